@@ -1,9 +1,16 @@
 import jwt
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import User, get_db
+from constants import AUTH_CACHE_TTL, AUTH_CACHE_SIZE, AUTH_SHARED_PATH
+from profiling import span
 
 # JWT configuration
 JWT_SECRET_KEY = 'your-secret-key-change-in-production'  # Change this in production!
@@ -32,22 +39,184 @@ def verify_token(token: str):
     except jwt.InvalidTokenError:
         return None
 
+class TTLCache:
+    """LRU mapping whose entries also expire, each at its own deadline"""
+    
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+    
+    def set(self, key, value, ttl=None):
+        self.entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+    
+    def pop(self, key):
+        self.entries.pop(key, None)
+    
+    def clear(self):
+        self.entries.clear()
+    
+    def stats(self):
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+class Principal:
+    """The authenticated user's identity and permissions, detached from any session"""
+    
+    __slots__ = ('id', 'username', 'email', 'role', 'is_active', 'created_at')
+    
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.email = user.email
+        self.role = user.role
+        self.is_active = user.is_active
+        self.created_at = user.created_at
+    
+    to_dict = User.to_dict
+
+class Invalidations:
+    """Users whose cached principals went stale, shared by all workers in one SQLite file.
+
+    invalidate_user appends a row after the change commits. Before serving
+    a cached principal a worker checks PRAGMA data_version, which only
+    changes when another connection has written to the file, and drops
+    the principals of any users appended since its last check. Rows are
+    kept for twice AUTH_CACHE_TTL; a worker that missed some clears its
+    whole cache. Without a path, other workers rely on AUTH_CACHE_TTL;
+    while the file cannot be read, principals are not cached.
+    """
+
+    def __init__(self, path, retention):
+        self.path = path
+        self.retention = retention
+        self.conn = None  # opened on first use, so importing this module creates no file
+        self.seq = 0
+        self.version = None
+
+    def _conn(self):
+        if self.conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS auth_invalidations ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            # nothing is cached yet, so earlier invalidations do not apply
+            self.seq = conn.execute(
+                "SELECT coalesce(max(seq), 0) FROM sqlite_sequence WHERE name = 'auth_invalidations'"
+            ).fetchone()[0]
+            self.version = conn.execute("PRAGMA data_version").fetchone()[0]
+            self.conn = conn
+        return self.conn
+
+    def publish(self, user_id):
+        if not self.path:
+            return
+        try:
+            conn = self._conn()
+            now = time.time()
+            conn.execute("INSERT INTO auth_invalidations (user_id, created_at) VALUES (?, ?)", (user_id, now))
+            conn.execute("DELETE FROM auth_invalidations WHERE created_at < ?", (now - self.retention,))
+        except sqlite3.Error as e:
+            logging.error(f"Error sharing auth cache invalidation: {e}")
+
+    def sync(self, cache):
+        """Drop principals invalidated by other workers; False if the cache cannot be trusted"""
+        if not self.path:
+            return True
+        try:
+            conn = self._conn()
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if version == self.version:
+                return True
+            rows = conn.execute(
+                "SELECT seq, user_id FROM auth_invalidations WHERE seq > ? ORDER BY seq", (self.seq,)
+            ).fetchall()
+            last = conn.execute(
+                "SELECT coalesce(max(seq), 0) FROM sqlite_sequence WHERE name = 'auth_invalidations'"
+            ).fetchone()[0]
+        except sqlite3.Error as e:
+            logging.error(f"Error reading auth cache invalidations: {e}")
+            cache.clear()
+            return False
+        if len(rows) < last - self.seq:
+            cache.clear()  # some were pruned before this worker saw them
+        else:
+            for _, user_id in rows:
+                cache.pop(user_id)
+        self.seq = max(self.seq, last)
+        self.version = version
+        return True
+
+# Decoded token payloads live until the token expires; principals live for
+# AUTH_CACHE_TTL seconds or until invalidate_user is called for them on any worker
+token_cache = TTLCache(AUTH_CACHE_SIZE, JWT_EXPIRATION_DELTA.total_seconds())
+principal_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+invalidations = Invalidations(AUTH_SHARED_PATH, 2 * AUTH_CACHE_TTL)
+
+def invalidate_user(user_id):
+    """Forget a cached principal after its role or status change has committed.
+
+    Clears this worker's cache at once and other workers' caches on their
+    next authenticated request.
+    """
+    principal_cache.pop(user_id)
+    if AUTH_CACHE_TTL > 0:
+        invalidations.publish(user_id)
+
+def decode_cached(token: str):
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = verify_token(token)
+        if payload:
+            token_cache.set(token, payload, payload['exp'] - time.time())
+    return payload
+
+async def load_principal(db: AsyncSession, user_id: str):
+    trusted = AUTH_CACHE_TTL > 0 and invalidations.sync(principal_cache)
+    principal = principal_cache.get(user_id) if trusted else None
+    if principal is None:
+        user = await db.scalar(select(User).where(User.id == user_id))
+        if user is None:
+            return None
+        principal = Principal(user)
+        if trusted:
+            principal_cache.set(user_id, principal)
+    return principal
+
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
+    db: AsyncSession = Depends(get_db)
+) -> Principal:
     """Get current user from JWT token"""
     token = credentials.credentials
-    payload = verify_token(token)
-    
-    if not payload:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    
-    user = db.query(User).filter(User.id == payload['user_id']).first()
+    with span('auth'):
+        payload = decode_cached(token)
+        
+        if not payload:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid authentication credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        
+        user = await load_principal(db, payload['user_id'])
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
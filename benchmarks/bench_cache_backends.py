@@ -0,0 +1,131 @@
+"""Hit-rate and latency comparison of the SimHash and embedding cache backends.
+
+Each base prompt is cached, then queried with a paraphrase (should hit) and
+with an unrelated prompt that shares most of its words (should miss).
+
+    python benchmarks/bench_cache_backends.py [--backends simhash embedding]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from caching import CacheManager, EmbeddingCacheManager
+
+# (cached prompt, paraphrase, unrelated prompt with overlapping words)
+PROMPTS = [
+    ("What is the capital of France?",
+     "Which city is the capital of France?",
+     "What is the capital gains tax in France?"),
+    ("How do I reverse a list in Python?",
+     "What's the way to reverse a Python list?",
+     "How do I sort a list in Python?"),
+    ("Explain how photosynthesis works",
+     "Can you describe the process of photosynthesis?",
+     "Explain how nuclear fusion works"),
+    ("What are the health benefits of green tea?",
+     "Why is green tea good for your health?",
+     "What are the health risks of energy drinks?"),
+    ("How do I make a cup of coffee with a French press?",
+     "What's the method for brewing coffee in a French press?",
+     "How do I make a cup of tea with a kettle?"),
+    ("Give me tips for improving my sleep",
+     "How can I sleep better at night?",
+     "Give me tips for improving my resume"),
+    ("What causes the seasons on Earth?",
+     "Why does Earth have seasons?",
+     "What causes the tides on Earth?"),
+    ("How do vaccines work?",
+     "Explain how a vaccine protects you",
+     "How do batteries work?"),
+    ("Write a haiku about autumn leaves",
+     "Compose a haiku on falling autumn leaves",
+     "Write a limerick about autumn leaves"),
+    ("What is the difference between TCP and UDP?",
+     "How does TCP differ from UDP?",
+     "What is the difference between HTTP and HTTPS?"),
+    ("How many legs does a spider have?",
+     "What is the number of legs on a spider?",
+     "How many eyes does a spider have?"),
+    ("Recommend a good science fiction book",
+     "Can you suggest a great sci-fi novel?",
+     "Recommend a good science museum"),
+    ("How do I center a div in CSS?",
+     "What's the CSS to center a div element?",
+     "How do I hide a div in CSS?"),
+    ("What is the boiling point of water?",
+     "At what temperature does water boil?",
+     "What is the freezing point of water?"),
+    ("Summarize the plot of Romeo and Juliet",
+     "Give me a summary of Romeo and Juliet's story",
+     "Summarize the plot of Hamlet"),
+    ("How can I lower my cholesterol naturally?",
+     "What are natural ways to reduce cholesterol?",
+     "How can I lower my electricity bill?"),
+]
+
+
+def build_backend(name, size):
+    if name == 'simhash':
+        return CacheManager(size)
+    return EmbeddingCacheManager(size)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run(name, size):
+    cache = build_backend(name, size)
+
+    set_us = []
+    for i, (prompt, _, _) in enumerate(PROMPTS):
+        start = time.perf_counter()
+        cache.set(prompt, i)
+        set_us.append((time.perf_counter() - start) * 1e6)
+
+    get_us = []
+    paraphrase_hits = 0
+    false_hits = 0
+    for i, (_, paraphrase, unrelated) in enumerate(PROMPTS):
+        start = time.perf_counter()
+        paraphrase_hits += cache.get(paraphrase) == i
+        get_us.append((time.perf_counter() - start) * 1e6)
+
+        start = time.perf_counter()
+        false_hits += cache.get(unrelated) is not None
+        get_us.append((time.perf_counter() - start) * 1e6)
+
+    return {
+        'backend': name,
+        'paraphrase_hit_rate': paraphrase_hits / len(PROMPTS),
+        'false_hit_rate': false_hits / len(PROMPTS),
+        'set_p50_us': statistics.median(set_us),
+        'get_p50_us': statistics.median(get_us),
+        'get_p99_us': percentile(get_us, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backends', nargs='+', default=['simhash', 'embedding'])
+    parser.add_argument('--size', type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'backend':>10} {'para hit':>9} {'false hit':>10} {'set p50 us':>11} {'get p50 us':>11} {'get p99 us':>11}")
+    for name in args.backends:
+        try:
+            result = run(name, args.size)
+        except ImportError as e:
+            print(f"{name:>10} skipped: {e}")
+            continue
+        print(f"{result['backend']:>10} {result['paraphrase_hit_rate']:>9.2f} {result['false_hit_rate']:>10.2f} "
+              f"{result['set_p50_us']:>11.1f} {result['get_p50_us']:>11.1f} {result['get_p99_us']:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
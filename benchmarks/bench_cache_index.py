@@ -0,0 +1,86 @@
+"""Size-scaling benchmark for the SimHash cache lookup.
+
+Compares the indexed LFUCache.check_cache against the previous linear scan
+over every cached fingerprint, for growing cache sizes.
+
+    python benchmarks/bench_cache_index.py [--sizes 100 1000 10000 100000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from caching import LFUCache, FINGERPRINT_BITS, hamming_distance, max_distance_for, SIMILARITY_THRESHOLD
+
+
+def linear_nearest(keys, key, max_distance):
+    best_key, best_distance = None, None
+    for cached_key in keys:
+        distance = hamming_distance(cached_key, key)
+        if best_distance is None or distance < best_distance:
+            best_key, best_distance = cached_key, distance
+    if best_distance is None or best_distance > max_distance:
+        return None, None
+    return best_key, best_distance
+
+
+def flip_bits(key, count, rng):
+    for bit in rng.sample(range(FINGERPRINT_BITS), count):
+        key ^= 1 << bit
+    return key
+
+
+def make_queries(keys, count, rng):
+    # half near-duplicates of cached prompts (hits), half unrelated prompts (misses)
+    queries = []
+    for i in range(count):
+        if i % 2 == 0:
+            queries.append(flip_bits(rng.choice(keys), rng.randint(0, 10), rng))
+        else:
+            queries.append(rng.getrandbits(FINGERPRINT_BITS))
+    return queries
+
+
+def time_per_call(fn, queries):
+    start = time.perf_counter()
+    for query in queries:
+        fn(query)
+    return (time.perf_counter() - start) / len(queries) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=18)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    max_distance = max_distance_for(SIMILARITY_THRESHOLD)
+
+    print(f"{'size':>8} {'linear us':>12} {'indexed us':>12} {'speedup':>9} {'hit rate':>9}")
+    for size in args.sizes:
+        cache = LFUCache(size)
+        keys = [rng.getrandbits(FINGERPRINT_BITS) for _ in range(size)]
+        for key in keys:
+            cache.add_cache(key, key)
+        queries = make_queries(keys, args.queries, rng)
+
+        # both strategies must agree on the distance of the match they find
+        hits = 0
+        for query in queries:
+            expected = linear_nearest(cache.cache, query, max_distance)[1]
+            found = cache.index.nearest(query, max_distance)[1]
+            assert expected == found, (query, expected, found)
+            hits += found is not None
+
+        linear_us = time_per_call(lambda q: linear_nearest(cache.cache, q, max_distance), queries)
+        indexed_us = time_per_call(cache.check_cache, queries)
+        print(f"{size:>8} {linear_us:>12.1f} {indexed_us:>12.1f} {linear_us / indexed_us:>8.1f}x {hits / len(queries):>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
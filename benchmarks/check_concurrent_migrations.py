@@ -0,0 +1,125 @@
+"""Multi-process startup check for the schema migrations.
+
+Starts several processes that run init_db() against the same SQLite file
+at the same moment, as uvicorn workers do, and fails if any of them
+crashes or the schema ends up other than fully migrated. Each round runs
+on a new copy of the starting database: by default one database without
+any tables and one with the schema from before the migrations existed;
+with --database, a copy of that file.
+
+    python benchmarks/check_concurrent_migrations.py [--workers 8] [--rounds 10] [--database chat_app.db]
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, inspect, text
+
+from migrations import MIGRATIONS, migrate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# each worker sleeps until the same start time, then runs the startup migration
+WORKER = """
+import sys, time
+sys.path.insert(0, {root!r})
+from models import init_db
+time.sleep(max({start!r} - time.time(), 0))
+init_db()
+"""
+
+
+def legacy_database(path):
+    """A database with the schema from before versioned migrations"""
+    engine = create_engine(f"sqlite:///{path}")
+    migrate(engine)
+    with engine.begin() as connection:
+        connection.execute(text('DROP TABLE schema_version'))
+        connection.execute(text('DROP TABLE log_rollups'))
+        for index in inspect(connection).get_indexes('chat_threads'):
+            connection.execute(text(f"DROP INDEX {index['name']}"))
+        connection.execute(text('ALTER TABLE chat_threads DROP COLUMN message_count'))
+        connection.execute(text('ALTER TABLE chat_threads DROP COLUMN last_message'))
+    engine.dispose()
+
+
+def problems(path):
+    """Ways the database differs from a fully migrated one"""
+    engine = create_engine(f"sqlite:///{path}")
+    found = []
+    with engine.connect() as connection:
+        schema = inspect(connection)
+        if not schema.has_table('schema_version'):
+            return ['no schema_version table']
+        versions = [row[0] for row in connection.execute(text('SELECT version FROM schema_version ORDER BY version'))]
+        if versions != [version for version, _, _ in MIGRATIONS]:
+            found.append(f"schema versions {versions}")
+        if not schema.has_table('log_rollups'):
+            found.append('no log_rollups table')
+        if 'message_count' not in {column['name'] for column in schema.get_columns('chat_threads')}:
+            found.append('no chat_threads.message_count')
+    engine.dispose()
+    return found
+
+
+def start_workers(path, count):
+    env = {**os.environ, 'DATABASE_URL': f"sqlite:///{path}"}
+    env.pop('ASYNC_DATABASE_URL', None)
+    script = WORKER.format(root=ROOT, start=time.time() + 1.0)
+    workers = [
+        subprocess.Popen([sys.executable, '-c', script], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        for _ in range(count)
+    ]
+    failures = []
+    for worker in workers:
+        _, stderr = worker.communicate()
+        if worker.returncode:
+            # the exception line, not SQLAlchemy's trailing link
+            errors = [line for line in stderr.splitlines() if 'Error' in line and not line.startswith(' ')]
+            failures.append(errors[-1] if errors else f"exit code {worker.returncode}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--database', help='start every round from a copy of this SQLite file')
+    args = parser.parse_args()
+
+    failed = 0
+    with tempfile.TemporaryDirectory() as directory:
+        sources = {}
+        if args.database:
+            sources[os.path.basename(args.database)] = args.database
+        else:
+            sources['empty'] = None
+            sources['legacy'] = os.path.join(directory, 'legacy.db')
+            legacy_database(sources['legacy'])
+
+        for name, source in sources.items():
+            for round_ in range(args.rounds):
+                path = os.path.join(directory, f"{name}-{round_}.db")
+                if source:
+                    shutil.copy(source, path)
+                crashes = start_workers(path, args.workers)
+                bad = crashes + problems(path)
+                failed += bool(bad)
+                print(f"{'FAIL' if bad else 'ok':4}  {name}, round {round_ + 1}: "
+                      f"{args.workers - len(crashes)}/{args.workers} workers started")
+                for line in bad:
+                    print(f"      {line}")
+
+    if failed:
+        print(f"\n{failed} round{'' if failed == 1 else 's'} failed")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Query-plan check for the hot listing and lookup queries.
+
+Builds a throwaway SQLite database through the schema migrations, runs
+EXPLAIN QUERY PLAN on the queries the API issues on every page load and
+fails if any of them scans a whole table or sorts in a temporary B-tree
+instead of reading an index in order.
+
+    python benchmarks/check_query_plans.py [--verbose]
+"""
+import argparse
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.dialects import sqlite
+
+from migrations import migrate
+from models import User, ChatThread, ChatMessage, APIKey, Log, LogRollup
+from pagination import keyset, encode_cursor
+
+MOMENT = datetime(2024, 1, 1, 12, 0, 0)
+CURSOR = encode_cursor(MOMENT, '00000000-0000-0000-0000-000000000000')
+USER_ID = '11111111-1111-1111-1111-111111111111'
+
+
+def hot_queries():
+    """(name, statement) pairs mirroring the queries in main.py, context.py and logger.py"""
+    threads = select(ChatThread).where(ChatThread.user_id == USER_ID)
+    messages = select(ChatMessage).where(ChatMessage.thread_id == USER_ID)
+    return [
+        ('thread list', keyset(threads, ChatThread.updated_at, ChatThread.id, None, 50)),
+        ('thread list, next page', keyset(threads, ChatThread.updated_at, ChatThread.id, CURSOR, 50)),
+        ('message page', keyset(messages, ChatMessage.created_at, ChatMessage.id, CURSOR, 100)),
+        ('thread history', select(ChatMessage.role, ChatMessage.content)
+            .where(ChatMessage.thread_id == USER_ID)
+            .order_by(ChatMessage.created_at, ChatMessage.id)),
+        ('logs', keyset(select(Log), Log.created_at, Log.id, CURSOR, 100)),
+        ('logs by action', keyset(select(Log).where(Log.action == 'chat_request'), Log.created_at, Log.id, CURSOR, 100)),
+        ('logs by user', keyset(select(Log).where(Log.user_id == USER_ID), Log.created_at, Log.id, CURSOR, 100)),
+        ('hourly rollups', select(LogRollup.bucket, func.sum(LogRollup.count))
+            .where(LogRollup.bucket >= MOMENT)
+            .group_by(LogRollup.bucket)
+            .order_by(LogRollup.bucket)),
+        ('user by username', select(User).where(User.username == 'admin')),
+        ('api keys by user', select(APIKey).where(APIKey.user_id == USER_ID, APIKey.is_active == True)),
+    ]
+
+
+def problems(plan):
+    """Plan lines that read a table without an index or sort outside one"""
+    found = []
+    for line in plan:
+        if line.startswith('SCAN ') and ' USING ' not in line:
+            found.append(line)
+        elif 'USE TEMP B-TREE' in line:
+            found.append(line)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--verbose', action='store_true', help='print every plan')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'plans.db')}")
+        migrate(engine)
+        failures = 0
+        with engine.connect() as connection:
+            for name, statement in hot_queries():
+                sql = str(statement.compile(dialect=sqlite.dialect(), compile_kwargs={'literal_binds': True}))
+                plan = [row[-1] for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}')]
+                bad = problems(plan)
+                failures += bool(bad)
+                print(f"{'FAIL' if bad else 'ok':4}  {name}")
+                for line in (plan if args.verbose else bad):
+                    print(f"      {line}")
+        engine.dispose()
+
+    if failures:
+        print(f"\n{failures} quer{'y' if failures == 1 else 'ies'} without a usable index")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""Stand-in Ollama server for load tests.
+
+Serves /api/chat and /api/generate, streamed or not, in the wire format the
+ollama client expects, without running a model. Timing is simulated: a
+fixed first-token latency, prompt evaluation at a given token rate (only
+the new prompt counts when a request continues from a saved `context`),
+then generation at a given token rate. A share of requests can fail, and
+concurrent generations can be capped like OLLAMA_NUM_PARALLEL.
+
+    python benchmarks/fake_ollama.py [--port 11434] [--latency-ms 50] [--tokens-per-sec 200]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+CHARS_PER_TOKEN = 4
+WORDS = (
+    "the model considers your question and answers it with a short and plausible "
+    "reply that is long enough to exercise streaming caching and storage paths"
+).split()
+
+
+class Settings:
+    latency = 0.05
+    tokens_per_sec = 200.0
+    prompt_tokens_per_sec = 0.0  # 0: prompt evaluation is free
+    answer_tokens = 48
+    error_rate = 0.0
+    parallel = 0  # 0: unlimited
+
+
+settings = Settings()
+app = FastAPI(title="Fake Ollama")
+stats = {'requests': 0, 'errors': 0, 'streams': 0, 'active': 0, 'max_active': 0, 'prompt_tokens': 0}
+slots = None
+rng = random.Random(18)
+
+
+def count_tokens(text):
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def answer_tokens(prompt):
+    # deterministic per prompt, so repeated prompts produce identical answers
+    local = random.Random(prompt)
+    count = max(1, int(local.gauss(settings.answer_tokens, settings.answer_tokens / 4)))
+    return [local.choice(WORDS) + ' ' for _ in range(count)]
+
+
+def timing_fields(prompt_tokens, tokens, prompt_seconds, started):
+    return {
+        'done': True,
+        'total_duration': int((time.perf_counter() - started) * 1e9),
+        'prompt_eval_count': prompt_tokens,
+        'prompt_eval_duration': int(prompt_seconds * 1e9),
+        'eval_count': len(tokens),
+        'eval_duration': int(len(tokens) / settings.tokens_per_sec * 1e9) if settings.tokens_per_sec else 0,
+    }
+
+
+async def generation(model, prompt_text, new_prompt_tokens, stream, chunk, final):
+    """Run one simulated generation; chunk(token) and final(tokens, fields) shape the response bodies"""
+    stats['requests'] += 1
+    if rng.random() < settings.error_rate:
+        stats['errors'] += 1
+        return JSONResponse({'error': 'simulated failure'}, status_code=500)
+
+    tokens = answer_tokens(prompt_text)
+    started = time.perf_counter()
+    prompt_seconds = new_prompt_tokens / settings.prompt_tokens_per_sec if settings.prompt_tokens_per_sec else 0.0
+    stats['prompt_tokens'] += new_prompt_tokens
+
+    async def run():
+        if slots is not None:
+            await slots.acquire()
+        stats['active'] += 1
+        stats['max_active'] = max(stats['max_active'], stats['active'])
+        try:
+            await asyncio.sleep(settings.latency + prompt_seconds)
+            delay = 1 / settings.tokens_per_sec if settings.tokens_per_sec else 0
+            for token in tokens:
+                if delay:
+                    await asyncio.sleep(delay)
+                yield token
+        finally:
+            stats['active'] -= 1
+            if slots is not None:
+                slots.release()
+
+    if not stream:
+        async for _ in run():
+            pass
+        return JSONResponse(final(tokens, timing_fields(new_prompt_tokens, tokens, prompt_seconds, started)))
+
+    stats['streams'] += 1
+
+    async def body():
+        async for token in run():
+            yield json.dumps(chunk(token)) + '\n'
+        yield json.dumps(final([], timing_fields(new_prompt_tokens, tokens, prompt_seconds, started))) + '\n'
+
+    return StreamingResponse(body(), media_type='application/x-ndjson')
+
+
+@app.post('/api/chat')
+async def chat(request: Request):
+    body = await request.json()
+    model, messages = body.get('model', ''), body.get('messages') or []
+    prompt_tokens = sum(count_tokens(m.get('content', '')) for m in messages)
+    last = messages[-1]['content'] if messages else ''
+
+    def chunk(token):
+        return {'model': model, 'message': {'role': 'assistant', 'content': token}, 'done': False}
+
+    def final(tokens, fields):
+        return {'model': model, 'message': {'role': 'assistant', 'content': ''.join(tokens)}, **fields}
+
+    return await generation(model, last, prompt_tokens, body.get('stream', True), chunk, final)
+
+
+@app.post('/api/generate')
+async def generate(request: Request):
+    body = await request.json()
+    model, prompt, system = body.get('model', ''), body.get('prompt', ''), body.get('system', '')
+    context = body.get('context') or []
+    # a saved context is already evaluated; only the new prompt (and a new system prompt) costs time
+    prompt_tokens = count_tokens(prompt) + (count_tokens(system) if system else 0)
+
+    def chunk(token):
+        return {'model': model, 'response': token, 'done': False}
+
+    def final(tokens, fields):
+        answer = ''.join(tokens)
+        new_context = list(context) + list(range(len(context), len(context) + prompt_tokens + len(tokens)))
+        return {'model': model, 'response': answer, 'context': new_context, **fields}
+
+    return await generation(model, prompt, prompt_tokens, body.get('stream', True), chunk, final)
+
+
+@app.get('/api/tags')
+async def tags():
+    return {'models': []}
+
+
+@app.get('/stats')
+async def get_stats():
+    return stats
+
+
+@app.get('/')
+async def root():
+    return 'Ollama is running'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--latency-ms', type=float, default=50, help='delay before the first token')
+    parser.add_argument('--tokens-per-sec', type=float, default=200, help='generation speed (0: instant)')
+    parser.add_argument('--prompt-tokens-per-sec', type=float, default=0, help='prompt evaluation speed (0: free)')
+    parser.add_argument('--answer-tokens', type=int, default=48, help='mean answer length')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with HTTP 500')
+    parser.add_argument('--parallel', type=int, default=0, help='concurrent generations (0: unlimited)')
+    parser.add_argument('--seed', type=int, default=18)
+    args = parser.parse_args()
+
+    settings.latency = args.latency_ms / 1000
+    settings.tokens_per_sec = args.tokens_per_sec
+    settings.prompt_tokens_per_sec = args.prompt_tokens_per_sec
+    settings.answer_tokens = args.answer_tokens
+    settings.error_rate = args.error_rate
+    settings.parallel = args.parallel
+    rng.seed(args.seed)
+
+    import uvicorn
+
+    @app.on_event('startup')
+    async def create_slots():
+        global slots
+        slots = asyncio.Semaphore(args.parallel) if args.parallel else None
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
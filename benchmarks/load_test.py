@@ -0,0 +1,377 @@
+"""End-to-end load test of the API against a fake Ollama server.
+
+Starts benchmarks/fake_ollama.py and the app (uvicorn, on a throwaway
+SQLite database) as subprocesses, registers a set of users, then has each
+of them replay a chat workload for a fixed time: new threads, follow-ups in
+their own threads, prompts from a small shared pool (response cache hits),
+streamed chats and history reads. Reports requests, errors, throughput and
+latency percentiles per endpoint and writes them to JSON. With --baseline
+the run fails if any endpoint's p50, p99 or throughput is worse than in
+the baseline run by more than --tolerance.
+
+    python benchmarks/load_test.py [--users 20] [--duration 30] [--workers 1] [--output load.json]
+    python benchmarks/load_test.py --baseline load.json --tolerance 0.25
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TOPICS = ['python', 'databases', 'gardening', 'astronomy', 'cooking', 'history', 'music', 'networking']
+TEMPLATES = [
+    "Can you explain the basics of {topic}?",
+    "What is a common mistake people make with {topic}?",
+    "Give me three tips about {topic}.",
+    "How would you teach {topic} to a beginner?",
+    "Summarize the most important ideas in {topic}.",
+]
+FIRST_TOKEN = 'chat_stream_first_token'
+FOLLOW_UPS = ["Can you expand on that?", "Why is that?", "Give me an example.", "And what about the opposite case?"]
+
+# relative weights of the actions a virtual user picks from
+WORKLOAD = {
+    'chat_new': 3,
+    'chat_continue': 4,
+    'chat_repeat': 3,
+    'chat_stream': 2,
+    'list_threads': 1,
+    'get_thread': 1,
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(q * len(values))) - 1))]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, endpoint, seconds, ok, status=None):
+        if ok:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+        else:
+            codes = self.errors.setdefault(endpoint, {})
+            codes[str(status)] = codes.get(str(status), 0) + 1
+
+    def summary(self, duration):
+        endpoints = {}
+        for endpoint in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies.get(endpoint, []))
+            errors = self.errors.get(endpoint, {})
+            endpoints[endpoint] = summarize(values, sum(errors.values()), duration, errors)
+        # first-token times are a second view of the streamed requests, not requests of their own
+        values = sorted(v for endpoint, latencies in self.latencies.items() if endpoint != FIRST_TOKEN for v in latencies)
+        errors = sum(sum(codes.values()) for codes in self.errors.values())
+        return endpoints, summarize(values, errors, duration)
+
+
+def summarize(values, errors, duration, codes=None):
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    result = {
+        'requests': len(values) + errors,
+        'errors': errors,
+        'throughput_rps': round(len(values) / duration, 2),
+        'mean_ms': ms(sum(values) / len(values)) if values else None,
+        'p50_ms': ms(percentile(values, 0.5)),
+        'p95_ms': ms(percentile(values, 0.95)),
+        'p99_ms': ms(percentile(values, 0.99)),
+        'max_ms': ms(values[-1]) if values else None,
+    }
+    if codes:
+        result['error_codes'] = codes
+    return result
+
+
+class VirtualUser:
+    def __init__(self, client, token, recorder, rng, repeat_pool, think):
+        self.client = client
+        self.headers = {'Authorization': f'Bearer {token}'}
+        self.recorder = recorder
+        self.rng = rng
+        self.repeat_pool = repeat_pool
+        self.think = think
+        self.threads = []
+
+    def new_prompt(self):
+        return self.rng.choice(TEMPLATES).format(topic=self.rng.choice(TOPICS)) + f" ({self.rng.getrandbits(32):x})"
+
+    async def call(self, endpoint, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, headers=self.headers, **kwargs)
+        except httpx.HTTPError:
+            self.recorder.record(endpoint, 0, False, 'connection')
+            return None
+        ok = response.status_code < 400
+        self.recorder.record(endpoint, time.perf_counter() - started, ok, response.status_code)
+        return response.json() if ok else None
+
+    async def chat(self, endpoint, prompt, thread_id=None):
+        result = await self.call(endpoint, 'POST', '/api/chat', json={'prompt': prompt, 'thread_id': thread_id})
+        if result and not thread_id:
+            self.threads.append(result['thread_id'])
+
+    async def stream(self, prompt, thread_id=None):
+        started = time.perf_counter()
+        first = event = status = None
+        try:
+            async with self.client.stream(
+                'POST', '/api/chat/stream', json={'prompt': prompt, 'thread_id': thread_id}, headers=self.headers
+            ) as response:
+                status = response.status_code
+                async for line in response.aiter_lines():
+                    if line.startswith('event: '):
+                        event = line[len('event: '):]
+                        if event == 'token' and first is None:
+                            first = time.perf_counter() - started
+                        elif event == 'error':
+                            status = 'stream_error'
+                    elif line.startswith('data: ') and event == 'done' and not thread_id:
+                        self.threads.append(json.loads(line[len('data: '):])['thread_id'])
+        except httpx.HTTPError:
+            status = 'connection'
+        ok = status == 200
+        self.recorder.record('chat_stream', time.perf_counter() - started, ok, status)
+        if ok and first is not None:
+            self.recorder.record(FIRST_TOKEN, first, True)
+
+    async def step(self):
+        action = self.rng.choices(list(WORKLOAD), weights=list(WORKLOAD.values()))[0]
+        if action in ('chat_continue', 'get_thread') and not self.threads:
+            action = 'chat_new'
+        if action == 'chat_new':
+            await self.chat('chat_new', self.new_prompt())
+        elif action == 'chat_continue':
+            await self.chat('chat_continue', self.rng.choice(FOLLOW_UPS), self.rng.choice(self.threads))
+        elif action == 'chat_repeat':
+            await self.chat('chat_repeat', self.rng.choice(self.repeat_pool))
+        elif action == 'chat_stream':
+            thread_id = self.rng.choice(self.threads) if self.threads and self.rng.random() < 0.5 else None
+            await self.stream(self.rng.choice(FOLLOW_UPS) if thread_id else self.new_prompt(), thread_id)
+        elif action == 'list_threads':
+            await self.call('list_threads', 'GET', '/api/chat/threads', params={'limit': 20})
+        else:
+            await self.call('get_thread', 'GET', f'/api/chat/threads/{self.rng.choice(self.threads)}')
+        if self.think:
+            await asyncio.sleep(self.rng.expovariate(1 / self.think))
+
+    async def run(self, deadline):
+        while time.perf_counter() < deadline:
+            await self.step()
+
+
+def start(command, env=None):
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+async def wait_ready(url, process, timeout=60):
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.perf_counter() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{url} exited: {process.stderr.read().decode()[-2000:]}")
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready in {timeout}s")
+
+
+async def register_users(client, count, prefix):
+    slots = asyncio.Semaphore(4)  # password hashing is deliberately slow; stay under the hasher's queue
+
+    async def register(i):
+        user = {'username': f'{prefix}{i}', 'email': f'{prefix}{i}@example.com', 'password': 'load-test-password'}
+        async with slots:
+            await client.post('/api/auth/register', json=user)
+            response = await client.post('/api/auth/login', json={
+                'username': user['username'], 'password': user['password']
+            })
+        response.raise_for_status()
+        return response.json()['token']
+
+    return await asyncio.gather(*(register(i) for i in range(count)))
+
+
+async def run(args, base_url, ollama_url):
+    rng = random.Random(args.seed)
+    repeat_pool = [TEMPLATES[i % len(TEMPLATES)].format(topic=TOPICS[i % len(TOPICS)]) for i in range(args.repeat_pool)]
+    limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        tokens = await register_users(client, args.users, f'load{rng.getrandbits(24):x}-')
+        recorder = Recorder()
+        users = [
+            VirtualUser(client, token, recorder, random.Random(args.seed + i), repeat_pool, args.think_ms / 1000)
+            for i, token in enumerate(tokens)
+        ]
+
+        if args.warmup:
+            await asyncio.gather(*(user.run(time.perf_counter() + args.warmup) for user in users))
+            recorder.latencies, recorder.errors = {}, {}
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user.run(started + args.duration) for user in users))
+        duration = time.perf_counter() - started
+        endpoints, total = recorder.summary(duration)
+
+        admin = await client.post('/api/auth/login', json={'username': 'admin', 'password': 'admin123'})
+        headers = {'Authorization': f"Bearer {admin.json()['token']}"}
+        cache = (await client.get('/api/admin/cache/stats', headers=headers)).json()
+    async with httpx.AsyncClient(base_url=ollama_url) as client:
+        ollama = (await client.get('/stats')).json()
+
+    return {
+        'duration_s': round(duration, 2),
+        'endpoints': endpoints,
+        'total': total,
+        'server': {
+            'cache_hit_ratio': cache.get('hit_ratio'),
+            'cache_entries': cache.get('entries'),
+            'ollama_requests': ollama['requests'],
+            'ollama_errors': ollama['errors'],
+            'ollama_max_concurrent': ollama['max_active'],
+            'ollama_prompt_tokens': ollama['prompt_tokens'],
+        }
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return the regressions of results against baseline, per endpoint"""
+    regressions = []
+    for endpoint, current in results['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(endpoint)
+        if not previous:
+            continue
+        for key in ('p50_ms', 'p99_ms'):
+            if previous[key] and current[key] and current[key] > previous[key] * (1 + tolerance):
+                regressions.append(f"{endpoint} {key}: {previous[key]} -> {current[key]}")
+        if previous['throughput_rps'] and current['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{endpoint} throughput_rps: {previous['throughput_rps']} -> {current['throughput_rps']}")
+    return regressions
+
+
+def print_table(results):
+    print(f"{'endpoint':<26} {'requests':>9} {'errors':>7} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    rows = list(results['endpoints'].items()) + [('total', results['total'])]
+    for endpoint, row in rows:
+        print(f"{endpoint:<26} {row['requests']:>9} {row['errors']:>7} {row['throughput_rps']:>8} "
+              f"{row['p50_ms'] or '-':>9} {row['p95_ms'] or '-':>9} {row['p99_ms'] or '-':>9}")
+    print(json.dumps(results['server']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of measured load')
+    parser.add_argument('--warmup', type=float, default=3, help='seconds of unmeasured load first')
+    parser.add_argument('--think-ms', type=float, default=0, help='mean pause between a user\'s requests')
+    parser.add_argument('--repeat-pool', type=int, default=20, help='shared prompts that should hit the cache')
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn worker processes')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--seed', type=int, default=18)
+    parser.add_argument('--latency-ms', type=float, default=50, help='fake Ollama first-token delay')
+    parser.add_argument('--tokens-per-sec', type=float, default=400, help='fake Ollama generation speed')
+    parser.add_argument('--prompt-tokens-per-sec', type=float, default=0, help='fake Ollama prompt evaluation speed')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of failing Ollama calls')
+    parser.add_argument('--parallel', type=int, default=0, help='fake Ollama concurrent generations (0: unlimited)')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE', help='extra app setting')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative regression')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        ollama_port, app_port = free_port(), free_port()
+        ollama = start([
+            sys.executable, os.path.join(ROOT, 'benchmarks', 'fake_ollama.py'), '--port', str(ollama_port),
+            '--latency-ms', str(args.latency_ms), '--tokens-per-sec', str(args.tokens_per_sec),
+            '--prompt-tokens-per-sec', str(args.prompt_tokens_per_sec), '--error-rate', str(args.error_rate),
+            '--parallel', str(args.parallel), '--seed', str(args.seed)
+        ])
+        env = {
+            **os.environ,
+            'DATABASE_URL': f"sqlite:///{os.path.join(directory, 'load.db')}",
+            'OLLAMA_HOST': f'http://127.0.0.1:{ollama_port}',
+            'CACHE_PERSIST_PATH': '',
+            'CACHE_SHARED_PATH': os.path.join(directory, 'shared_cache.db'),
+            'METRICS_SHARED_PATH': os.path.join(directory, 'metrics.db'),
+        }
+        env.update(item.split('=', 1) for item in args.env)
+        app = start([
+            sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(app_port),
+            '--workers', str(args.workers), '--log-level', 'warning'
+        ], env=env)
+        try:
+            base_url, ollama_url = f'http://127.0.0.1:{app_port}', f'http://127.0.0.1:{ollama_port}'
+            asyncio.run(wait_ready(ollama_url + '/', ollama))
+            asyncio.run(wait_ready(base_url + '/health', app))
+            results = asyncio.run(run(args, base_url, ollama_url))
+        finally:
+            for process in (app, ollama):
+                process.terminate()
+                try:
+                    process.wait(10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'python': platform.python_version(),
+            'settings': vars(args),
+        },
+        **results
+    }
+    print_table(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+"""Microbenchmarks for the response cache, SimHash, serialization and history queries.
+
+Times the operations on the chat hot path in isolation:
+- CacheManager.get and .set across cache sizes, and get across prompt lengths
+- SimHash fingerprinting across prompt lengths
+- to_dict + JSON encoding of large threads and of admin log pages
+- the thread history query (context.thread_context) on threads of growing length
+
+For every series it fits how the time per call grows with the varied
+parameter (the exponent k in time ~ n^k over the larger half of the points)
+and warns when that is worse than the operation is designed for, e.g. a
+cache lookup growing linearly with the number of cached entries. Caches
+are filled with random fingerprints, so sizes up to a million entries take
+seconds rather than hashing a million prompts.
+
+    python benchmarks/microbench.py [--quick] [--only cache simhash serialize history] [--output micro.json]
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simhash import Simhash
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import selectinload
+
+from caching import CacheManager, FINGERPRINT_BITS
+from migrations import migrate
+from models import User, ChatThread, ChatMessage, Log
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORDS = (
+    "how what why explain the a of to in python database cache thread model answer question "
+    "performance memory latency index query server request token stream history context user"
+).split()
+
+# largest growth exponent each series is designed for
+EXPECTED = {
+    'cache_get/size': 0.5,       # indexed lookup, sublinear in the number of entries
+    'cache_set/size': 0.5,       # O(1) insert and LFU eviction
+    'cache_get/prompt_chars': 1.2,
+    'simhash/prompt_chars': 1.2,
+    'serialize_thread/messages': 1.2,
+    'serialize_logs/page_size': 1.2,
+    'history_query/messages': 1.2,  # index range scan, independent of other threads
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_prompt(rng, chars):
+    words = []
+    length = 0
+    while length < chars:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:chars]
+
+
+def measure(call, batches, budget):
+    """Run call over each batch of inputs in turn; return per-call seconds (median, min) across batches.
+
+    Stops early once `budget` seconds have passed, after at least one batch.
+    """
+    per_call = []
+    started = time.perf_counter()
+    for batch in batches:
+        t = time.perf_counter()
+        for item in batch:
+            call(item)
+        per_call.append((time.perf_counter() - t) / len(batch))
+        if time.perf_counter() - started > budget:
+            break
+    return statistics.median(per_call), min(per_call)
+
+
+def result(series, value, median, best, extra=None):
+    row = {
+        'series': series,
+        'n': value,
+        'median_us': round(median * 1e6, 3),
+        'min_us': round(best * 1e6, 3),
+        'ops_per_sec': round(1 / median, 1) if median else None,
+    }
+    row.update(extra or {})
+    print(f"{series:<28} {value:>9} {row['median_us']:>14.3f} {row['ops_per_sec'] or 0:>14.1f}")
+    return row
+
+
+def fill(manager, size, rng):
+    # random fingerprints stand in for hashed prompts; only the index shape matters
+    for _ in range(size):
+        key = rng.getrandbits(FINGERPRINT_BITS)
+        manager.lfu_cache.add_cache(('', key), 'cached answer', ('', key))
+
+
+def bench_cache(sizes, lengths, args, rng):
+    rows = []
+    queries = max(20, args.queries)
+    for size in sizes:
+        manager = CacheManager(size)
+        fill(manager, size, rng)
+        # half near-duplicates of cached prompts (hits), half new prompts (misses)
+        cached = [make_prompt(rng, 200) for _ in range(queries // 2)]
+        for prompt in cached:
+            manager.set(prompt, 'cached answer')
+        lookups = [prompt + '?' for prompt in cached] + [make_prompt(rng, 200) for _ in range(queries // 2)]
+        median, best = measure(manager.get, [lookups] * args.rounds, args.budget)
+        rows.append(result('cache_get/size', size, median, best))
+
+        writes = [[make_prompt(rng, 200) for _ in range(queries)] for _ in range(args.rounds)]
+        median, best = measure(lambda prompt: manager.set(prompt, 'new answer'), writes, args.budget)
+        rows.append(result('cache_set/size', size, median, best))
+
+    size = min(10000, max(sizes))
+    manager = CacheManager(size)
+    fill(manager, size, rng)
+    for chars in lengths:
+        lookups = [make_prompt(rng, chars) for _ in range(queries)]
+        median, best = measure(manager.get, [lookups] * args.rounds, args.budget)
+        rows.append(result('cache_get/prompt_chars', chars, median, best, {'cache_size': size}))
+    return rows
+
+
+def bench_simhash(lengths, args, rng):
+    rows = []
+    for chars in lengths:
+        prompts = [make_prompt(rng, chars) for _ in range(max(20, args.queries))]
+        median, best = measure(lambda prompt: Simhash(prompt).value, [prompts] * args.rounds, args.budget)
+        rows.append(result('simhash/prompt_chars', chars, median, best, {'mb_per_sec': round(chars / median / 1e6, 3)}))
+    return rows
+
+
+def populate(path, thread_sizes, log_count, rng):
+    """Build a migrated SQLite database with one thread per size plus unrelated traffic"""
+    engine = create_engine(f"sqlite:///{path}")
+    migrate(engine)
+    now = datetime(2024, 1, 1)
+    users = [{'id': str(uuid.uuid4()), 'username': f'user{i}', 'email': f'user{i}@example.com',
+              'password_hash': 'x', 'role': 'user', 'is_active': True, 'created_at': now} for i in range(20)]
+    threads, messages = [], []
+    # the measured threads share the table with many small ones
+    sizes = list(thread_sizes) + [20] * 500
+    for size in sizes:
+        thread_id = str(uuid.uuid4())
+        threads.append({'id': thread_id, 'user_id': rng.choice(users)['id'], 'title': 'bench', 'model_used': 'bench',
+                        'created_at': now, 'updated_at': now, 'message_count': size})
+        for i in range(size):
+            messages.append({'id': str(uuid.uuid4()), 'thread_id': thread_id, 'role': 'user' if i % 2 else 'assistant',
+                             'content': make_prompt(rng, 300), 'created_at': now + timedelta(seconds=i)})
+    logs = [{'id': str(uuid.uuid4()), 'user_id': rng.choice(users)['id'], 'action': 'chat_request',
+             'endpoint': '/api/chat', 'method': 'POST', 'status_code': 200,
+             'log_metadata': json.dumps({'model': 'bench', 'cached': False}), 'ip_address': '127.0.0.1',
+             'user_agent': 'microbench', 'created_at': now + timedelta(seconds=i)} for i in range(log_count)]
+    with engine.begin() as connection:
+        connection.execute(insert(User), users)
+        connection.execute(insert(ChatThread), threads)
+        connection.execute(insert(ChatMessage), messages)
+        connection.execute(insert(Log), logs)
+    engine.dispose()
+    return threads[:len(thread_sizes)]
+
+
+async def bench_database(thread_sizes, page_sizes, args, rng):
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'micro.db')
+        threads = populate(path, thread_sizes, max(page_sizes), rng)
+        engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        sessions = async_sessionmaker(engine, expire_on_commit=False)
+
+        async def timed(call):
+            """(median, min) seconds per awaited call over args.rounds rounds"""
+            samples = []
+            started = time.perf_counter()
+            for _ in range(args.rounds):
+                t = time.perf_counter()
+                await call()
+                samples.append(time.perf_counter() - t)
+                if time.perf_counter() - started > args.budget:
+                    break
+            return statistics.median(samples), min(samples)
+
+        async with sessions() as db:
+            for thread in threads:
+                # the query context.thread_context runs on a history cache miss
+                async def history():
+                    rows = await db.execute(
+                        select(ChatMessage.role, ChatMessage.content)
+                        .where(ChatMessage.thread_id == thread['id'])
+                        .order_by(ChatMessage.created_at, ChatMessage.id)
+                    )
+                    return [{'role': role, 'content': content} for role, content in rows]
+
+                median, best = await timed(history)
+                rows.append(result('history_query/messages', thread['message_count'], median, best))
+
+            for thread in threads:
+                loaded = await db.scalar(select(ChatThread).where(ChatThread.id == thread['id']))
+                messages = list(await db.scalars(
+                    select(ChatMessage).where(ChatMessage.thread_id == thread['id']).order_by(ChatMessage.created_at)
+                ))
+
+                def serialize():
+                    payload = loaded.to_dict()
+                    payload['messages'] = [message.to_dict() for message in messages]
+                    return json.dumps(payload)
+
+                median, best = measure(lambda _: serialize(), [[None]] * args.rounds, args.budget)
+                rows.append(result('serialize_thread/messages', len(messages), median, best))
+
+            for page_size in page_sizes:
+                logs = list(await db.scalars(
+                    select(Log).options(selectinload(Log.user)).order_by(Log.created_at.desc()).limit(page_size)
+                ))
+                median, best = measure(
+                    lambda _: json.dumps([log.to_dict() for log in logs]), [[None]] * args.rounds, args.budget
+                )
+                rows.append(result('serialize_logs/page_size', page_size, median, best))
+        await engine.dispose()
+    return rows
+
+
+def growth(points):
+    """Least-squares exponent k of time ~ n^k over the larger half of the points"""
+    points = sorted(points)
+    if len(points) >= 4:
+        points = points[len(points) // 2 - 1:]
+    if len(points) < 2:
+        return None
+    xs = [math.log(n) for n, _ in points]
+    ys = [math.log(t) for _, t in points]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    spread = sum((x - mean_x) ** 2 for x in xs)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / spread if spread else None
+
+
+def scaling(rows):
+    checks = []
+    for series, expected in EXPECTED.items():
+        points = [(row['n'], row['median_us']) for row in rows if row['series'] == series and row['median_us'] > 0]
+        exponent = growth(points)
+        if exponent is None:
+            continue
+        ok = exponent <= expected
+        checks.append({'series': series, 'exponent': round(exponent, 3), 'expected_max': expected, 'ok': ok})
+        if not ok:
+            print(f"WARNING: {series.replace('/', ' grows as ')}^{exponent:.2f}, expected at most ^{expected}",
+                  file=sys.stderr)
+    return checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='smaller sizes, for a fast sanity run')
+    parser.add_argument('--only', nargs='+', choices=['cache', 'simhash', 'serialize', 'history'])
+    parser.add_argument('--sizes', type=int, nargs='+', help='cache sizes (default 100 to 1,000,000)')
+    parser.add_argument('--queries', type=int, default=200, help='calls per round')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=3.0, help='seconds per measurement before stopping early')
+    parser.add_argument('--seed', type=int, default=18)
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--strict', action='store_true', help='exit non-zero when a scaling check fails')
+    args = parser.parse_args()
+
+    selected = set(args.only or ['cache', 'simhash', 'serialize', 'history'])
+    rng = random.Random(args.seed)
+    sizes = args.sizes or ([100, 1000, 10000] if args.quick else [100, 1000, 10000, 100000, 1000000])
+    lengths = [50, 200, 1000, 5000]
+    thread_sizes = [100, 1000] if args.quick else [100, 1000, 3000, 10000]
+    page_sizes = [50, 200, 500] if args.quick else [50, 100, 200, 500, 1000]
+
+    print(f"{'series':<28} {'n':>9} {'median us':>14} {'ops/s':>14}")
+    rows = []
+    if 'cache' in selected:
+        rows += bench_cache(sizes, lengths, args, rng)
+    if 'simhash' in selected:
+        rows += bench_simhash(lengths, args, rng)
+    if selected & {'serialize', 'history'}:
+        database_rows = asyncio.run(bench_database(thread_sizes, page_sizes, args, rng))
+        rows += [row for row in database_rows if row['series'].split('_')[0] in selected]
+    checks = scaling(rows)
+
+    if args.output:
+        results = {
+            'meta': {
+                'commit': git_commit(),
+                'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'settings': vars(args),
+            },
+            'results': rows,
+            'scaling': checks,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.strict and not all(check['ok'] for check in checks):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,52 +1,1404 @@
+import hashlib
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from itertools import combinations
 from simhash import Simhash
 
+from metrics import Histogram
+
+from constants import (
+    CACHE_BACKEND, CACHE_SIZE, CACHE_SHARD_SIZES, CACHE_CONTEXT_MESSAGES, CACHE_AGING_INTERVAL,
+    CACHE_PERSIST_PATH, CACHE_PERSIST_MAX_ENTRIES,
+    CACHE_MODE, CACHE_SHARED_PATH, CACHE_SYNC_INTERVAL_MS,
+    EMBEDDING_MODEL, EMBEDDING_SIMILARITY_THRESHOLD,
+    EMBEDDING_DTYPE, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_WAIT_MS
+)
+
+try:
+    import numpy as np
+except ImportError:  # only needed by the embedding backend
+    np = None
+
+FINGERPRINT_BITS = 64
+SIMILARITY_THRESHOLD = 0.8
+VALUE_SIZE_BUCKETS = (128, 256, 512, 1024, 2048, 4096, 8192, 16384, 65536)
+
+def hamming_distance(a, b):
+    # XOR integer hashes, count differing bits
+    return bin(a ^ b).count("1")
+
+def max_distance_for(threshold):
+    # largest hamming distance whose similarity still clears the threshold
+    return int((1 - threshold) * FINGERPRINT_BITS + 1e-9)
+
+def value_size(value):
+    # bytes a cached response takes as UTF-8
+    return len(value.encode('utf-8') if isinstance(value, str) else str(value).encode('utf-8'))
+
+def context_digest(messages, recent=CACHE_CONTEXT_MESSAGES):
+    """Digest of the system prompt and the last `recent` turns a prompt is answered in.
+
+    A cached answer is only reused under the same digest, so "continue" in
+    one thread never returns another thread's continuation. New threads all
+    share the system-prompt-only digest.
+    """
+    system = [m for m in messages if m['role'] == 'system']
+    turns = [m for m in messages if m['role'] != 'system']
+    digest = hashlib.blake2b(digest_size=8)
+    for message in system + (turns[-recent:] if recent > 0 else []):
+        digest.update(message['role'].encode('utf-8') + b'\0' + message['content'].encode('utf-8') + b'\0')
+    return digest.hexdigest()
+
+
+class SimHashIndex:
+    """Multi-index hashing over 64-bit fingerprints.
+
+    The fingerprint is split into `blocks` equal chunks, each with its own
+    table. Two fingerprints within distance d must agree on at least one
+    chunk up to distance d // blocks (pigeonhole), so a lookup only probes
+    the chunk values within that radius instead of scanning every key.
+    """
+
+    def __init__(self, blocks=4):
+        self.blocks = blocks
+        self.block_bits = FINGERPRINT_BITS // blocks
+        self.block_mask = (1 << self.block_bits) - 1
+        self.tables = [{} for _ in range(blocks)]  # [{chunk_value: set(keys)}]
+        self.keys = set()
+        self._probe_masks = {}  # {radius: [xor masks of weight <= radius]}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _chunks(self, key):
+        for i in range(self.blocks):
+            yield i, (key >> (i * self.block_bits)) & self.block_mask
+
+    def _masks(self, radius):
+        masks = self._probe_masks.get(radius)
+        if masks is None:
+            masks = []
+            for weight in range(radius + 1):
+                for bits in combinations(range(self.block_bits), weight):
+                    mask = 0
+                    for bit in bits:
+                        mask |= 1 << bit
+                    masks.append(mask)
+            self._probe_masks[radius] = masks
+        return masks
+
+    def add(self, key, probe=None):
+        if key in self.keys:
+            return
+        self.keys.add(key)
+        for i, chunk in self._chunks(key):
+            self.tables[i].setdefault(chunk, set()).add(key)
+
+    def remove(self, key):
+        if key not in self.keys:
+            return
+        self.keys.discard(key)
+        for i, chunk in self._chunks(key):
+            bucket = self.tables[i][chunk]
+            bucket.discard(key)
+            if not bucket:
+                del self.tables[i][chunk]
+
+    def clear(self):
+        self.tables = [{} for _ in range(self.blocks)]
+        self.keys = set()
+
+    def closest(self, key, max_distance):
+        """Return (key, distance) of the closest probed candidate, or (None, None).
+
+        Every key within max_distance is probed, so a result beyond it only
+        means nothing closer exists; keys further away may be missed.
+        """
+        if not self.keys:
+            return None, None
+        if key in self.keys:
+            return key, 0
+
+        masks = self._masks(max_distance // self.blocks)
+        if len(masks) * self.blocks >= len(self.keys):
+            # probing would touch more buckets than there are keys
+            candidates = self.keys
+        else:
+            candidates = set()
+            for i, chunk in self._chunks(key):
+                table = self.tables[i]
+                candidates.update(*filter(None, map(table.get, [chunk ^ mask for mask in masks])))
+            if not candidates:
+                return None, None
+
+        best_key = min(candidates, key=lambda candidate: bin(candidate ^ key).count("1"))
+        return best_key, hamming_distance(best_key, key)
+
+    def nearest(self, key, max_distance):
+        """Return (nearest_key, distance) within max_distance, or (None, None)"""
+        best_key, best_distance = self.closest(key, max_distance)
+        if best_key is None or best_distance > max_distance:
+            return None, None
+        return best_key, best_distance
+
+    def match(self, key, threshold):
+        """Return (nearest key clearing threshold or None, similarity of the closest candidate or None)"""
+        max_distance = max_distance_for(threshold)
+        best_key, best_distance = self.closest(key, max_distance)
+        if best_key is None:
+            return None, None
+        similarity = 1 - best_distance / FINGERPRINT_BITS
+        return (best_key if best_distance <= max_distance else None), similarity
+
+
+class EmbeddingIndex:
+    """Cosine top-1 search over L2-normalized prompt embeddings.
+
+    Vectors are rows of one preallocated contiguous matrix, so a lookup is a
+    single matrix-vector product and an argmax. Freed rows are zeroed and
+    reused. float16 storage halves memory; blocks are upcast to float32 for
+    the product since NumPy has no fast float16 BLAS path.
+    """
+
+    FLOAT16_BLOCK_ROWS = 16384
+
+    def __init__(self, capacity, dim, dtype='float32'):
+        if np is None:
+            raise RuntimeError("The embedding cache backend requires numpy")
+        self.matrix = np.zeros((capacity, dim), dtype=dtype)
+        self.rows = {}  # {key: row}
+        self.row_keys = [None] * capacity
+        self.free_rows = []
+        self.high_water = 0  # rows beyond this have never been used
+
+    def __len__(self):
+        return len(self.rows)
+
+    def resize(self, capacity):
+        """Reallocate the matrix with room for capacity rows"""
+        if capacity < self.high_water:
+            raise ValueError("Cannot shrink below the rows in use")
+        matrix = np.zeros((capacity, self.matrix.shape[1]), dtype=self.matrix.dtype)
+        matrix[:self.high_water] = self.matrix[:self.high_water]
+        self.matrix = matrix
+        self.row_keys = self.row_keys[:self.high_water] + [None] * (capacity - self.high_water)
+
+    def add(self, key, probe=None):
+        row = self.rows.get(key)
+        if row is None:
+            if not self.free_rows and self.high_water == len(self.matrix):
+                self.resize(max(1, 2 * len(self.matrix)))
+            row = self.free_rows.pop() if self.free_rows else self.high_water
+            self.high_water = max(self.high_water, row + 1)
+            self.rows[key] = row
+            self.row_keys[row] = key
+        self.matrix[row] = probe
+
+    def remove(self, key):
+        row = self.rows.pop(key, None)
+        if row is None:
+            return
+        self.matrix[row] = 0
+        self.row_keys[row] = None
+        self.free_rows.append(row)
+
+    def clear(self):
+        self.matrix[:self.high_water] = 0
+        self.rows = {}
+        self.row_keys = [None] * len(self.row_keys)
+        self.free_rows = []
+        self.high_water = 0
+
+    def scores(self, vector):
+        rows = self.matrix[:self.high_water]
+        if rows.dtype == np.float32:
+            return rows @ vector
+        return np.concatenate([
+            rows[start:start + self.FLOAT16_BLOCK_ROWS].astype(np.float32) @ vector
+            for start in range(0, len(rows), self.FLOAT16_BLOCK_ROWS)
+        ])
+
+    def match(self, vector, threshold):
+        """Return (most similar key if its cosine clears threshold or None, best cosine or None)"""
+        if not self.rows:
+            return None, None
+        scores = self.scores(vector)
+        row = int(np.argmax(scores))
+        similarity = float(scores[row])
+        if similarity < threshold:
+            return None, similarity
+        return self.row_keys[row], similarity
+
+
+class CacheStats:
+    """Lookup, write and eviction counters for one response cache.
+
+    Besides hits and misses, every lookup records the similarity of the
+    closest cached entry it found, hit or miss, in 0.05 wide bins, so the
+    threshold can be tuned against the real distribution. Lookups with no
+    candidate at all are counted as 'none'. Counters are per process.
+    """
+
+    SIMILARITY_BINS = 20
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lookup_latency = Histogram()
+        self.value_sizes = Histogram(VALUE_SIZE_BUCKETS)
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+            self.sets = 0
+            self.evictions = 0
+            self.store_errors = 0  # shared store reads/writes that failed and were skipped
+            self.similarity = [0] * self.SIMILARITY_BINS
+            self.no_neighbor = 0
+        self.lookup_latency.reset()
+        self.value_sizes.reset()
+
+    def record_lookup(self, hit, similarity):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            if similarity is None:
+                self.no_neighbor += 1
+            else:
+                # negative cosines land in the lowest bin
+                i = min(max(int(similarity * self.SIMILARITY_BINS), 0), self.SIMILARITY_BINS - 1)
+                self.similarity[i] += 1
+
+    def record_set(self, size):
+        with self.lock:
+            self.sets += 1
+        self.value_sizes.observe(size)
+
+    def record_evictions(self, count=1):
+        with self.lock:
+            self.evictions += count
+
+    def record_store_error(self):
+        with self.lock:
+            self.store_errors += 1
+
+    def snapshot(self):
+        bins = self.SIMILARITY_BINS
+        with self.lock:
+            lookups = self.hits + self.misses
+            histogram = {f"{i / bins:.2f}-{(i + 1) / bins:.2f}": count for i, count in enumerate(self.similarity)}
+            histogram['none'] = self.no_neighbor
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'sets': self.sets,
+                'evictions': self.evictions,
+                'store_errors': self.store_errors,
+                'similarity_histogram': histogram,
+            }
+        stats['lookup_latency_ms'] = self.lookup_latency.summary(scale=1000)
+        stats['value_size_bytes'] = self.value_sizes.summary()
+        return stats
+
+
+class ScopedIndex:
+    """One similarity index per context scope.
+
+    Keys and probes are (scope, inner) pairs. A lookup only searches the
+    index of its own scope, so entries cached under a different system
+    prompt or conversation never match. Empty scopes are dropped.
+    """
+
+    def __init__(self, make_index):
+        self.make_index = make_index
+        self.scopes = {}  # {scope: index}
+
+    def __len__(self):
+        return sum(len(index) for index in self.scopes.values())
+
+    def add(self, key, probe=None):
+        scope, inner = key
+        index = self.scopes.get(scope)
+        if index is None:
+            index = self.scopes[scope] = self.make_index()
+        index.add(inner, probe[1])
+
+    def remove(self, key):
+        scope, inner = key
+        index = self.scopes.get(scope)
+        if index is None:
+            return
+        index.remove(inner)
+        if not len(index):
+            del self.scopes[scope]
+
+    def clear(self):
+        self.scopes = {}
+
+    def match(self, probe, threshold):
+        scope, inner = probe
+        index = self.scopes.get(scope)
+        if index is None:
+            return None, None
+        key, similarity = index.match(inner, threshold)
+        return ((scope, key) if key is not None else None), similarity
+
+
 class LFUCache:
-    def __init__(self, size=100):
+    """Similarity-keyed LFU cache with O(1) eviction.
+
+    Keys sit in frequency buckets ({hit_count: OrderedDict}) kept in least
+    recently used order, and the lowest non-empty count is tracked, so
+    eviction pops the oldest key of the least used bucket. With
+    `aging_interval` set, all hit counts are halved every that many
+    operations so entries that were hot long ago can be evicted again.
+    All operations are serialized on a lock so the cache can be shared
+    between threads.
+    """
+
+    def __init__(self, size=100, threshold=SIMILARITY_THRESHOLD, aging_interval=None, index=None):
         self.size = size
-        self.cache = {}  # {int_hash: [value, hit_count]}
-
-    def add_cache(self, key, value):
-        if len(self.cache) >= self.size:
-            self.remove_lfu()
-        self.cache[key] = [value, 0]  # [value, hit count]
-
-    def check_cache(self, key):
-        # find nearest value to the key in the cache based on hamming distance
-        lowest_distance = float('inf')
-        key_found = None
-
-        for cached_key in self.cache.keys():
-            # XOR integer hashes, count differing bits
-            distance = bin(cached_key ^ key).count("1")
-            if distance < lowest_distance:
-                lowest_distance = distance
-                key_found = cached_key
-
-        if key_found is None:
-            return None
+        self.threshold = threshold
+        self.aging_interval = aging_interval
+        self.cache = {}  # {key: [value, hit_count]}
+        self.buckets = {}  # {hit_count: OrderedDict(key -> None)}, oldest first
+        self.min_count = 0
+        self.operations = 0
+        self.value_bytes = 0  # total size of cached values
+        self.index = index if index is not None else SimHashIndex()
+        self.stats = CacheStats()
+        self.lock = threading.RLock()
 
-        similarity = 1 - (lowest_distance / 64.0)
+    def _link(self, key, count):
+        self.buckets.setdefault(count, OrderedDict())[key] = None
 
-        if similarity >= 0.8:
-            self.cache[key_found][1] += 1
-            return self.cache[key_found][0]
+    def _unlink(self, key):
+        count = self.cache[key][1]
+        bucket = self.buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[count]
+        return count
 
-        return None
+    def _tick(self):
+        self.operations += 1
+        if self.aging_interval and self.operations % self.aging_interval == 0:
+            self.age()
+
+    def add_cache(self, key, value, probe=None):
+        # probe is what the index searches on; SimHash keys are their own probe
+        size = value_size(value)
+        with self.lock:
+            if key in self.cache:
+                self._unlink(key)
+                self.value_bytes -= value_size(self.cache[key][0])
+            elif len(self.cache) >= self.size:
+                self.remove_lfu()
+            self.cache[key] = [value, 0]  # [value, hit count]
+            self._link(key, 0)
+            self.min_count = 0
+            self.value_bytes += size
+            self.index.add(key, probe)
+            self.stats.record_set(size)
+            self._tick()
+
+    def preload(self, key, value, probe=None, hits=0):
+        """Insert a warm-start entry without evicting; returns False once full"""
+        with self.lock:
+            if key in self.cache:
+                return True
+            if len(self.cache) >= self.size:
+                return False
+            self.cache[key] = [value, hits]
+            self._link(key, hits)
+            self.min_count = min(self.min_count, hits)
+            self.value_bytes += value_size(value)
+            self.index.add(key, probe)
+            return True
+
+    def find(self, probe):
+        """Return (key, value) of the most similar cached entry, or (None, None)"""
+        with self.lock:
+            # find the most similar cached key (hamming distance or cosine, per index)
+            key_found, similarity = self.index.match(probe, self.threshold)
+            self.stats.record_lookup(key_found is not None, similarity)
+            self._tick()
+
+            if key_found is None:
+                return None, None
+
+            entry = self.cache[key_found]
+            count = self._unlink(key_found)
+            entry[1] = count + 1
+            self._link(key_found, entry[1])
+            if self.min_count == count and count not in self.buckets:
+                self.min_count = entry[1]
+            return key_found, entry[0]
+
+    def check_cache(self, probe):
+        return self.find(probe)[1]
 
     def remove_lfu(self):
-        # removes least frequently used key
-        lfu_key = min(self.cache, key=lambda k: self.cache[k][1])
-        del self.cache[lfu_key]
+        # removes least frequently used key, least recently used among ties
+        with self.lock:
+            if not self.cache:
+                return
+            if self.min_count not in self.buckets:
+                self.min_count = min(self.buckets)
+            bucket = self.buckets[self.min_count]
+            lfu_key, _ = bucket.popitem(last=False)
+            if not bucket:
+                del self.buckets[self.min_count]
+            self.value_bytes -= value_size(self.cache.pop(lfu_key)[0])
+            self.index.remove(lfu_key)
+            self.stats.record_evictions()
+
+    def resize(self, size):
+        """Change the capacity, evicting the least used entries down to it"""
+        with self.lock:
+            self.size = size
+            while len(self.cache) > size:
+                self.remove_lfu()
+
+    def clear(self):
+        with self.lock:
+            self.cache = {}
+            self.buckets = {}
+            self.min_count = 0
+            self.value_bytes = 0
+            self.index.clear()
+
+    def age(self):
+        # halve every hit count so stale popularity decays; O(n), amortized by aging_interval
+        with self.lock:
+            buckets = {}
+            for count in sorted(self.buckets):
+                aged = count >> 1
+                target = buckets.setdefault(aged, OrderedDict())
+                for key in self.buckets[count]:
+                    target[key] = None
+                    self.cache[key][1] = aged
+            self.buckets = buckets
+            self.min_count = min(buckets) if buckets else 0
+
+
+class PersistentCacheStore:
+    """SQLite-backed second tier for the response cache.
+
+    Entries and hit counts are queued in memory and committed in batches by
+    a background thread, so the request path never waits on disk. After a
+    restart the hottest entries are read back to warm the in-memory tier.
+    Rows are keyed by shard (model) and carry their context scope, so one
+    store serves every shard.
+    """
+
+    def __init__(self, path, max_entries=100000, flush_interval=1.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self.pending = {}  # {(shard, cache_key): (scope, prompt, value)}
+        self.pending_hits = {}  # {(shard, cache_key): hits since last flush}
+        self.cleared = set()  # shards to delete on the next flush
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.closed = False
+
+        conn = self._connect()
+        try:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(cache_entries)")]
+            if columns and 'shard' not in columns:
+                # entries from before sharding have no model or context scope and cannot be served safely
+                conn.execute("DROP TABLE cache_entries")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                "shard TEXT NOT NULL, cache_key TEXT NOT NULL, scope TEXT NOT NULL, "
+                "prompt TEXT NOT NULL, value TEXT NOT NULL, "
+                "hits INTEGER NOT NULL DEFAULT 0, updated_at REAL NOT NULL, PRIMARY KEY (shard, cache_key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_entries_hits ON cache_entries (hits, updated_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_entries_shard_hits ON cache_entries (shard, hits, updated_at)")
+            conn.commit()
+        finally:
+            conn.close()
+
+        self.writer = threading.Thread(target=self._run, name='cache-store-writer', daemon=True)
+        self.writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def put(self, shard, cache_key, scope, prompt, value):
+        with self.lock:
+            self.pending[(shard, cache_key)] = (scope, prompt, value)
+
+    def hit(self, shard, cache_key):
+        key = (shard, cache_key)
+        with self.lock:
+            self.pending_hits[key] = self.pending_hits.get(key, 0) + 1
+
+    def clear(self, shard):
+        """Drop every persisted entry of a shard, including queued writes, on the next flush"""
+        with self.lock:
+            self.pending = {key: entry for key, entry in self.pending.items() if key[0] != shard}
+            self.pending_hits = {key: count for key, count in self.pending_hits.items() if key[0] != shard}
+            self.cleared.add(shard)
+
+    def shards(self):
+        """Return the shards that have persisted entries"""
+        conn = self._connect()
+        try:
+            return [row[0] for row in conn.execute("SELECT DISTINCT shard FROM cache_entries")]
+        finally:
+            conn.close()
+
+    def hottest(self, shard, limit):
+        """Return up to limit (scope, prompt, value, hits) rows of a shard, most used first"""
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT scope, prompt, value, hits FROM cache_entries WHERE shard = ? "
+                "ORDER BY hits DESC, updated_at DESC LIMIT ?",
+                (shard, limit)
+            ).fetchall()
+        finally:
+            conn.close()
+
+    def flush(self, conn):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            hits, self.pending_hits = self.pending_hits, {}
+            cleared, self.cleared = self.cleared, set()
+        if not pending and not hits and not cleared:
+            return
+
+        now = time.time()
+        with conn:
+            conn.executemany("DELETE FROM cache_entries WHERE shard = ?", [(shard,) for shard in cleared])
+            conn.executemany(
+                "INSERT INTO cache_entries (shard, cache_key, scope, prompt, value, hits, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, 0, ?) "
+                "ON CONFLICT(shard, cache_key) DO UPDATE SET prompt = excluded.prompt, value = excluded.value, "
+                "updated_at = excluded.updated_at",
+                [(shard, key, scope, prompt, value, now) for (shard, key), (scope, prompt, value) in pending.items()]
+            )
+            conn.executemany(
+                "UPDATE cache_entries SET hits = hits + ? WHERE shard = ? AND cache_key = ?",
+                [(count, shard, key) for (shard, key), count in hits.items()]
+            )
+            if pending:
+                # keep the disk tier bounded by dropping the least used entries
+                excess = conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0] - self.max_entries
+                if excess > 0:
+                    conn.execute(
+                        "DELETE FROM cache_entries WHERE rowid IN "
+                        "(SELECT rowid FROM cache_entries ORDER BY hits ASC, updated_at ASC LIMIT ?)",
+                        (excess,)
+                    )
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while not self.closed:
+                self.wake.wait(self.flush_interval)
+                try:
+                    self.flush(conn)
+                except Exception as e:
+                    logging.error(f"Error writing response cache to disk: {e}")
+            self.flush(conn)
+        finally:
+            conn.close()
+
+    def close(self):
+        """Stop the writer after a final flush; safe to call once per shard"""
+        if self.closed:
+            return
+        self.closed = True
+        self.wake.set()
+        self.writer.join()
 
 
 class CacheManager:
-    def __init__(self, size=100):
-        self.lfu_cache = LFUCache(size)
+    """SimHash response cache for one shard.
+
+    Entries are keyed by (scope, fingerprint), where scope is the
+    context_digest of the conversation, so a lookup only matches prompts
+    asked in the same context.
+    """
+
+    name = 'simhash'
+
+    def __init__(self, size=100, aging_interval=None, store=None, index=None, threshold=SIMILARITY_THRESHOLD, shard=''):
+        index = index if index is not None else ScopedIndex(SimHashIndex)
+        self.lfu_cache = LFUCache(size, threshold, aging_interval, index=index)
+        self.stats = self.lfu_cache.stats
+        self.store = store
+        self.shard = shard
+
+    def keys_for(self, prompts):
+        """Return an unscoped (cache key, index probe) pair for each prompt"""
+        hashes = [Simhash(prompt).value for prompt in prompts]  # use 64-bit integer
+        return list(zip(hashes, hashes))
+
+    def stored_key(self, cache_key):
+        """Text form of a scoped cache key, as kept by the persistent and shared stores"""
+        scope, key = cache_key
+        return f"{scope}:{key}"
+
+    def serialize(self, cache_key, probe):
+        """Encode a scoped key and probe for the shared store as (text, bytes)"""
+        return self.stored_key(cache_key), probe[1].to_bytes(8, 'big')
+
+    def deserialize(self, stored_key, stored_probe=None):
+        """Decode a shared store row back to a scoped (cache key, probe)"""
+        scope, key = stored_key.split(':', 1)
+        fingerprint = int(key)
+        return (scope, fingerprint), (scope, fingerprint)
+
+    def get(self, key: str, scope: str = ''):
+        start = time.perf_counter()
+        _, probe = self.keys_for([key])[0]
+        cache_key, value = self.lfu_cache.find((scope, probe))
+        if cache_key is not None and self.store is not None:
+            self.store.hit(self.shard, self.stored_key(cache_key))
+        self.stats.lookup_latency.observe(time.perf_counter() - start)
+        return value
+
+    def set(self, key: str, value: str, scope: str = ''):
+        cache_key, probe = self.keys_for([key])[0]
+        cache_key, probe = (scope, cache_key), (scope, probe)
+        self.lfu_cache.add_cache(cache_key, value, probe)
+        if self.store is not None:
+            self.store.put(self.shard, self.stored_key(cache_key), scope, key, value)
+
+    def get_stats(self):
+        """Return counters, distributions and current configuration"""
+        with self.lfu_cache.lock:
+            entries = len(self.lfu_cache.cache)
+            value_bytes = self.lfu_cache.value_bytes
+            size, threshold = self.lfu_cache.size, self.lfu_cache.threshold
+        stats = {
+            'backend': self.name,
+            'mode': 'local',
+            'size': size,
+            'threshold': threshold,
+            'entries': entries,
+            'value_bytes': value_bytes,
+            'avg_value_bytes': round(value_bytes / entries, 1) if entries else None,
+            'persistent': self.store is not None,
+        }
+        stats.update(self.stats.snapshot())
+        return stats
+
+    def flush(self):
+        """Drop every entry, including the persisted ones"""
+        self.lfu_cache.clear()
+        if self.store is not None:
+            self.store.clear(self.shard)
+
+    def resize(self, size):
+        self.lfu_cache.resize(size)
+
+    def set_threshold(self, threshold):
+        with self.lfu_cache.lock:
+            self.lfu_cache.threshold = threshold
+
+    def warm_start(self, limit, chunk_size=256):
+        """Load the hottest persisted entries in a background thread"""
+        if self.store is None or limit <= 0:
+            return None
+        thread = threading.Thread(target=self._warm, args=(limit, chunk_size), name='cache-warm-start', daemon=True)
+        thread.start()
+        return thread
+
+    def _warm(self, limit, chunk_size):
+        loaded = 0
+        try:
+            rows = self.store.hottest(self.shard, limit)
+            full = False
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                keys = self.keys_for([prompt for _, prompt, _, _ in chunk])
+                for (cache_key, probe), (scope, _, value, hits) in zip(keys, chunk):
+                    full = not self.lfu_cache.preload((scope, cache_key), value, (scope, probe), hits)
+                    if full:
+                        break
+                    loaded += 1
+                if full:
+                    break
+            logging.info(f"Response cache warm start loaded {loaded} entries for '{self.shard}'")
+        except Exception as e:
+            logging.error(f"Response cache warm start failed: {e}")
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+
+
+class BatchEncoder:
+    """Embeds prompts from concurrent callers in shared batches.
+
+    Callers block on a future while a worker thread drains the queue, waiting
+    at most `max_wait` seconds to fill a batch of up to `batch_size` prompts.
+    """
+
+    def __init__(self, model, batch_size=32, max_wait=0.005):
+        self.model = model
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.worker = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+        self.worker.start()
+
+    def encode(self, text):
+        future = Future()
+        self.queue.put((text, future))
+        return future.result()
+
+    def encode_many(self, texts):
+        vectors = self.model.encode(list(texts), batch_size=self.batch_size, convert_to_numpy=True)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            try:
+                vectors = self.encode_many([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+
+class EmbeddingCacheManager(CacheManager):
+    """Semantic response cache keyed by sentence-transformers embeddings.
+
+    Drop-in alternative to CacheManager: prompts are embedded (batched across
+    concurrent callers) and matched by cosine similarity, so paraphrases hit
+    while unrelated prompts that merely share words do not.
+    """
+
+    name = 'embedding'
+    SCOPE_ROWS = 16  # initial rows per scope; scope matrices grow by doubling
+
+    def __init__(self, size=100, model_name=EMBEDDING_MODEL, threshold=EMBEDDING_SIMILARITY_THRESHOLD,
+                 dtype=EMBEDDING_DTYPE, batch_size=EMBEDDING_BATCH_SIZE,
+                 max_wait=EMBEDDING_BATCH_WAIT_MS / 1000.0, aging_interval=None, model=None, store=None,
+                 encoder=None, shard=''):
+        # shards share one encoder so the model is loaded and batched once
+        if encoder is None:
+            if model is None:
+                from sentence_transformers import SentenceTransformer
+                model = SentenceTransformer(model_name)
+            encoder = BatchEncoder(model, batch_size, max_wait)
+        self.encoder = encoder
+        dim = encoder.model.get_sentence_embedding_dimension()
+        index = ScopedIndex(lambda: EmbeddingIndex(min(size, self.SCOPE_ROWS), dim, dtype))
+        super().__init__(size, aging_interval, store, index=index, threshold=threshold, shard=shard)
+
+    def keys_for(self, prompts):
+        if len(prompts) == 1:
+            vectors = [self.encoder.encode(prompts[0])]
+        else:
+            vectors = self.encoder.encode_many(prompts)
+        return list(zip(prompts, vectors))
+
+    def serialize(self, cache_key, probe):
+        return self.stored_key(cache_key), np.asarray(probe[1], dtype=np.float32).tobytes()
+
+    def deserialize(self, stored_key, stored_probe=None):
+        scope, key = stored_key.split(':', 1)
+        if stored_probe is None:
+            return (scope, key), None
+        return (scope, key), (scope, np.frombuffer(stored_probe, dtype=np.float32))
+
+
+class SharedCacheStore:
+    """Response cache entries shared by all worker processes in one SQLite file.
+
+    Every write runs in a BEGIN IMMEDIATE transaction, so inserts and the
+    evictions they trigger are atomic and serialized across processes, and
+    a shard never holds more than its `size` entries. Eviction is an LFU on
+    the shared hit counts within the shard (oldest first among ties). Each
+    change is appended to a log that workers replay to keep their local
+    indexes in step; the log is pruned by age, so a worker only reloads
+    everything if it has not synced for `log_retention` seconds. WAL mode
+    lets any number of workers read while one writes. Runtime settings
+    (size, threshold) are kept in the file too, so an admin change reaches
+    every worker: per shard, or for all shards under the reserved
+    DEFAULTS_SHARD, which applies wherever a shard has no setting of its
+    own. One instance serves one shard.
+    """
+
+    DEFAULTS_SHARD = '*'
+    PRUNE_EVERY = 1000  # log writes between prunes
+
+    def __init__(self, path, size, log_retention=300.0, shard=''):
+        self.path = path
+        self.size = size
+        self.shard = shard
+        self.log_retention = log_retention
+        self.local = threading.local()
+
+        conn = self._conn()
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(shared_cache_entries)")]
+        if columns and 'shard' not in columns:
+            # entries from before sharding have no model or context scope and cannot be served safely
+            for table in ('shared_cache_entries', 'shared_cache_log', 'shared_cache_settings'):
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_cache_entries ("
+            "shard TEXT NOT NULL, cache_key TEXT NOT NULL, probe BLOB NOT NULL, value TEXT NOT NULL, "
+            "hits INTEGER NOT NULL DEFAULT 0, seq INTEGER NOT NULL, PRIMARY KEY (shard, cache_key))"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_shared_cache_entries_hits ON shared_cache_entries (shard, hits, seq)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_cache_log ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, shard TEXT NOT NULL, cache_key TEXT NOT NULL, op TEXT NOT NULL, "
+            "created_at REAL NOT NULL DEFAULT 0)"
+        )
+        if 'created_at' not in [row[1] for row in conn.execute("PRAGMA table_info(shared_cache_log)")]:
+            try:
+                conn.execute("ALTER TABLE shared_cache_log ADD COLUMN created_at REAL NOT NULL DEFAULT 0")
+            except sqlite3.OperationalError:
+                pass  # added by another worker meanwhile
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_cache_settings ("
+            "shard TEXT NOT NULL, name TEXT NOT NULL, value REAL NOT NULL, PRIMARY KEY (shard, name))"
+        )
+
+    def _conn(self):
+        # one connection per thread; autocommit so transactions are explicit
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def _log(self, conn, cache_key, op, shard=None):
+        return conn.execute(
+            "INSERT INTO shared_cache_log (shard, cache_key, op, created_at) VALUES (?, ?, ?, ?)",
+            (self.shard if shard is None else shard, cache_key, op, time.time())
+        ).lastrowid
+
+    def _prune(self, conn):
+        # drop log rows older than the retention, always keeping the newest
+        conn.execute(
+            "DELETE FROM shared_cache_log WHERE seq < ("
+            "SELECT COALESCE(MIN(seq), (SELECT MAX(seq) FROM shared_cache_log)) FROM shared_cache_log "
+            "WHERE created_at >= ?)", (time.time() - self.log_retention,)
+        )
+
+    def shards(self):
+        """Return the shards that have entries"""
+        return [row[0] for row in self._conn().execute("SELECT DISTINCT shard FROM shared_cache_entries")]
+
+    def get_value(self, cache_key):
+        row = self._conn().execute(
+            "SELECT value FROM shared_cache_entries WHERE shard = ? AND cache_key = ?", (self.shard, cache_key)
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_settings(self):
+        """The shard's settings, falling back to the defaults for all shards"""
+        rows = self._conn().execute(
+            "SELECT shard, name, value FROM shared_cache_settings WHERE shard IN (?, ?) ORDER BY shard = ? DESC",
+            (self.shard, self.DEFAULTS_SHARD, self.DEFAULTS_SHARD)
+        ).fetchall()
+        return {name: value for _, name, value in rows}  # the shard's own rows come last and win
+
+    def get_defaults(self):
+        return dict(self._conn().execute(
+            "SELECT name, value FROM shared_cache_settings WHERE shard = ?", (self.DEFAULTS_SHARD,)
+        ).fetchall())
+
+    def set_setting(self, name, value, shard=None):
+        self._conn().execute(
+            "INSERT INTO shared_cache_settings (shard, name, value) VALUES (?, ?, ?) "
+            "ON CONFLICT(shard, name) DO UPDATE SET value = excluded.value",
+            (self.shard if shard is None else shard, name, value)
+        )
+
+    def set_default(self, name, value):
+        """Set a setting for every shard, replacing the shards' own values"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM shared_cache_settings WHERE name = ? AND shard != ?", (name, self.DEFAULTS_SHARD))
+            self.set_setting(name, value, self.DEFAULTS_SHARD)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _capacity(self, conn, shard=None):
+        row = conn.execute(
+            "SELECT value FROM shared_cache_settings WHERE shard IN (?, ?) AND name = 'size' "
+            "ORDER BY shard = ? LIMIT 1",
+            (self.shard if shard is None else shard, self.DEFAULTS_SHARD, self.DEFAULTS_SHARD)
+        ).fetchone()
+        return int(row[0]) if row else self.size
+
+    def _evict(self, conn, keep=None, shard=None):
+        # caller holds the write transaction; returns the number of evicted entries
+        shard = self.shard if shard is None else shard
+        excess = conn.execute(
+            "SELECT COUNT(*) FROM shared_cache_entries WHERE shard = ?", (shard,)
+        ).fetchone()[0] - self._capacity(conn, shard)
+        if excess <= 0:
+            return 0
+        victims = [row[0] for row in conn.execute(
+            "SELECT cache_key FROM shared_cache_entries WHERE shard = ? AND cache_key != ? "
+            "ORDER BY hits ASC, seq ASC LIMIT ?", (shard, keep or '', excess)
+        )]
+        conn.executemany(
+            "DELETE FROM shared_cache_entries WHERE shard = ? AND cache_key = ?", [(shard, key) for key in victims]
+        )
+        for key in victims:
+            self._log(conn, key, 'del', shard)
+        return len(victims)
+
+    def put(self, cache_key, probe, value):
+        """Insert or replace an entry, evicting the least used ones if full; returns the eviction count"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            seq = self._log(conn, cache_key, 'set')
+            conn.execute(
+                "INSERT INTO shared_cache_entries (shard, cache_key, probe, value, hits, seq) VALUES (?, ?, ?, ?, 0, ?) "
+                "ON CONFLICT(shard, cache_key) DO UPDATE SET probe = excluded.probe, value = excluded.value, "
+                "hits = 0, seq = excluded.seq",
+                (self.shard, cache_key, probe, value, seq)
+            )
+            evicted = self._evict(conn, keep=cache_key)
+            if seq % self.PRUNE_EVERY == 0:
+                self._prune(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return evicted
+
+    def resize(self, size):
+        """Change the shard's capacity, evicting down to it; returns the eviction count"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.set_setting('size', size)
+            evicted = self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return evicted
+
+    def resize_all(self, size):
+        """Set the default capacity of every shard, evicting each down to it; returns the eviction count"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM shared_cache_settings WHERE name = 'size' AND shard != ?", (self.DEFAULTS_SHARD,))
+            self.set_setting('size', size, self.DEFAULTS_SHARD)
+            evicted = sum(self._evict(conn, shard=shard) for shard, in conn.execute(
+                "SELECT DISTINCT shard FROM shared_cache_entries"
+            ).fetchall())
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return evicted
+
+    def clear(self):
+        """Delete every entry of the shard and log a flush that workers replay"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM shared_cache_entries WHERE shard = ?", (self.shard,))
+            self._log(conn, '', 'flush')
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def summary(self):
+        """Return (capacity, entry count, total value bytes)"""
+        conn = self._conn()
+        entries, value_bytes = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(CAST(value AS BLOB))), 0) FROM shared_cache_entries "
+            "WHERE shard = ?", (self.shard,)
+        ).fetchone()
+        return self._capacity(conn), entries, value_bytes
+
+    def add_hits(self, hits):
+        if not hits:
+            return
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "UPDATE shared_cache_entries SET hits = hits + ? WHERE shard = ? AND cache_key = ?",
+                [(count, self.shard, key) for key, count in hits.items()]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def snapshot(self):
+        """Return (last log seq, [(cache_key, probe)]) for a full index load"""
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM shared_cache_log").fetchone()[0]
+            rows = conn.execute(
+                "SELECT cache_key, probe FROM shared_cache_entries WHERE shard = ?", (self.shard,)
+            ).fetchall()
+        finally:
+            conn.execute("COMMIT")
+        return last_seq, rows
+
+    def changes_since(self, seq):
+        """Return (last log seq, the shard's changes after seq as [(op, cache_key, probe)]), or None if seq was pruned"""
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            first, last_seq = conn.execute("SELECT MIN(seq), COALESCE(MAX(seq), 0) FROM shared_cache_log").fetchone()
+            if first is not None and first > seq + 1:
+                return None
+            return last_seq, conn.execute(
+                "SELECT l.op, l.cache_key, e.probe FROM shared_cache_log l "
+                "LEFT JOIN shared_cache_entries e ON e.shard = l.shard AND e.cache_key = l.cache_key "
+                "WHERE l.seq > ? AND l.shard = ? ORDER BY l.seq", (seq, self.shard)
+            ).fetchall()
+        finally:
+            conn.execute("COMMIT")
+
+
+class SharedCacheManager:
+    """Response cache shared across uvicorn workers.
+
+    Values, hit counts and eviction live in a SharedCacheStore; each worker
+    only keeps the similarity index (fingerprints or embeddings) of the
+    selected backend, refreshed from the store's change log by a background
+    thread every `sync_interval` seconds. A worker sees its own writes
+    immediately and other workers' writes after its next sync; a match on an
+    entry another worker just evicted reads no value and counts as a miss.
+    A threshold change is stored alongside the entries and picked up by
+    every worker on its next sync.
+    """
+
+    def __init__(self, backend, store, sync_interval=0.25):
+        self.backend = backend
+        self.store = store
+        self.index = backend.lfu_cache.index
+        self.threshold = backend.lfu_cache.threshold
+        self.stats = CacheStats()
+        self.sync_interval = sync_interval
+        self.last_seq = None
+        self.pending_hits = {}
+        self.lock = threading.RLock()
+        self.stopped = threading.Event()
+        self.syncer = threading.Thread(target=self._run, name='shared-cache-sync', daemon=True)
+        self.syncer.start()
+
+    def get(self, key: str, scope: str = ''):
+        start = time.perf_counter()
+        _, probe = self.backend.keys_for([key])[0]
+        with self.lock:
+            key_found, similarity = self.index.match((scope, probe), self.threshold)
+
+        value = None
+        if key_found is not None:
+            stored_key = self.backend.stored_key(key_found)
+            try:
+                value = self.store.get_value(stored_key)
+            except sqlite3.Error as e:
+                # the cache degrades to a miss rather than failing the request
+                logging.error(f"Error reading shared response cache: {e}")
+                self.stats.record_store_error()
+            if value is not None:
+                with self.lock:
+                    self.pending_hits[stored_key] = self.pending_hits.get(stored_key, 0) + 1
+        self.stats.record_lookup(value is not None, similarity)
+        self.stats.lookup_latency.observe(time.perf_counter() - start)
+        return value
+
+    def set(self, key: str, value: str, scope: str = ''):
+        cache_key, probe = self.backend.keys_for([key])[0]
+        cache_key, probe = (scope, cache_key), (scope, probe)
+        stored_key, stored_probe = self.backend.serialize(cache_key, probe)
+        try:
+            evicted = self.store.put(stored_key, stored_probe, value)
+        except sqlite3.Error as e:
+            # skip the write; the answer was already delivered
+            logging.error(f"Error writing shared response cache: {e}")
+            self.stats.record_store_error()
+            return
+        with self.lock:
+            self.index.add(cache_key, probe)
+        self.stats.record_set(value_size(value))
+        self.stats.record_evictions(evicted)
+
+    def get_stats(self):
+        """Return this worker's counters with the shared store's size and configuration"""
+        size, entries, value_bytes = self.store.summary()
+        with self.lock:
+            indexed = len(self.index)
+        stats = {
+            'backend': self.backend.name,
+            'mode': 'shared',
+            'size': size,
+            'threshold': self.threshold,
+            'entries': entries,
+            'indexed': indexed,
+            'value_bytes': value_bytes,
+            'avg_value_bytes': round(value_bytes / entries, 1) if entries else None,
+            'persistent': True,
+        }
+        stats.update(self.stats.snapshot())
+        return stats
+
+    def flush(self):
+        self.store.clear()
+        with self.lock:
+            self.index.clear()
+
+    def resize(self, size):
+        self.stats.record_evictions(self.store.resize(size))
+
+    def set_threshold(self, threshold):
+        self.store.set_setting('threshold', threshold)
+        self.threshold = threshold
+
+    def sync(self):
+        """Apply store changes to the local index and flush hit counts"""
+        with self.lock:
+            hits, self.pending_hits = self.pending_hits, {}
+        self.store.add_hits(hits)
+
+        threshold = self.store.get_settings().get('threshold')
+        if threshold is not None:
+            self.threshold = threshold
+
+        changes = self.store.changes_since(self.last_seq) if self.last_seq is not None else None
+        if changes is None:
+            # first sync, or this worker fell behind the pruned log: reload everything
+            last_seq, rows = self.store.snapshot()
+            entries = [self.backend.deserialize(key, probe) for key, probe in rows]
+            with self.lock:
+                self.index.clear()
+                for cache_key, probe in entries:
+                    self.index.add(cache_key, probe)
+                self.last_seq = last_seq
+            return
+
+        last_seq, changes = changes
+        with self.lock:
+            for op, stored_key, stored_probe in changes:
+                if op == 'flush':
+                    self.index.clear()
+                    continue
+                cache_key, probe = self.backend.deserialize(stored_key, stored_probe)
+                if op == 'del' or stored_probe is None:
+                    self.index.remove(cache_key)
+                else:
+                    self.index.add(cache_key, probe)
+            self.last_seq = last_seq
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                self.sync()
+            except Exception as e:
+                logging.error(f"Error syncing shared response cache: {e}")
+            self.stopped.wait(self.sync_interval)
+
+    def warm_start(self, limit, chunk_size=256):
+        # the shared store is persistent; the first sync loads it
+        return None
+
+    def close(self):
+        self.stopped.set()
+        self.syncer.join()
+        self.store.add_hits(self.pending_hits)
+
+
+class ShardedCacheManager:
+    """Response cache split into one shard per model.
+
+    Each shard is a complete cache manager (local or shared) with its own
+    capacity, threshold, LFU eviction and stats, so one model's answers are
+    never served for another and a busy model cannot evict a quiet one's
+    entries. Within a shard, keys are scoped by context_digest. Shards are
+    created on first use, or at warm start for models cached by a previous run.
+    """
+
+    def __init__(self, make_shard, size=100, shard_sizes=None, store=None):
+        self.make_shard = make_shard  # (model, size) -> cache manager
+        self.default_size = size
+        self.shard_sizes = dict(shard_sizes or {})
+        self.default_threshold = None
+        self.store = store  # lists the shards with stored entries
+        self.shards = {}  # {model: cache manager}
+        self.lock = threading.Lock()
+
+    def shard(self, model):
+        manager = self.shards.get(model)
+        if manager is None:
+            with self.lock:
+                manager = self.shards.get(model)
+                if manager is None:
+                    manager = self.make_shard(model, self.shard_sizes.get(model, self.default_size))
+                    # a shared shard reads the defaults from the store instead
+                    if self.default_threshold is not None and not self.shared:
+                        manager.set_threshold(self.default_threshold)
+                    self.shards[model] = manager
+        return manager
+
+    @property
+    def shared(self):
+        return isinstance(self.store, SharedCacheStore)
+
+    def _targets(self, model):
+        return [self.shard(model)] if model else list(self.shards.values())
+
+    def get(self, model: str, key: str, scope: str = ''):
+        return self.shard(model).get(key, scope)
+
+    def set(self, model: str, key: str, value: str, scope: str = ''):
+        self.shard(model).set(key, value, scope)
+
+    def get_stats(self):
+        """Return per-shard stats with totals across shards"""
+        shards = {model: manager.get_stats() for model, manager in list(self.shards.items())}
+        hits = sum(stats['hits'] for stats in shards.values())
+        misses = sum(stats['misses'] for stats in shards.values())
+        default_size = self.store.get_defaults().get('size', self.default_size) if self.shared else self.default_size
+        return {
+            'default_size': int(default_size),
+            'context_messages': CACHE_CONTEXT_MESSAGES,
+            'entries': sum(stats['entries'] for stats in shards.values()),
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+            'evictions': sum(stats['evictions'] for stats in shards.values()),
+            'shards': shards,
+        }
+
+    def flush(self, model=None):
+        for manager in self._targets(model):
+            manager.flush()
+
+    def resize(self, size, model=None):
+        """Resize one shard, or every shard and the default budget"""
+        if model:
+            self.shard_sizes[model] = size
+        else:
+            self.default_size = size
+            self.shard_sizes = {}
+            if self.shared:
+                # also reaches shards only other workers have created, and the ones created later
+                self.store.resize_all(size)
+                return
+        for manager in self._targets(model):
+            manager.resize(size)
+
+    def set_threshold(self, threshold, model=None):
+        if not model:
+            self.default_threshold = threshold
+            if self.shared:
+                self.store.set_default('threshold', threshold)
+                for manager in list(self.shards.values()):
+                    manager.threshold = threshold  # other workers pick it up on their next sync
+                return
+        for manager in self._targets(model):
+            manager.set_threshold(threshold)
+
+    def warm_start(self, limit, chunk_size=256):
+        """Create the shards stored by a previous run and warm them in a background thread"""
+        if self.store is None or limit <= 0:
+            return None
+        thread = threading.Thread(target=self._warm, args=(limit, chunk_size), name='cache-warm-start', daemon=True)
+        thread.start()
+        return thread
+
+    def _warm(self, limit, chunk_size):
+        try:
+            models = self.store.shards()
+        except Exception as e:
+            logging.error(f"Response cache warm start failed: {e}")
+            return
+        for model in models:
+            manager = self.shard(model)
+            if isinstance(manager, CacheManager):
+                manager._warm(limit, chunk_size)
+
+    def close(self):
+        for manager in list(self.shards.values()):
+            manager.close()
+        if isinstance(self.store, PersistentCacheStore):
+            self.store.close()
+
+
+def create_cache_manager(backend=CACHE_BACKEND, size=CACHE_SIZE, persist_path=CACHE_PERSIST_PATH, mode=CACHE_MODE,
+                         shard_sizes=CACHE_SHARD_SIZES, aging_interval=CACHE_AGING_INTERVAL):
+    """Build the per-model sharded response cache selected by configuration"""
+    if mode == 'shared':
+        # the shared store is already persistent, so no separate disk tier
+        make_backend = _backend_factory(backend, store=None)
+
+        def make_shard(model, shard_size):
+            store = SharedCacheStore(CACHE_SHARED_PATH, shard_size, shard=model)
+            return SharedCacheManager(make_backend(model, shard_size), store, CACHE_SYNC_INTERVAL_MS / 1000.0)
+
+        return ShardedCacheManager(make_shard, size, shard_sizes, store=SharedCacheStore(CACHE_SHARED_PATH, size))
+    if mode != 'local':
+        raise ValueError(f"Unknown cache mode: {mode}")
+
+    store = PersistentCacheStore(persist_path, CACHE_PERSIST_MAX_ENTRIES) if persist_path else None
+    make_backend = _backend_factory(backend, store, aging_interval or None)
+    return ShardedCacheManager(make_backend, size, shard_sizes, store=store)
 
-    def get(self, key: str):
-        key_hash = Simhash(key).value  # use 64-bit integer
-        return self.lfu_cache.check_cache(key_hash)
 
-    def set(self, key: str, value: str):
-        key_hash = Simhash(key).value  # use 64-bit integer
-        self.lfu_cache.add_cache(key_hash, value)
+def _backend_factory(backend, store, aging_interval=None):
+    # returns (model, size) -> shard cache manager of the selected backend
+    if backend == 'simhash':
+        return lambda model, size: CacheManager(size, aging_interval, store=store, shard=model)
+    if backend == 'embedding':
+        from sentence_transformers import SentenceTransformer
+        encoder = BatchEncoder(
+            SentenceTransformer(EMBEDDING_MODEL), EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_WAIT_MS / 1000.0
+        )
+        return lambda model, size: EmbeddingCacheManager(
+            size, store=store, encoder=encoder, aging_interval=aging_interval, shard=model
+        )
+    raise ValueError(f"Unknown cache backend: {backend}")
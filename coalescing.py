@@ -0,0 +1,101 @@
+import asyncio
+from simhash import Simhash
+
+
+def flight_key(model: str, prompt: str, scope: str = ''):
+    # SimHash normalizes case, punctuation and whitespace, so trivially different
+    # spellings of the same prompt share a fingerprint; scope is the same
+    # context digest the response cache uses, so only prompts asked in the
+    # same context share a generation
+    return model, scope, Simhash(prompt).value
+
+
+class Flight:
+    """One in-flight generation that any number of callers can follow.
+
+    Chunks are buffered as the producer yields them, so a caller that joins
+    late still replays the response from the beginning.
+    """
+
+    def __init__(self, producer):
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self.followers = 0
+        self.updated = asyncio.Condition()
+        self.task = asyncio.ensure_future(self._pump(producer))
+
+    async def _notify(self):
+        async with self.updated:
+            self.updated.notify_all()
+
+    async def _pump(self, producer):
+        try:
+            async for chunk in producer:
+                self.chunks.append(chunk)
+                await self._notify()
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished = True
+            await self._notify()
+
+    async def follow(self):
+        position = 0
+        while True:
+            async with self.updated:
+                await self.updated.wait_for(lambda: self.finished or len(self.chunks) > position)
+            while position < len(self.chunks):
+                yield self.chunks[position]
+                position += 1
+            if self.finished and position == len(self.chunks):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class SingleFlight:
+    """Coalesces concurrent identical LLM requests into one generation.
+
+    The first caller for a key starts the producer; later callers with the
+    same key follow its output instead of calling Ollama again. A producer
+    error is raised in every follower. A cancelled caller only detaches;
+    the generation itself is cancelled once no caller is left waiting.
+    """
+
+    def __init__(self):
+        self.flights = {}  # {key: Flight}
+        self.started = 0
+        self.joined = 0
+
+    def _forget(self, key, flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+    async def stream(self, key, make_producer):
+        """Yield response chunks for key, starting the producer if nobody else has"""
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = Flight(make_producer())
+            self.flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self.started += 1
+        else:
+            self.joined += 1
+
+        flight.followers += 1
+        try:
+            async for chunk in flight.follow():
+                yield chunk
+        finally:
+            flight.followers -= 1
+            if flight.followers == 0 and not flight.task.done():
+                flight.task.cancel()
+                self._forget(key, flight)
+
+    async def do(self, key, make_producer):
+        """Return the full response for key"""
+        return ''.join([chunk async for chunk in self.stream(key, make_producer)])
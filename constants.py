@@ -1,2 +1,103 @@
+import os
+
+def per_model(name):
+    """Parse a "model=n,model=n" environment variable into {model: n}"""
+    return {
+        model.strip(): int(value)
+        for model, _, value in (item.rpartition('=') for item in os.getenv(name, '').split(',') if item.strip())
+    }
+
+def host_list(value):
+    """Split a comma- or space-separated list of host addresses"""
+    return [host for host in value.replace(',', ' ').split() if host]
+
+def per_model_hosts(name):
+    """Parse a "model=host|host;model=host" environment variable into {model: [host, ...]}"""
+    return {
+        model.strip(): host_list(hosts.replace('|', ' '))
+        for model, _, hosts in (item.partition('=') for item in os.getenv(name, '').split(';') if item.strip())
+    }
+
 DEFAULT_MODEL = "gemma2:2b"
-SYSTEM_PROMPT = "You are a helpful assistant."
\ No newline at end of file
+SYSTEM_PROMPT = "You are a helpful assistant."
+
+# Database connection pool and SQLite tuning
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))  # seconds; server databases only
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', '65536'))  # page cache per connection
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+
+# Password hashing (werkzeug method string, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000")
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+PASSWORD_SALT_LENGTH = int(os.getenv('PASSWORD_SALT_LENGTH', '16'))
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))  # threads hashing in parallel
+PASSWORD_HASH_CONCURRENCY = int(os.getenv('PASSWORD_HASH_CONCURRENCY', '16'))  # hashes running or queued
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv('PASSWORD_HASH_QUEUE_TIMEOUT', '5'))  # seconds to wait for a slot
+
+# Authenticated principal cache (per worker, invalidated across workers through AUTH_SHARED_PATH)
+AUTH_CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL', '30'))  # seconds a user's role/status may be served from memory
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', '10000'))
+AUTH_SHARED_PATH = os.getenv('AUTH_SHARED_PATH', 'auth.db')  # role/status changes seen by all workers; empty: this worker only
+
+# Request profiling
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'true').lower() in ('1', 'true', 'yes')  # per-stage Server-Timing header
+PROFILER_INTERVAL_MS = float(os.getenv('PROFILER_INTERVAL_MS', '5'))  # default sampling interval when started
+
+# Prometheus metrics (/metrics)
+METRICS_SHARED_PATH = os.getenv('METRICS_SHARED_PATH', 'metrics.db')  # snapshots of all workers; empty: this worker only
+METRICS_SYNC_INTERVAL_MS = float(os.getenv('METRICS_SYNC_INTERVAL_MS', '5000'))  # how often a worker publishes
+METRICS_RETENTION_S = float(os.getenv('METRICS_RETENTION_S', '600'))  # keep counters of exited workers this long
+
+# Activity log write-behind pipeline
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_BATCH_SIZE = int(os.getenv('LOG_BATCH_SIZE', '200'))
+LOG_FLUSH_INTERVAL_MS = float(os.getenv('LOG_FLUSH_INTERVAL_MS', '500'))
+LOG_ENQUEUE_TIMEOUT_MS = float(os.getenv('LOG_ENQUEUE_TIMEOUT_MS', '50'))  # wait for queue space before dropping
+
+# Ollama connection settings
+OLLAMA_HOST = os.getenv('OLLAMA_HOST', 'http://127.0.0.1:11434')
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv('OLLAMA_CONNECT_TIMEOUT', '5'))
+OLLAMA_READ_TIMEOUT = float(os.getenv('OLLAMA_READ_TIMEOUT', '300'))
+OLLAMA_MAX_CONNECTIONS = int(os.getenv('OLLAMA_MAX_CONNECTIONS', '32'))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.getenv('OLLAMA_KEEPALIVE_EXPIRY', '60'))
+OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')  # how long Ollama keeps a model (and its KV cache) loaded
+
+# Ollama backend pool: requests go to the host with the fewest calls in progress
+OLLAMA_HOSTS = host_list(os.getenv('OLLAMA_HOSTS', '')) or [OLLAMA_HOST]
+OLLAMA_MODEL_HOSTS = per_model_hosts('OLLAMA_MODEL_HOSTS')  # per-model host lists, e.g. "llama3=http://a:11434|http://b:11434"
+OLLAMA_HOST_CONCURRENCY = int(os.getenv('OLLAMA_HOST_CONCURRENCY', '4'))  # calls per host and worker; 0: unlimited
+OLLAMA_QUEUE_TIMEOUT = float(os.getenv('OLLAMA_QUEUE_TIMEOUT', '60'))  # seconds to wait for a free host
+OLLAMA_HEALTH_INTERVAL = float(os.getenv('OLLAMA_HEALTH_INTERVAL', '10'))  # seconds between probes; 0 disables them
+OLLAMA_HEALTH_TIMEOUT = float(os.getenv('OLLAMA_HEALTH_TIMEOUT', '2'))
+OLLAMA_EJECT_ERRORS = int(os.getenv('OLLAMA_EJECT_ERRORS', '3'))  # consecutive failed calls before a host is ejected
+OLLAMA_EJECT_SECONDS = float(os.getenv('OLLAMA_EJECT_SECONDS', '30'))  # first ejection; doubles on repeats
+
+# Conversation context sent to the model
+CONTEXT_CACHE_MB = float(os.getenv('CONTEXT_CACHE_MB', '64'))  # in-memory thread histories per worker
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '3072'))  # estimated tokens of history per request
+CONTEXT_TOKEN_BUDGETS = per_model('CONTEXT_TOKEN_BUDGETS')  # per-model overrides, e.g. "llama2=1536"
+CONTEXT_SUMMARY = os.getenv('CONTEXT_SUMMARY', 'false').lower() in ('1', 'true', 'yes')  # summarize trimmed turns
+CONTEXT_REUSE = os.getenv('CONTEXT_REUSE', 'false').lower() in ('1', 'true', 'yes')  # continue threads from Ollama's context
+
+# Response cache settings
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'simhash')  # simhash or embedding
+CACHE_SIZE = int(os.getenv('CACHE_SIZE', '100'))
+# Per-model shard budgets overriding CACHE_SIZE, e.g. "gemma2:2b=500,mistral=100"
+CACHE_SHARD_SIZES = per_model('CACHE_SHARD_SIZES')
+# Halve every hit count after this many cache operations, so answers that were popular long ago can be evicted; 0 disables
+CACHE_AGING_INTERVAL = int(os.getenv('CACHE_AGING_INTERVAL', '0'))
+# Conversation turns (besides the system prompt) folded into the cache key
+CACHE_CONTEXT_MESSAGES = int(os.getenv('CACHE_CONTEXT_MESSAGES', '4'))
+CACHE_PERSIST_PATH = os.getenv('CACHE_PERSIST_PATH', 'response_cache.db')  # empty disables the disk tier
+CACHE_PERSIST_MAX_ENTRIES = int(os.getenv('CACHE_PERSIST_MAX_ENTRIES', '100000'))
+CACHE_MODE = os.getenv('CACHE_MODE', 'local')  # local (per worker) or shared (across workers)
+CACHE_SHARED_PATH = os.getenv('CACHE_SHARED_PATH', 'shared_cache.db')
+CACHE_SYNC_INTERVAL_MS = float(os.getenv('CACHE_SYNC_INTERVAL_MS', '250'))
+CACHE_WARM_ENTRIES = int(os.getenv('CACHE_WARM_ENTRIES', os.getenv('CACHE_SIZE', '100')))
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+EMBEDDING_SIMILARITY_THRESHOLD = float(os.getenv('EMBEDDING_SIMILARITY_THRESHOLD', '0.9'))
+EMBEDDING_DTYPE = os.getenv('EMBEDDING_DTYPE', 'float32')  # float32 or float16
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '32'))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv('EMBEDDING_BATCH_WAIT_MS', '5'))
@@ -0,0 +1,261 @@
+import asyncio
+import logging
+from collections import Counter, OrderedDict
+from sqlalchemy import select
+
+from constants import (
+    CONTEXT_CACHE_MB, CONTEXT_TOKEN_BUDGET, CONTEXT_TOKEN_BUDGETS, CONTEXT_SUMMARY, CONTEXT_REUSE
+)
+from models import ChatMessage
+
+CHARS_PER_TOKEN = 4  # rough average for English text with the models we serve
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation below in a few sentences. Keep names, facts, "
+    "decisions and open questions; drop pleasantries."
+)
+
+
+def estimate_tokens(message):
+    return len(message['content']) // CHARS_PER_TOKEN + 4  # + role and framing
+
+
+def message_bytes(message):
+    return len(message['content'].encode('utf-8')) + len(message['role'])
+
+
+def first_turn(messages):
+    """Index of the first message after the leading system prompt"""
+    return 1 if messages and messages[0]['role'] == 'system' else 0
+
+
+class ThreadContext:
+    """History of one thread plus the summary of turns trimmed from its window"""
+
+    __slots__ = ('messages', 'size', 'summary', 'summarized', 'summarizing', 'llm_context')
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.size = sum(message_bytes(m) for m in self.messages)
+        self.summary = None
+        self.summarized = 0  # number of leading messages the summary covers
+        self.summarizing = False
+        self.llm_context = None  # (model, message count, Ollama context tokens) after the last turn
+
+
+class ContextCache:
+    """Per-thread conversation history, LRU-evicted by total content size.
+
+    Entries are validated against the thread's denormalized message_count,
+    so a turn saved by another worker makes the entry stale and it is
+    reloaded from the database instead of serving a history with gaps.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, thread_id, message_count):
+        entry = self.entries.get(thread_id)
+        if entry is None or len(entry.messages) != message_count:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(thread_id)
+        self.hits += 1
+        return entry
+
+    def put(self, thread_id, messages):
+        old = self.entries.pop(thread_id, None)
+        entry = ThreadContext(messages)
+        if old is not None:
+            self.bytes -= old.size
+            if old.summarized <= len(entry.messages):
+                entry.summary, entry.summarized = old.summary, old.summarized
+            entry.llm_context = old.llm_context  # still checked against the message count on use
+        self.entries[thread_id] = entry
+        self.bytes += entry.size
+        self._evict()
+        return entry
+
+    def append(self, thread_id, messages, expected):
+        """Add messages saved to a thread that held `expected` messages before"""
+        entry = self.entries.get(thread_id)
+        if entry is None:
+            return
+        if len(entry.messages) != expected:
+            # another request appended meanwhile; reload on next use
+            self.remove(thread_id)
+            return
+        entry.messages.extend(messages)
+        added = sum(message_bytes(m) for m in messages)
+        entry.size += added
+        self.bytes += added
+        self.entries.move_to_end(thread_id)
+        self._evict()
+
+    def record(self, thread_id, entry, messages, expected):
+        """Add a saved turn to the history it was answered from; returns the cached entry, if any.
+
+        `expected` is the number of messages the history held when the request
+        read it. The entry is shared with concurrent requests on the thread, so
+        if one of them recorded its turn meanwhile the histories have diverged
+        and the thread is dropped, to be reloaded from the database.
+        """
+        if thread_id in self.entries:
+            self.append(thread_id, messages, expected)
+            return self.entries.get(thread_id)
+        if len(entry.messages) != expected:
+            return None
+        return self.put(thread_id, entry.messages + list(messages))
+
+    def remove(self, thread_id):
+        entry = self.entries.pop(thread_id, None)
+        if entry is not None:
+            self.bytes -= entry.size
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            _, entry = self.entries.popitem(last=False)
+            self.bytes -= entry.size
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            'threads': len(self.entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'reuse': dict(reuse_stats)
+        }
+
+
+context_cache = ContextCache(int(CONTEXT_CACHE_MB * 1024 * 1024))
+
+
+async def thread_context(db, thread):
+    """Cached history of a thread, read from the database on a miss"""
+    entry = context_cache.get(thread.id, thread.message_count)
+    if entry is None:
+        rows = await db.execute(
+            select(ChatMessage.role, ChatMessage.content)
+            .where(ChatMessage.thread_id == thread.id)
+            .order_by(ChatMessage.created_at, ChatMessage.id)
+        )
+        entry = context_cache.put(thread.id, [{'role': role, 'content': content} for role, content in rows])
+    return entry
+
+
+def token_budget(model):
+    return CONTEXT_TOKEN_BUDGETS.get(model, CONTEXT_TOKEN_BUDGET)
+
+
+def window(entry, budget):
+    """Split history into (system messages, newest turns within budget, first kept index).
+
+    The most recent turn is always kept, even if it alone exceeds the budget.
+    """
+    messages = entry.messages
+    system = messages[:first_turn(messages)]
+    used = sum(estimate_tokens(m) for m in system)
+    if entry.summary:
+        used += estimate_tokens({'content': entry.summary})
+    start = len(messages)
+    floor = max(len(system), entry.summarized)
+    while start > floor:
+        cost = estimate_tokens(messages[start - 1])
+        if used + cost > budget and start < len(messages):
+            break
+        used += cost
+        start -= 1
+    if start < len(messages) - 1 and messages[start]['role'] == 'assistant':
+        start += 1  # don't open the window with an answer whose question was trimmed
+    return system, messages[start:], start
+
+
+def build_context(entry, model, prompt):
+    """Messages to send before the new prompt, trimmed to the model's token budget"""
+    budget = token_budget(model) - estimate_tokens({'content': prompt})
+    system, turns, start = window(entry, budget)
+    context = list(system)
+    if entry.summary:
+        context.append({'role': 'system', 'content': f"Summary of the earlier conversation: {entry.summary}"})
+    context.extend(turns)
+    return context, start
+
+
+reuse_stats = Counter()
+
+
+def reusable_context(entry, model):
+    """generate() arguments continuing the thread from Ollama's saved context, or None.
+
+    The saved context is only valid if it was produced by the same model
+    right after the last message in the history, and it is dropped once it
+    outgrows the model's token budget; the caller then sends the trimmed
+    history instead.
+    """
+    if not CONTEXT_REUSE:
+        return None
+    messages = entry.messages
+    if len(messages) == first_turn(messages):
+        reuse_stats['new_thread'] += 1
+        return {'system': messages[0]['content'] if messages else '', 'context': None}
+    if entry.llm_context is None:
+        reason = 'missing'
+    else:
+        saved_model, length, tokens = entry.llm_context
+        if saved_model != model:
+            reason = 'model_changed'
+        elif length != len(messages):
+            reason = 'stale'
+        elif len(tokens) > token_budget(model):
+            reason = 'over_budget'
+        else:
+            reuse_stats['reused'] += 1
+            reuse_stats['tokens_not_resent'] += sum(estimate_tokens(m) for m in messages)
+            return {'system': '', 'context': tokens}
+    reuse_stats[f'fallback_{reason}'] += 1
+    return None
+
+
+async def summarize(entry, client, upto):
+    """Fold messages [summarized:upto] into the entry's running summary"""
+    try:
+        first = max(entry.summarized, first_turn(entry.messages))
+        transcript = '\n'.join(f"{m['role']}: {m['content']}" for m in entry.messages[first:upto])
+        if entry.summary:
+            transcript = f"Earlier summary: {entry.summary}\n{transcript}"
+        summary = await client.get_chat_response([
+            {'role': 'system', 'content': SUMMARY_PROMPT},
+            {'role': 'user', 'content': transcript}
+        ])
+        entry.summary, entry.summarized = summary.strip(), upto
+    except Exception as e:
+        logging.error(f"Error summarizing conversation: {e}")
+    finally:
+        entry.summarizing = False
+
+
+_summaries = set()  # running summarize() tasks, referenced until done
+
+
+def compact(entry, client, start):
+    """Summarize turns trimmed from the window in the background, if enabled.
+
+    The current request goes out without them; the summary is included from
+    the next turn on.
+    """
+    if not CONTEXT_SUMMARY or entry.summarizing:
+        return
+    if start <= max(entry.summarized, first_turn(entry.messages)):
+        return
+    entry.summarizing = True
+    task = asyncio.ensure_future(summarize(entry, client, start))
+    _summaries.add(task)
+    task.add_done_callback(_summaries.discard)
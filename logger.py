@@ -1,73 +1,276 @@
+import asyncio
 import json
+import logging
+import uuid
+from collections import Counter
 from datetime import datetime, timedelta
 from fastapi import Request
-from sqlalchemy.orm import Session
-from models import Log, get_db
+from sqlalchemy import select, func, insert, case
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from models import Log, LogRollup, get_db, AsyncSessionLocal
+from pagination import keyset, page
+from profiling import span
+from constants import LOG_QUEUE_SIZE, LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL_MS, LOG_ENQUEUE_TIMEOUT_MS
+
+def hour_bucket(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+def rollup_key(created_at, action, status_code, log_metadata):
+    """(bucket, action, model, status_code) row of log_rollups a log counts towards"""
+    model = ''
+    if log_metadata:
+        try:
+            model = json.loads(log_metadata).get('model') or ''
+        except (ValueError, AttributeError):
+            pass
+    return (hour_bucket(created_at), action, model, status_code or 0)
+
+async def add_rollups(db: AsyncSession, counts):
+    """Upsert rollup counts, adding to existing rows"""
+    if not counts:
+        return
+    dialect = postgresql if db.bind.dialect.name == 'postgresql' else sqlite
+    stmt = dialect.insert(LogRollup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['bucket', 'action', 'model', 'status_code'],
+        set_={'count': LogRollup.count + stmt.excluded.count}
+    )
+    await db.execute(stmt, [
+        {'bucket': bucket, 'action': action, 'model': model, 'status_code': status_code, 'count': count}
+        for (bucket, action, model, status_code), count in counts.items()
+    ])
+
+class LogPipeline:
+    """Write-behind queue for activity logs.
+
+    Requests only enqueue a row; a background task inserts them in bulk
+    once `batch_size` rows are waiting or `flush_interval` seconds have
+    passed. The queue is bounded: when it is full a request waits at most
+    `enqueue_timeout` seconds for space, then the row is dropped and counted.
+    """
+
+    def __init__(self, maxsize=10000, batch_size=200, flush_interval=0.5, enqueue_timeout=0.05):
+        self.queue = asyncio.Queue(maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.wake = asyncio.Event()
+        self.task = None
+        self.writing = None
+        self.held = None
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    async def put(self, row):
+        try:
+            self.queue.put_nowait(row)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(self.queue.put(row), self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                self.dropped += 1
+                return False
+        self.enqueued += 1
+        if self.queue.qsize() >= self.batch_size:
+            self.wake.set()
+        return True
+
+    def _drain(self):
+        batch = []
+        while len(batch) < self.batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _write(self, batch):
+        try:
+            counts = Counter(
+                rollup_key(row['created_at'], row['action'], row['status_code'], row['log_metadata'])
+                for row in batch
+            )
+            async with AsyncSessionLocal() as db:
+                # the rollups commit with the rows they count
+                await db.execute(insert(Log), batch)
+                await add_rollups(db, counts)
+                await db.commit()
+            self.written += len(batch)
+            self.batches += 1
+        except Exception as e:
+            self.failed += len(batch)
+            logging.error(f"Error writing {len(batch)} activity logs: {e}")
+
+    async def _run(self):
+        while True:
+            first = await self.queue.get()
+            if self.queue.qsize() + 1 < self.batch_size:
+                # linger so a burst shares one insert, unless the batch fills first
+                self.wake.clear()
+                try:
+                    await asyncio.wait_for(self.wake.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                except asyncio.CancelledError:
+                    # hand the row back so stop() flushes it with the rest
+                    self.held = first
+                    raise
+            batch = [first] + self._drain()
+            # shielded so shutdown never cancels a half-written batch
+            self.writing = asyncio.ensure_future(self._write(batch))
+            await asyncio.shield(self.writing)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Stop the writer and flush everything still queued"""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.writing is not None:
+            await self.writing
+        if self.held is not None:
+            await self._write([self.held] + self._drain())
+            self.held = None
+        while not self.queue.empty():
+            await self._write(self._drain())
+
+    def stats(self):
+        return {
+            'queued': self.queue.qsize(),
+            'capacity': self.queue.maxsize,
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'batches': self.batches
+        }
+
+log_pipeline = LogPipeline(
+    LOG_QUEUE_SIZE, LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL_MS / 1000.0, LOG_ENQUEUE_TIMEOUT_MS / 1000.0
+)
 
 class ActivityLogger:
     """Log user activities with metadata"""
     
     @staticmethod
-    def log(db: Session, user_id: str, action: str, status_code: int = None, metadata: dict = None, request: Request = None):
-        """Log an activity"""
+    async def log(user_id: str, action: str, status_code: int = None, metadata: dict = None, request: Request = None):
+        """Queue an activity for the background log writer"""
         try:
-            log_entry = Log(
-                user_id=user_id,
-                action=action,
-                endpoint=request.url.path if request else None,
-                method=request.method if request else None,
-                status_code=status_code,
-                log_metadata=json.dumps(metadata) if metadata else None,
-                ip_address=request.client.host if request else None,
-                user_agent=request.headers.get('user-agent') if request else None
-            )
-            db.add(log_entry)
-            db.commit()
+            with span('log'):
+                await log_pipeline.put({
+                    'id': str(uuid.uuid4()),
+                    'user_id': user_id,
+                    'action': action,
+                    'endpoint': request.url.path if request else None,
+                    'method': request.method if request else None,
+                    'status_code': status_code,
+                    'log_metadata': json.dumps(metadata) if metadata else None,
+                    'ip_address': request.client.host if request else None,
+                    'user_agent': request.headers.get('user-agent') if request else None,
+                    'created_at': datetime.utcnow()
+                })
         except Exception as e:
             # Don't fail the request if logging fails
             print(f"Error logging activity: {e}")
-            db.rollback()
     
     @staticmethod
-    def get_logs(db: Session, user_id: str = None, action: str = None, limit: int = 100, offset: int = 0):
-        """Retrieve logs with optional filters"""
-        query = db.query(Log)
+    async def get_logs(db: AsyncSession, user_id: str = None, action: str = None, limit: int = 100,
+                       cursor: str = None, exact_total: bool = False):
+        """Retrieve a page of logs with optional filters.
+
+        `total` is an exact COUNT only when exact_total is set. Otherwise it
+        is read from the hourly rollups (which lag by up to one flush
+        interval), or left as None when filtering by user, which the rollups
+        do not track.
+        """
+        query = select(Log)
         
         if user_id:
-            query = query.filter(Log.user_id == user_id)
+            query = query.where(Log.user_id == user_id)
         if action:
-            query = query.filter(Log.action == action)
+            query = query.where(Log.action == action)
+        
+        if exact_total:
+            total = await db.scalar(select(func.count()).select_from(query.subquery()))
+        elif user_id:
+            total = None
+        else:
+            estimate = select(func.coalesce(func.sum(LogRollup.count), 0))
+            if action:
+                estimate = estimate.where(LogRollup.action == action)
+            total = await db.scalar(estimate)
         
-        query = query.order_by(Log.created_at.desc())
-        total = query.count()
-        logs = query.limit(limit).offset(offset).all()
+        query = keyset(query.options(selectinload(Log.user)), Log.created_at, Log.id, cursor, limit)
+        logs, next_cursor = page(await db.scalars(query), limit, 'created_at')
         
         return {
             'logs': [log.to_dict() for log in logs],
             'total': total,
+            'total_exact': exact_total,
             'limit': limit,
-            'offset': offset
+            'next_cursor': next_cursor
         }
     
     @staticmethod
-    def get_telemetry(db: Session):
-        """Get telemetry data for dashboard"""
+    async def get_telemetry(db: AsyncSession, hours: int = 24):
+        """Get telemetry data for dashboard.
+
+        Log figures come from the hourly rollups, so the cost depends on the
+        number of hours and distinct actions rather than on the size of the
+        logs table.
+        """
         from models import User, ChatThread, ChatMessage
         
-        total_users = db.query(User).count()
-        active_users = db.query(User).filter(User.is_active == True).count()
-        total_chats = db.query(ChatThread).count()
-        total_messages = db.query(ChatMessage).count()
+        total_users = await db.scalar(select(func.count()).select_from(User))
+        active_users = await db.scalar(select(func.count()).select_from(User).where(User.is_active == True))
+        total_chats = await db.scalar(select(func.count()).select_from(ChatThread))
+        total_messages = await db.scalar(select(func.count()).select_from(ChatMessage))
+        
+        total = func.sum(LogRollup.count)
+        errors = func.sum(case((LogRollup.status_code >= 400, LogRollup.count), else_=0))
         
         # Get logs by action
-        action_counts = {}
-        logs = db.query(Log).all()
-        for log in logs:
-            action_counts[log.action] = action_counts.get(log.action, 0) + 1
+        rows = await db.execute(select(LogRollup.action, total).group_by(LogRollup.action))
+        action_counts = {action: count for action, count in rows}
+        
+        rows = await db.execute(
+            select(LogRollup.model, total, errors)
+            .where(LogRollup.action == 'chat_request', LogRollup.model != '')
+            .group_by(LogRollup.model)
+        )
+        model_counts = {model: {'requests': count, 'errors': failed} for model, count, failed in rows}
+        
+        rows = await db.execute(
+            select(LogRollup.status_code, total).where(LogRollup.status_code != 0).group_by(LogRollup.status_code)
+        )
+        status_counts = {str(code): count for code, count in rows}
+        
+        # Get recent activity, one point per hour
+        since = hour_bucket(datetime.utcnow() - timedelta(hours=hours - 1))
+        rows = await db.execute(
+            select(LogRollup.bucket, total, errors)
+            .where(LogRollup.bucket >= since)
+            .group_by(LogRollup.bucket)
+            .order_by(LogRollup.bucket)
+        )
+        hourly = {bucket: (count, failed) for bucket, count, failed in rows}
+        hourly_activity = []
+        for i in range(hours):
+            bucket = since + timedelta(hours=i)
+            count, failed = hourly.get(bucket, (0, 0))
+            hourly_activity.append({'bucket': bucket.isoformat(), 'requests': count, 'errors': failed})
         
-        # Get recent activity (last 24 hours)
-        yesterday = datetime.utcnow() - timedelta(days=1)
-        recent_logs = db.query(Log).filter(Log.created_at >= yesterday).count()
+        yesterday = hour_bucket(datetime.utcnow() - timedelta(hours=23))
+        recent_logs = await db.scalar(select(func.coalesce(total, 0)).where(LogRollup.bucket >= yesterday))
         
         return {
             'total_users': total_users,
@@ -75,5 +278,9 @@ class ActivityLogger:
             'total_chats': total_chats,
             'total_messages': total_messages,
             'action_counts': action_counts,
-            'recent_activity_24h': recent_logs
+            'model_counts': model_counts,
+            'status_counts': status_counts,
+            'recent_activity_24h': recent_logs,
+            'hourly_activity': hourly_activity,
+            'activity_log_pipeline': log_pipeline.stats()
         }
@@ -1,26 +1,42 @@
+import asyncio
+import json
 import logging
 import uuid
 import os
-from datetime import datetime
 from fastapi import FastAPI, Depends, HTTPException, Request, status, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
-from constants import DEFAULT_MODEL, SYSTEM_PROMPT
+from constants import DEFAULT_MODEL, SYSTEM_PROMPT, CACHE_WARM_ENTRIES, SERVER_TIMING, PROFILER_INTERVAL_MS
 from models import (
-    init_db, get_db, User, ChatThread, ChatMessage, Model, APIKey, Log
+    init_db, get_db, async_engine, AsyncSessionLocal, User, ChatThread, ChatMessage, Model, APIKey, Log
 )
 from auth import (
-    generate_token, verify_token, get_current_user, require_auth, require_admin, require_developer
+    generate_token, verify_token, get_current_user, require_auth, require_admin, require_developer,
+    invalidate_user, principal_cache, token_cache
+)
+from logger import ActivityLogger, log_pipeline
+from ollama_client import OllamaClient, BackendUnavailable, close_async_clients, prompt_eval_stats, pool as ollama_pool
+from caching import create_cache_manager, context_digest
+from coalescing import SingleFlight, flight_key
+from pagination import keyset, page
+from passwords import HasherBusy, hash_password, verify_password, needs_rehash
+from context import ThreadContext, context_cache, thread_context, build_context, compact, reusable_context
+from profiling import TimingMiddleware, span, stage_stats, profiler
+from metrics import (
+    registry, exporter, chat_in_flight, cache_hits, cache_misses, cache_entries, cache_capacity,
+    db_pool, log_queue_depth, log_queue_capacity, log_rows, ollama_outstanding, ollama_up
 )
-from logger import ActivityLogger
-from ollama_client import OllamaClient
-from caching import CacheManager
 from schemas import (
     RegisterRequest, LoginRequest, LoginResponse,
     ChatRequest, ChatResponse,
     CreateAPIKeyRequest, AddModelRequest, UpdateModelRequest,
-    UpdateUserRoleRequest, UpdateUserStatusRequest, DatabaseQueryRequest
+    UpdateUserRoleRequest, UpdateUserStatusRequest, DatabaseQueryRequest,
+    UpdateCacheConfigRequest
 )
 
 app = FastAPI(title="AI Chat Application", version="1.0.0")
@@ -32,34 +48,39 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
-cache_manager = CacheManager()
+# Per-stage request timing (Server-Timing header and /api/admin/profiling/stages)
+app.add_middleware(TimingMiddleware, header=SERVER_TIMING)
+
+cache_manager = create_cache_manager()
+inflight = SingleFlight()
 logging.basicConfig(level=logging.INFO)
 
 # Initialize database
 init_db()
 
 # Create default admin user and models
-def init_default_data():
-    db = next(get_db())
+async def init_default_data():
+    db = AsyncSessionLocal()
     try:
         # Create default admin user if it doesn't exist
-        if not db.query(User).filter(User.username == 'admin').first():
+        if not await db.scalar(select(User).where(User.username == 'admin')):
             admin = User(
                 username='admin',
                 email='admin@example.com',
                 role='admin'
             )
-            admin.set_password('admin123')  # Change this in production!
+            admin.password_hash = await hash_password('admin123')  # Change this in production!
             db.add(admin)
-            db.commit()
+            await db.commit()
             logging.info("Default admin user created: admin/admin123")
         
         # Add default models if they don't exist
         default_models = ['gemma2:2b', 'llama2', 'mistral']
         for model_name in default_models:
-            if not db.query(Model).filter(Model.name == model_name).first():
+            if not await db.scalar(select(Model).where(Model.name == model_name)):
                 model = Model(
                     name=model_name,
                     display_name=model_name.replace(':', ' ').title(),
@@ -67,17 +88,78 @@ def init_default_data():
                     is_enabled=True
                 )
                 db.add(model)
-        db.commit()
+        await db.commit()
     except Exception as e:
         logging.error(f"Error initializing default data: {e}")
-        db.rollback()
+        await db.rollback()
     finally:
-        db.close()
+        await db.close()
 
 # Initialize on startup
 @app.on_event("startup")
 async def startup_event():
-    init_default_data()
+    await init_default_data()
+    log_pipeline.start()
+    exporter.start()
+    ollama_pool.start()
+    # Refill the response cache from disk without holding up readiness
+    cache_manager.warm_start(CACHE_WARM_ENTRIES)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await ollama_pool.stop()
+    await close_async_clients()
+    # Flush queued activity logs before the process exits
+    await log_pipeline.stop()
+    profiler.stop()
+    exporter.stop()
+    cache_manager.close()
+
+async def generate_response(ollama_client, messages, prompt, scope, stream, reuse=None, state=None):
+    """Produce the LLM response in chunks and cache it once complete.
+
+    With `reuse` (see context.reusable_context) only the prompt is sent,
+    continuing from the thread's saved Ollama context; the next context
+    is left in state['context'].
+    """
+    chunks = []
+    if reuse is not None and stream:
+        async for chunk in ollama_client.stream_context_response(prompt, state=state, **reuse):
+            chunks.append(chunk)
+            yield chunk
+    elif reuse is not None:
+        response = await ollama_client.get_context_response(prompt, state=state, **reuse)
+        chunks.append(response)
+        yield response
+    elif stream:
+        async for chunk in ollama_client.stream_chat_response(messages):
+            chunks.append(chunk)
+            yield chunk
+    else:
+        response = await ollama_client.get_chat_response(messages)
+        chunks.append(response)
+        yield response
+    await run_in_threadpool(cache_manager.set, ollama_client.model, prompt, ''.join(chunks), scope)
+
+# How often a pending LLM call checks whether its HTTP client is still connected
+DISCONNECT_POLL_INTERVAL = 0.5
+
+class ClientDisconnected(Exception):
+    """Raised when the HTTP client goes away before the LLM call finishes"""
+
+async def cancel_on_disconnect(request: Request, coro):
+    """Await an LLM call, cancelling it as soon as the HTTP client disconnects"""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
 
 
 # ==================== AUTHENTICATION ENDPOINTS ====================
@@ -86,7 +168,7 @@ async def startup_event():
 async def register(
     data: RegisterRequest,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Register a new user"""
     try:
@@ -99,7 +181,7 @@ async def register(
                 token = auth_header.split(' ')[1]
                 payload = verify_token(token)
                 if payload:
-                    current_user_obj = db.query(User).filter(User.id == payload['user_id']).first()
+                    current_user_obj = await db.scalar(select(User).where(User.id == payload['user_id']))
         except:
             pass
        
@@ -111,12 +193,12 @@ async def register(
                 )
        
         # Check if user already exists
-        if db.query(User).filter(User.username == data.username).first():
+        if await db.scalar(select(User).where(User.username == data.username)):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Username already exists"
             )
-        if db.query(User).filter(User.email == data.email).first():
+        if await db.scalar(select(User).where(User.email == data.email)):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Email already exists"
@@ -124,12 +206,12 @@ async def register(
        
         # Create user
         user = User(username=data.username, email=data.email, role=data.role)
-        user.set_password(data.password)
+        user.password_hash = await hash_password(data.password)
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
        
-        ActivityLogger.log(db, user.id, 'user_registered', 201, {'username': data.username, 'role': data.role}, request)
+        await ActivityLogger.log(user.id, 'user_registered', 201, {'username': data.username, 'role': data.role}, request)
        
         return {
             'message': 'User registered successfully',
@@ -138,9 +220,14 @@ async def register(
    
     except HTTPException:
         raise
+    except HasherBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many sign-ups in progress, try again shortly"
+        )
     except Exception as e:
         logging.error(f"Registration error: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Registration failed"
@@ -150,14 +237,14 @@ async def register(
 async def login(
     data: LoginRequest,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Login user and return JWT token"""
     try:
-        user = db.query(User).filter(User.username == data.username).first()
+        user = await db.scalar(select(User).where(User.username == data.username))
        
-        if not user or not user.check_password(data.password):
-            ActivityLogger.log(db, None, 'login_failed', 401, {'username': data.username}, request)
+        if not user or not await verify_password(user.password_hash, data.password):
+            await ActivityLogger.log(None, 'login_failed', 401, {'username': data.username}, request)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid credentials"
@@ -169,13 +256,23 @@ async def login(
                 detail="Account is inactive"
             )
        
+        # Upgrade hashes made with older parameters while the password is at hand
+        if await needs_rehash(user.password_hash):
+            user.password_hash = await hash_password(data.password)
+            await db.commit()
+        
         token = generate_token(user.id, user.role)
-        ActivityLogger.log(db, user.id, 'login', 200, {'username': data.username}, request)
+        await ActivityLogger.log(user.id, 'login', 200, {'username': data.username}, request)
        
         return LoginResponse(token=token, user=user.to_dict())
    
     except HTTPException:
         raise
+    except HasherBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many logins in progress, try again shortly"
+        )
     except Exception as e:
         logging.error(f"Login error: {e}")
         raise HTTPException(
@@ -186,11 +283,10 @@ async def login(
 @app.post("/api/auth/logout")
 async def logout(
     request: Request,
-    current_user: User = Depends(require_auth),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(require_auth)
 ):
     """Logout user"""
-    ActivityLogger.log(db, current_user.id, 'logout', 200, None, request)
+    await ActivityLogger.log(current_user.id, 'logout', 200, None, request)
     return {'message': 'Logged out successfully'}
 
 @app.get("/api/auth/me")
@@ -205,23 +301,24 @@ async def get_response_from_llm(
     data: ChatRequest,
     current_user: User = Depends(require_auth),
     request: Request = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Get response from LLM"""
     try:
         model_name = data.model or DEFAULT_MODEL
         
         if not data.prompt:
-            ActivityLogger.log(db, current_user.id, 'chat_request', 400, {'error': 'No prompt'}, request)
+            await ActivityLogger.log(current_user.id, 'chat_request', 400, {'error': 'No prompt'}, request)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Prompt is required"
             )
         
         # Verify model exists and is enabled
-        model = db.query(Model).filter(Model.name == model_name, Model.is_enabled == True).first()
+        with span('model'):
+            model = await db.scalar(select(Model).where(Model.name == model_name, Model.is_enabled == True))
         if not model:
-            ActivityLogger.log(db, current_user.id, 'chat_request', 400, {'error': 'Invalid model', 'model': model_name}, request)
+            await ActivityLogger.log(current_user.id, 'chat_request', 400, {'error': 'Invalid model', 'model': model_name}, request)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Model not found or disabled"
@@ -229,113 +326,311 @@ async def get_response_from_llm(
         
         ollama_client = OllamaClient(model=model_name)
         
+        # A new thread is only written after the LLM answers, so no write
+        # transaction stays open while other requests run during the await
+        is_new_thread = not data.thread_id
+        if is_new_thread:
+            history = ThreadContext([{"role": "system", "content": SYSTEM_PROMPT}])
+        else:
+            with span('history'):
+                thread = await db.scalar(select(ChatThread).where(ChatThread.id == data.thread_id))
+                if not thread or thread.user_id != current_user.id:
+                    raise HTTPException(
+                        status_code=status.HTTP_403_FORBIDDEN,
+                        detail="Invalid thread"
+                    )
+                
+                # Load previous messages, from memory when this worker has the thread cached
+                history = await thread_context(db, thread)
+        # The cached history is shared with concurrent turns on this thread; note how much of it this turn saw
+        history_length = len(history.messages)
+        previous_messages, window_start = build_context(history, model_name, data.prompt)
+        
+        # Cached answers are only reused within the same model and conversation context
+        scope = context_digest(previous_messages)
+        
         # Try cache first
-        cached_response = cache_manager.get(data.prompt)
+        with span('cache'):
+            cached_response = await run_in_threadpool(cache_manager.get, model_name, data.prompt, scope)
         if cached_response is not None:
             logging.info("Cache hit! Returning cached response.")
             
-            if not data.thread_id:
-                thread = ChatThread(user_id=current_user.id, model_used=model_name, title=data.prompt[:50])
-                db.add(thread)
-                db.flush()
-                data.thread_id = thread.id
+            with span('commit'):
+                new_messages = []
+                if is_new_thread:
+                    thread = ChatThread(user_id=current_user.id, model_used=model_name, title=data.prompt[:50])
+                    db.add(thread)
+                    await db.flush()
+                    data.thread_id = thread.id
+                    
+                    # Save system message
+                    new_messages.append(ChatMessage(thread_id=thread.id, role='system', content=SYSTEM_PROMPT))
                 
-                # Save system message
-                system_msg = ChatMessage(thread_id=thread.id, role='system', content=SYSTEM_PROMPT)
-                db.add(system_msg)
-            
-            thread = db.query(ChatThread).filter(ChatThread.id == data.thread_id).first()
-            if not thread or thread.user_id != current_user.id:
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="Invalid thread"
-                )
-            
-            # Save user message
-            user_msg = ChatMessage(thread_id=data.thread_id, role='user', content=data.prompt)
-            db.add(user_msg)
-            
-            # Save assistant response
-            assistant_msg = ChatMessage(thread_id=data.thread_id, role='assistant', content=cached_response)
-            db.add(assistant_msg)
-            
-            thread.updated_at = datetime.utcnow()
-            db.commit()
+                # Save user message and assistant response
+                new_messages.append(ChatMessage(thread_id=data.thread_id, role='user', content=data.prompt))
+                new_messages.append(ChatMessage(thread_id=data.thread_id, role='assistant', content=cached_response))
+                db.add_all(new_messages)
+                thread.add_messages(*new_messages)
+                await db.commit()
+            remember_turn(data.thread_id, history, history_length, new_messages, ollama_client, window_start, {})
             
-            ActivityLogger.log(db, current_user.id, 'chat_request', 200, {'model': model_name, 'cached': True}, request)
+            await ActivityLogger.log(current_user.id, 'chat_request', 200, {'model': model_name, 'cached': True}, request)
             return ChatResponse(response=cached_response, thread_id=data.thread_id)
         
-        # Create new thread if needed
-        if not data.thread_id:
-            thread = ChatThread(user_id=current_user.id, model_used=model_name, title=data.prompt[:50])
-            db.add(thread)
-            db.flush()
-            data.thread_id = thread.id
-            
-            # Save system message
-            system_msg = ChatMessage(thread_id=thread.id, role='system', content=SYSTEM_PROMPT)
-            db.add(system_msg)
-        else:
-            thread = db.query(ChatThread).filter(ChatThread.id == data.thread_id).first()
-            if not thread or thread.user_id != current_user.id:
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="Invalid thread"
-                )
-        
-        # Load previous messages
-        previous_messages = []
-        messages = db.query(ChatMessage).filter(ChatMessage.thread_id == data.thread_id).order_by(ChatMessage.created_at).all()
-        for msg in messages:
-            previous_messages.append({"role": msg.role, "content": msg.content})
-        
         previous_messages.append({"role": "user", "content": data.prompt})
+        reuse, generation = reusable_context(history, model_name), {}
+        
+        # Hand the pooled connection back while the LLM generates
+        with span('commit'):
+            await db.commit()
         
-        # Get response from LLM
+        # Get response from LLM, sharing one generation between identical in-flight prompts
+        key = flight_key(model_name, data.prompt, scope)
+        coalesced = key in inflight.flights
         try:
-            response = ollama_client.get_chat_response(previous_messages)
+            with span('llm'), chat_in_flight.track((model_name,)):
+                response = await cancel_on_disconnect(request, inflight.do(
+                    key, lambda: generate_response(
+                        ollama_client, previous_messages, data.prompt, scope, stream=False, reuse=reuse, state=generation
+                    )
+                ))
+        except ClientDisconnected:
+            logging.info("Client disconnected, cancelled LLM request")
+            await ActivityLogger.log(current_user.id, 'chat_request', 499, {'error': 'Client disconnected', 'model': model_name}, request)
+            raise HTTPException(
+                status_code=499,
+                detail="Client disconnected"
+            )
+        except BackendUnavailable as e:
+            logging.warning(f"No Ollama host available: {e}")
+            await ActivityLogger.log(current_user.id, 'chat_request', 503, {'error': str(e), 'model': model_name}, request)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="All model servers are busy, try again shortly"
+            )
         except Exception as e:
             logging.error(f"Error getting response from OllamaClient: {e}")
-            ActivityLogger.log(db, current_user.id, 'chat_request', 500, {'error': str(e), 'model': model_name}, request)
+            await ActivityLogger.log(current_user.id, 'chat_request', 500, {'error': str(e), 'model': model_name}, request)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Could not get response from LLM"
             )
         
-        # Save messages
-        user_msg = ChatMessage(thread_id=data.thread_id, role='user', content=data.prompt)
-        assistant_msg = ChatMessage(thread_id=data.thread_id, role='assistant', content=response)
-        db.add(user_msg)
-        db.add(assistant_msg)
-        thread.updated_at = datetime.utcnow()
-        db.commit()
-        
-        # Save to cache
-        cache_manager.set(data.prompt, response)
+        with span('commit'):
+            # Create new thread if needed
+            new_messages = []
+            if is_new_thread:
+                thread = ChatThread(user_id=current_user.id, model_used=model_name, title=data.prompt[:50])
+                db.add(thread)
+                await db.flush()
+                data.thread_id = thread.id
+                
+                # Save system message
+                new_messages.append(ChatMessage(thread_id=thread.id, role='system', content=SYSTEM_PROMPT))
+            
+            # Save messages
+            new_messages.append(ChatMessage(thread_id=data.thread_id, role='user', content=data.prompt))
+            new_messages.append(ChatMessage(thread_id=data.thread_id, role='assistant', content=response))
+            db.add_all(new_messages)
+            thread.add_messages(*new_messages)
+            await db.commit()
+        remember_turn(data.thread_id, history, history_length, new_messages, ollama_client, window_start, generation)
         
-        ActivityLogger.log(db, current_user.id, 'chat_request', 200, {'model': model_name, 'cached': False}, request)
+        await ActivityLogger.log(current_user.id, 'chat_request', 200, {'model': model_name, 'cached': False, 'coalesced': coalesced}, request)
         return ChatResponse(response=response, thread_id=data.thread_id)
     
     except HTTPException:
         raise
     except Exception as e:
         logging.error(f"Error processing chat request: {e}")
-        db.rollback()
-        ActivityLogger.log(db, current_user.id, 'chat_request', 500, {'error': str(e)}, request)
+        await db.rollback()
+        await ActivityLogger.log(current_user.id, 'chat_request', 500, {'error': str(e)}, request)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Internal server error"
         )
 
+def remember_turn(thread_id, history, history_length, saved, ollama_client, window_start, generation):
+    """Append a committed turn to the in-memory thread history it was answered from.
+
+    `history_length` is the number of messages the history held when the
+    request read it; if another turn was recorded since, the thread is
+    dropped from the cache instead.
+
+    If the answer came with an Ollama context, keep it for the next turn;
+    otherwise compact whatever fell out of the history window.
+    """
+    turn = [{'role': message.role, 'content': message.content} for message in saved[-2:]]
+    entry = context_cache.record(thread_id, history, turn, history_length)
+    if entry is None or len(entry.messages) != history_length + len(turn):
+        # Overlapped another turn: this answer's Ollama context never saw that
+        # turn, so it must not be continued from
+        history.llm_context = None
+        return
+    if generation.get('context'):
+        entry.llm_context = (ollama_client.model, len(entry.messages), generation['context'])
+    else:
+        compact(entry, ollama_client, window_start)
+
+def sse_event(event: str, data: dict) -> str:
+    """Format a single Server-Sent Event frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/api/chat/stream")
+async def stream_response_from_llm(
+    data: ChatRequest,
+    current_user: User = Depends(require_auth),
+    request: Request = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """Stream response from LLM token by token as Server-Sent Events"""
+    model_name = data.model or DEFAULT_MODEL
+    
+    if not data.prompt:
+        await ActivityLogger.log(current_user.id, 'chat_request', 400, {'error': 'No prompt', 'stream': True}, request)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Prompt is required"
+        )
+    
+    # Verify model exists and is enabled
+    with span('model'):
+        model = await db.scalar(select(Model).where(Model.name == model_name, Model.is_enabled == True))
+    if not model:
+        await ActivityLogger.log(current_user.id, 'chat_request', 400, {'error': 'Invalid model', 'model': model_name, 'stream': True}, request)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Model not found or disabled"
+        )
+    
+    # Validate the thread before the stream starts so errors still map to HTTP status codes
+    is_new_thread = not data.thread_id
+    if is_new_thread:
+        thread_id = str(uuid.uuid4())
+    else:
+        with span('history'):
+            thread = await db.scalar(select(ChatThread).where(ChatThread.id == data.thread_id))
+            if not thread or thread.user_id != current_user.id:
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail="Invalid thread"
+                )
+            thread_id = thread.id
+    
+    user_id = current_user.id
+    if is_new_thread:
+        history = ThreadContext([{"role": "system", "content": SYSTEM_PROMPT}])
+    else:
+        with span('history'):
+            history = await thread_context(db, thread)
+    history_length = len(history.messages)
+    previous_messages, window_start = build_context(history, model_name, data.prompt)
+    
+    # Cached answers are only reused within the same model and conversation context
+    scope = context_digest(previous_messages)
+    with span('cache'):
+        cached_response = await run_in_threadpool(cache_manager.get, model_name, data.prompt, scope)
+    previous_messages.append({"role": "user", "content": data.prompt})
+    reuse = reusable_context(history, model_name) if cached_response is None else None
+    generation = {}
+    
+    ollama_client = OllamaClient(model=model_name)
+    
+    async def event_stream():
+        yield sse_event('thread', {'thread_id': thread_id})
+        
+        if cached_response is not None:
+            logging.info("Cache hit! Streaming cached response.")
+            response = cached_response
+            yield sse_event('token', {'content': cached_response})
+        else:
+            chunks = []
+            key = flight_key(model_name, data.prompt, scope)
+            coalesced = key in inflight.flights
+            try:
+                with span('llm'), chat_in_flight.track((model_name,)):
+                    async for chunk in inflight.stream(
+                        key, lambda: generate_response(
+                            ollama_client, previous_messages, data.prompt, scope, stream=True, reuse=reuse, state=generation
+                        )
+                    ):
+                        chunks.append(chunk)
+                        yield sse_event('token', {'content': chunk})
+            except BackendUnavailable as e:
+                logging.warning(f"No Ollama host available: {e}")
+                await ActivityLogger.log(user_id, 'chat_request', 503, {'error': str(e), 'model': model_name, 'stream': True}, request)
+                yield sse_event('error', {'detail': "All model servers are busy, try again shortly"})
+                return
+            except Exception as e:
+                logging.error(f"Error streaming response from OllamaClient: {e}")
+                await ActivityLogger.log(user_id, 'chat_request', 500, {'error': str(e), 'model': model_name, 'stream': True}, request)
+                yield sse_event('error', {'detail': "Could not get response from LLM"})
+                return
+            response = ''.join(chunks)
+        
+        # Persist the turn once the full response is known
+        stream_db = AsyncSessionLocal()
+        try:
+            with span('commit'):
+                new_messages = []
+                if is_new_thread:
+                    thread = ChatThread(id=thread_id, user_id=user_id, model_used=model_name, title=data.prompt[:50])
+                    stream_db.add(thread)
+                    await stream_db.flush()
+                    
+                    # Save system message
+                    new_messages.append(ChatMessage(thread_id=thread_id, role='system', content=SYSTEM_PROMPT))
+                else:
+                    thread = await stream_db.scalar(select(ChatThread).where(ChatThread.id == thread_id))
+                
+                new_messages.append(ChatMessage(thread_id=thread_id, role='user', content=data.prompt))
+                new_messages.append(ChatMessage(thread_id=thread_id, role='assistant', content=response))
+                stream_db.add_all(new_messages)
+                thread.add_messages(*new_messages)
+                await stream_db.commit()
+            remember_turn(thread_id, history, history_length, new_messages, ollama_client, window_start, generation)
+            
+            metadata = {'model': model_name, 'cached': cached_response is not None, 'stream': True}
+            if cached_response is None:
+                metadata['coalesced'] = coalesced
+            await ActivityLogger.log(user_id, 'chat_request', 200, metadata, request)
+        except Exception as e:
+            logging.error(f"Error saving streamed chat: {e}")
+            await stream_db.rollback()
+            await ActivityLogger.log(user_id, 'chat_request', 500, {'error': str(e), 'stream': True}, request)
+            yield sse_event('error', {'detail': "Internal server error"})
+            return
+        finally:
+            await stream_db.close()
+        
+        yield sse_event('done', {'thread_id': thread_id, 'cached': cached_response is not None})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.get("/api/chat/threads")
 async def get_chat_threads(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str = Query(None),
     current_user: User = Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get all chat threads for current user"""
+    """Get the current user's chat threads, most recently updated first"""
     try:
-        threads = db.query(ChatThread).filter(ChatThread.user_id == current_user.id).order_by(ChatThread.updated_at.desc()).all()
-        return [thread.to_dict() for thread in threads]
+        query = keyset(
+            select(ChatThread).where(ChatThread.user_id == current_user.id),
+            ChatThread.updated_at, ChatThread.id, cursor, limit
+        )
+        threads, next_cursor = page(await db.scalars(query), limit, 'updated_at')
+        return {'threads': [thread.to_dict() for thread in threads], 'next_cursor': next_cursor}
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         logging.error(f"Error getting threads: {e}")
         raise HTTPException(
@@ -346,12 +641,14 @@ async def get_chat_threads(
 @app.get("/api/chat/threads/{thread_id}")
 async def get_chat_thread(
     thread_id: str,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: str = Query(None),
     current_user: User = Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get a specific chat thread with messages"""
+    """Get a chat thread with its latest messages; next_cursor pages back to older ones"""
     try:
-        thread = db.query(ChatThread).filter(ChatThread.id == thread_id).first()
+        thread = await db.scalar(select(ChatThread).where(ChatThread.id == thread_id))
         
         if not thread or thread.user_id != current_user.id:
             raise HTTPException(
@@ -359,13 +656,25 @@ async def get_chat_thread(
                 detail="Thread not found"
             )
         
-        messages = db.query(ChatMessage).filter(ChatMessage.thread_id == thread_id).order_by(ChatMessage.created_at).all()
+        query = keyset(
+            select(ChatMessage).where(ChatMessage.thread_id == thread_id),
+            ChatMessage.created_at, ChatMessage.id, cursor, limit
+        )
+        messages, next_cursor = page(await db.scalars(query), limit, 'created_at')
+        
+        # pages are fetched newest first but each is returned in chronological order
         thread_dict = thread.to_dict()
-        thread_dict['messages'] = [msg.to_dict() for msg in messages]
+        thread_dict['messages'] = [msg.to_dict() for msg in reversed(messages)]
+        thread_dict['next_cursor'] = next_cursor
         
         return thread_dict
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         logging.error(f"Error getting thread: {e}")
         raise HTTPException(
@@ -376,11 +685,11 @@ async def get_chat_thread(
 @app.get("/api/models")
 async def get_models(
     current_user: User = Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Get all enabled models"""
     try:
-        models = db.query(Model).filter(Model.is_enabled == True).all()
+        models = await db.scalars(select(Model).where(Model.is_enabled == True))
         return [model.to_dict() for model in models]
     except Exception as e:
         logging.error(f"Error getting models: {e}")
@@ -394,11 +703,15 @@ async def get_models(
 @app.get("/api/developer/api-keys")
 async def get_api_keys(
     current_user: User = Depends(require_developer),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Get API keys for enabled models"""
     try:
-        api_keys = db.query(APIKey).filter(APIKey.user_id == current_user.id, APIKey.is_active == True).all()
+        api_keys = await db.scalars(
+            select(APIKey)
+            .options(selectinload(APIKey.model))
+            .where(APIKey.user_id == current_user.id, APIKey.is_active == True)
+        )
         return [key.to_dict(include_key=True) for key in api_keys]
     except Exception as e:
         logging.error(f"Error getting API keys: {e}")
@@ -412,11 +725,11 @@ async def create_api_key(
     data: CreateAPIKeyRequest,
     current_user: User = Depends(require_developer),
     request: Request = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Create API key for a model"""
     try:
-        model = db.query(Model).filter(Model.id == data.model_id).first()
+        model = await db.scalar(select(Model).where(Model.id == data.model_id))
         if not model or not model.is_enabled:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -432,16 +745,16 @@ async def create_api_key(
             key_value=api_key_value
         )
         db.add(api_key)
-        db.commit()
-        db.refresh(api_key)
+        await db.commit()
+        await db.refresh(api_key, ['model'])
         
-        ActivityLogger.log(db, current_user.id, 'api_key_created', 201, {'model_id': data.model_id}, request)
+        await ActivityLogger.log(current_user.id, 'api_key_created', 201, {'model_id': data.model_id}, request)
         return api_key.to_dict(include_key=True)
     except HTTPException:
         raise
     except Exception as e:
         logging.error(f"Error creating API key: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to create API key"
@@ -452,11 +765,11 @@ async def delete_api_key(
     key_id: str,
     current_user: User = Depends(require_developer),
     request: Request = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Delete an API key"""
     try:
-        api_key = db.query(APIKey).filter(APIKey.id == key_id).first()
+        api_key = await db.scalar(select(APIKey).where(APIKey.id == key_id))
         
         if not api_key or api_key.user_id != current_user.id:
             raise HTTPException(
@@ -465,15 +778,15 @@ async def delete_api_key(
             )
         
         api_key.is_active = False
-        db.commit()
+        await db.commit()
         
-        ActivityLogger.log(db, current_user.id, 'api_key_deleted', 200, {'key_id': key_id}, request)
+        await ActivityLogger.log(current_user.id, 'api_key_deleted', 200, {'key_id': key_id}, request)
         return {"message": "API key deleted"}
     except HTTPException:
         raise
     except Exception as e:
         logging.error(f"Error deleting API key: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to delete API key"
@@ -485,15 +798,23 @@ async def delete_api_key(
 async def get_logs(
     user_id: str = Query(None),
     action: str = Query(None),
-    limit: int = Query(100),
-    offset: int = Query(0),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str = Query(None),
+    exact_total: bool = Query(False),
     current_user: User = Depends(require_admin),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get logs with optional filters"""
+    """Get logs with optional filters, newest first"""
     try:
-        result = ActivityLogger.get_logs(db, user_id=user_id, action=action, limit=limit, offset=offset)
+        result = await ActivityLogger.get_logs(
+            db, user_id=user_id, action=action, limit=limit, cursor=cursor, exact_total=exact_total
+        )
         return result
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         logging.error(f"Error getting logs: {e}")
         raise HTTPException(
@@ -503,12 +824,13 @@ async def get_logs(
 
 @app.get("/api/admin/telemetry")
 async def get_telemetry(
+    hours: int = Query(24, ge=1, le=24 * 30),
     current_user: User = Depends(require_admin),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get telemetry data for dashboard"""
+    """Get telemetry data for dashboard, with an hourly series over the last `hours` hours"""
     try:
-        telemetry = ActivityLogger.get_telemetry(db)
+        telemetry = await ActivityLogger.get_telemetry(db, hours)
         return telemetry
     except Exception as e:
         logging.error(f"Error getting telemetry: {e}")
@@ -522,11 +844,11 @@ async def add_model(
     data: AddModelRequest,
     current_user: User = Depends(require_admin),
     request: Request = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Add a new model"""
     try:
-        if db.query(Model).filter(Model.name == data.name).first():
+        if await db.scalar(select(Model).where(Model.name == data.name)):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Model already exists"
@@ -535,16 +857,16 @@ async def add_model(
         display_name = data.display_name or data.name
         model = Model(name=data.name, display_name=display_name, provider=data.provider)
         db.add(model)
-        db.commit()
-        db.refresh(model)
+        await db.commit()
+        await db.refresh(model)
         
-        ActivityLogger.log(db, current_user.id, 'model_added', 201, {'model_name': data.name}, request)
+        await ActivityLogger.log(current_user.id, 'model_added', 201, {'model_name': data.name}, request)
         return model.to_dict()
     except HTTPException:
         raise
     except Exception as e:
         logging.error(f"Error adding model: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to add model"
@@ -556,11 +878,11 @@ async def update_model(
     data: UpdateModelRequest,
     current_user: User = Depends(require_admin),
     request: Request = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Update model (enable/disable)"""
     try:
-        model = db.query(Model).filter(Model.id == model_id).first()
+        model = await db.scalar(select(Model).where(Model.id == model_id))
         if not model:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -572,16 +894,16 @@ async def update_model(
         if data.display_name is not None:
             model.display_name = data.display_name
         
-        db.commit()
-        db.refresh(model)
+        await db.commit()
+        await db.refresh(model)
         
-        ActivityLogger.log(db, current_user.id, 'model_updated', 200, {'model_id': model_id}, request)
+        await ActivityLogger.log(current_user.id, 'model_updated', 200, {'model_id': model_id}, request)
         return model.to_dict()
     except HTTPException:
         raise
     except Exception as e:
         logging.error(f"Error updating model: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to update model"
@@ -590,11 +912,11 @@ async def update_model(
 @app.get("/api/admin/users")
 async def get_users(
     current_user: User = Depends(require_admin),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Get all users"""
     try:
-        users = db.query(User).all()
+        users = await db.scalars(select(User))
         return [user.to_dict() for user in users]
     except Exception as e:
         logging.error(f"Error getting users: {e}")
@@ -609,11 +931,11 @@ async def update_user_role(
     data: UpdateUserRoleRequest,
     current_user: User = Depends(require_admin),
     request: Request = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Promote/demote user"""
     try:
-        user = db.query(User).filter(User.id == user_id).first()
+        user = await db.scalar(select(User).where(User.id == user_id))
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -628,10 +950,11 @@ async def update_user_role(
         
         old_role = user.role
         user.role = data.role
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        invalidate_user(user_id)
+        await db.refresh(user)
         
-        ActivityLogger.log(db, current_user.id, 'user_role_updated', 200, {
+        await ActivityLogger.log(current_user.id, 'user_role_updated', 200, {
             'target_user_id': user_id,
             'old_role': old_role,
             'new_role': data.role
@@ -641,7 +964,7 @@ async def update_user_role(
         raise
     except Exception as e:
         logging.error(f"Error updating user role: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to update user role"
@@ -653,11 +976,11 @@ async def update_user_status(
     data: UpdateUserStatusRequest,
     current_user: User = Depends(require_admin),
     request: Request = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Activate/deactivate user"""
     try:
-        user = db.query(User).filter(User.id == user_id).first()
+        user = await db.scalar(select(User).where(User.id == user_id))
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -665,10 +988,11 @@ async def update_user_status(
             )
         
         user.is_active = data.is_active
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        invalidate_user(user_id)
+        await db.refresh(user)
         
-        ActivityLogger.log(db, current_user.id, 'user_status_updated', 200, {
+        await ActivityLogger.log(current_user.id, 'user_status_updated', 200, {
             'target_user_id': user_id,
             'is_active': user.is_active
         }, request)
@@ -677,17 +1001,199 @@ async def update_user_status(
         raise
     except Exception as e:
         logging.error(f"Error updating user status: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to update user status"
         )
+
+@app.get("/api/admin/cache/stats")
+async def get_cache_stats(
+    current_user: User = Depends(require_admin)
+):
+    """Get per-model response cache counters, similarity histograms and configuration"""
+    try:
+        stats = await run_in_threadpool(cache_manager.get_stats)
+        stats['context'] = context_cache.stats()
+        stats['prompt_eval'] = prompt_eval_stats.snapshot()
+        stats['auth'] = {'principals': principal_cache.stats(), 'tokens': token_cache.stats()}
+        return stats
+    except Exception as e:
+        logging.error(f"Error getting cache stats: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to retrieve cache stats"
+        )
+
+@app.post("/api/admin/cache/flush")
+async def flush_cache(
+    model: str = Query(None),
+    current_user: User = Depends(require_admin),
+    request: Request = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """Drop every response cache entry, or only those of one model"""
+    try:
+        if model and not await db.scalar(select(Model).where(Model.name == model)):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Model not found"
+            )
+        
+        await run_in_threadpool(cache_manager.flush, model)
+        await ActivityLogger.log(current_user.id, 'cache_flushed', 200, {'model': model}, request)
+        return {"message": "Cache flushed"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error flushing cache: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to flush cache"
+        )
+
+@app.put("/api/admin/cache/config")
+async def update_cache_config(
+    data: UpdateCacheConfigRequest,
+    current_user: User = Depends(require_admin),
+    request: Request = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """Resize the response cache or change its similarity threshold, for all models or one"""
+    try:
+        if data.model and not await db.scalar(select(Model).where(Model.name == data.model)):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Model not found"
+            )
+        if data.size is not None and data.size < 1:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Cache size must be at least 1"
+            )
+        if data.threshold is not None and not 0 < data.threshold <= 1:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Threshold must be between 0 and 1"
+            )
+
+        if data.size is not None:
+            await run_in_threadpool(cache_manager.resize, data.size, data.model)
+        if data.threshold is not None:
+            await run_in_threadpool(cache_manager.set_threshold, data.threshold, data.model)
+
+        await ActivityLogger.log(current_user.id, 'cache_config_updated', 200, {
+            'model': data.model,
+            'size': data.size,
+            'threshold': data.threshold
+        }, request)
+        return await run_in_threadpool(cache_manager.get_stats)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error updating cache config: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to update cache config"
+        )
+
+@app.get("/api/admin/ollama/backends")
+async def get_ollama_backends(
+    current_user: User = Depends(require_admin)
+):
+    """Get load, health and error counts of each Ollama host in this worker's backend pool"""
+    return ollama_pool.stats()
+
+@app.get("/api/admin/profiling/stages")
+async def get_stage_latencies(
+    current_user: User = Depends(require_admin)
+):
+    """Get p50/p95/p99 latency in ms of each request stage, per endpoint, for this worker"""
+    return stage_stats.stats()
+
+@app.delete("/api/admin/profiling/stages")
+async def reset_stage_latencies(
+    current_user: User = Depends(require_admin)
+):
+    """Clear the per-stage latency histograms"""
+    stage_stats.reset()
+    return {"message": "Stage latencies reset"}
+
+@app.post("/api/admin/profiling/start")
+async def start_profiler(
+    interval_ms: float = Query(PROFILER_INTERVAL_MS, ge=1, le=1000),
+    current_user: User = Depends(require_admin),
+    request: Request = None
+):
+    """Start sampling the event loop's stack every interval_ms"""
+    # started from a request handler, so the sampled thread is the event loop's
+    if not profiler.start(interval_ms / 1000):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Profiler is already running"
+        )
+    await ActivityLogger.log(current_user.id, 'profiler_started', 200, {'interval_ms': interval_ms}, request)
+    return {"message": "Profiler started", "interval_ms": interval_ms}
+
+@app.post("/api/admin/profiling/stop")
+async def stop_profiler(
+    top: int = Query(50, ge=1, le=1000),
+    current_user: User = Depends(require_admin),
+    request: Request = None
+):
+    """Stop the sampling profiler and return the most frequent stacks"""
+    await run_in_threadpool(profiler.stop)
+    report = profiler.report(top)
+    await ActivityLogger.log(current_user.id, 'profiler_stopped', 200, {'samples': report['samples']}, request)
+    return report
+
+@app.get("/api/admin/profiling/samples")
+async def get_profiler_samples(
+    top: int = Query(50, ge=1, le=1000),
+    current_user: User = Depends(require_admin)
+):
+    """Get the most frequent stacks sampled so far; the profiler keeps running"""
+    return profiler.report(top)
+
 # ==================== UTILITY ENDPOINTS ====================
 
 @app.get("/health")
 async def health_check():
     return "OK"
 
+@registry.collector
+def collect_metrics():
+    """Sample cache, connection pool, Ollama backend and log queue state for /metrics"""
+    shards = cache_manager.get_stats()['shards']
+    cache_hits.replace({(model,): stats['hits'] for model, stats in shards.items()})
+    cache_misses.replace({(model,): stats['misses'] for model, stats in shards.items()})
+    cache_entries.replace({(model,): stats['entries'] for model, stats in shards.items()})
+    cache_capacity.replace({(model,): stats['size'] for model, stats in shards.items()})
+    
+    pool = async_engine.pool
+    if hasattr(pool, 'checkedout'):  # in-memory SQLite runs on a single static connection
+        db_pool.replace({
+            ('checked_out',): pool.checkedout(),
+            ('idle',): pool.checkedin(),
+            ('overflow',): max(pool.overflow(), 0),
+            ('size',): pool.size()
+        })
+    
+    backends = ollama_pool.stats()['hosts']
+    ollama_outstanding.replace({(host,): stats['outstanding'] for host, stats in backends.items()})
+    ollama_up.replace({(host,): int(stats['available']) for host, stats in backends.items()})
+    
+    logs = log_pipeline.stats()
+    log_queue_depth.set(value=logs['queued'])
+    log_queue_capacity.set(value=logs['capacity'])
+    log_rows.replace({(outcome,): logs[outcome] for outcome in ('written', 'dropped', 'failed')})
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus metrics, added up across all workers"""
+    body = await run_in_threadpool(exporter.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
 if __name__ == '__main__':
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=5000)
@@ -0,0 +1,376 @@
+import bisect
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from constants import CACHE_MODE, METRICS_SHARED_PATH, METRICS_SYNC_INTERVAL_MS, METRICS_RETENTION_S
+
+# Upper bounds in seconds, from sub-millisecond cache lookups to long generations
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+
+class Histogram:
+    """Fixed-bucket histogram with interpolated quantiles.
+
+    Observing a value is a binary search and three increments, so it is
+    cheap enough for request hot paths. Quantiles are estimated by linear
+    interpolation inside the bucket that contains them.
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counts = [0] * (len(self.bounds) + 1)  # last bucket is +Inf
+            self.count = 0
+            self.sum = 0.0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        with self.lock:
+            counts, count = list(self.counts), self.count
+        if count == 0:
+            return None
+        rank = q * count
+        seen = 0
+        for i, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                if i == len(self.bounds):
+                    return lower  # overflow bucket has no upper bound
+                upper = self.bounds[i]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.bounds[-1]
+
+    def summary(self, scale=1.0):
+        """Return count, mean and p50/p95/p99, multiplied by scale (e.g. 1000 for ms)"""
+        def scaled(value):
+            return round(value * scale, 4) if value is not None else None
+
+        with self.lock:
+            count, total = self.count, self.sum
+        return {
+            'count': count,
+            'mean': scaled(total / count) if count else None,
+            'p50': scaled(self.quantile(0.5)),
+            'p95': scaled(self.quantile(0.95)),
+            'p99': scaled(self.quantile(0.99)),
+        }
+
+
+# Prometheus exporter.
+#
+# Each worker keeps its counters, gauges and histograms in memory, where an
+# update is a dict lookup and an increment. A background thread writes a
+# JSON snapshot of them to a SQLite file shared by the workers every
+# `interval`; /metrics, served by whichever worker gets the scrape, adds up
+# the latest snapshot of every worker. Counters and histograms include
+# workers that exited recently, so totals don't drop when one restarts;
+# gauges only count workers that are still reporting.
+
+class Metric:
+    """One metric family: a value (or a Histogram) per combination of label values"""
+
+    def __init__(self, name, help, kind, labels=(), buckets=LATENCY_BUCKETS, aggregate='sum'):
+        self.name = name
+        self.help = help
+        self.kind = kind  # counter, gauge or histogram
+        self.labels = tuple(labels)
+        self.buckets = buckets
+        self.aggregate = aggregate  # how workers' values combine: sum, or max for state they share
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+    def set(self, labels=(), value=0):
+        with self.lock:
+            self.values[labels] = value
+
+    def replace(self, values):
+        """Set every labelled value at once, dropping label combinations not in values"""
+        with self.lock:
+            self.values = dict(values)
+
+    def observe(self, value, labels=()):
+        histogram = self.values.get(labels)
+        if histogram is None:
+            with self.lock:
+                histogram = self.values.setdefault(labels, Histogram(self.buckets))
+        histogram.observe(value)
+
+    @contextmanager
+    def track(self, labels=()):
+        """Count the block as in progress while it runs (gauges)"""
+        self.inc(labels)
+        try:
+            yield
+        finally:
+            self.dec(labels)
+
+    def snapshot(self):
+        with self.lock:
+            values = list(self.values.items())
+        if self.kind != 'histogram':
+            return [[list(labels), value] for labels, value in values]
+        samples = []
+        for labels, histogram in values:
+            with histogram.lock:
+                samples.append([list(labels), [list(histogram.counts), histogram.sum]])
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+
+    def _add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Metric(name, help, 'counter', labels))
+
+    def gauge(self, name, help, labels=(), aggregate='sum'):
+        return self._add(Metric(name, help, 'gauge', labels, aggregate=aggregate))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Metric(name, help, 'histogram', labels, buckets))
+
+    def collector(self, func):
+        """Register func to refresh sampled metrics (sizes, queue depths) before each snapshot"""
+        self.collectors.append(func)
+        return func
+
+    def snapshot(self):
+        for collect in self.collectors:
+            try:
+                collect()
+            except Exception as e:
+                logging.error(f"Error collecting metrics: {e}")
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def merge(self, snapshots):
+        """Add up (snapshot, live) pairs from the workers into {name: {labels: value}}"""
+        merged = {name: {} for name in self.metrics}
+        for snapshot, live in snapshots:
+            for name, samples in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is None or (metric.kind == 'gauge' and not live):
+                    continue
+                values = merged[name]
+                for labels, value in samples:
+                    labels = tuple(labels)
+                    if metric.kind != 'histogram':
+                        if metric.aggregate == 'max':
+                            values[labels] = max(values.get(labels, value), value)
+                        else:
+                            values[labels] = values.get(labels, 0) + value
+                        continue
+                    counts, total = value
+                    if len(counts) != len(metric.buckets) + 1:
+                        continue  # written with other buckets by an older version
+                    current = values.get(labels)
+                    if current is None:
+                        values[labels] = [list(counts), total]
+                    else:
+                        current[0] = [a + b for a, b in zip(current[0], counts)]
+                        current[1] += total
+        return merged
+
+    def render(self, merged):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in sorted(merged.get(name, {}).items()):
+                pairs = [f'{key}="{escape(str(label))}"' for key, label in zip(metric.labels, labels)]
+                if metric.kind != 'histogram':
+                    lines.append(f"{name}{format_labels(pairs)} {format_value(value)}")
+                    continue
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else format_value(bound)
+                    bucket = format_labels(pairs + ['le="%s"' % le])
+                    lines.append(f"{name}_bucket{bucket} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(pairs)} {format_value(total)}")
+                lines.append(f"{name}_count{format_labels(pairs)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(pairs):
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsStore:
+    """Latest metric snapshot of every worker, in one SQLite file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS worker_metrics ("
+            "worker TEXT PRIMARY KEY, pid INTEGER NOT NULL, updated_at REAL NOT NULL, snapshot TEXT NOT NULL)"
+        )
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def write(self, worker, snapshot, now):
+        self._conn().execute(
+            "INSERT INTO worker_metrics (worker, pid, updated_at, snapshot) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (worker) DO UPDATE SET updated_at = excluded.updated_at, snapshot = excluded.snapshot",
+            (worker, os.getpid(), now, json.dumps(snapshot))
+        )
+
+    def read(self, since):
+        """Return [(updated_at, snapshot)] of workers that reported after since, pruning older ones"""
+        conn = self._conn()
+        conn.execute("DELETE FROM worker_metrics WHERE updated_at < ?", (since,))
+        return [(updated_at, json.loads(snapshot)) for updated_at, snapshot in conn.execute(
+            "SELECT updated_at, snapshot FROM worker_metrics"
+        )]
+
+
+class MetricsExporter:
+    """Publishes this worker's metrics to the shared store and renders everyone's.
+
+    Without a store (path empty) /metrics shows this worker alone.
+    """
+
+    def __init__(self, registry, path=None, interval=5.0, retention=600.0):
+        self.registry = registry
+        self.path = path
+        self.store = None  # opened on first use, so importing this module creates no file
+        self.interval = interval
+        self.retention = retention
+        self.worker = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def shared(self):
+        if self.store is None and self.path:
+            self.store = MetricsStore(self.path)
+        return self.store is not None
+
+    def start(self):
+        if not self.shared() or self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name='metrics-exporter', daemon=True)
+        self.thread.start()
+
+    def publish(self):
+        snapshot = self.registry.snapshot()
+        if self.shared():
+            self.store.write(self.worker, snapshot, time.time())
+        return snapshot
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.publish()
+            except Exception as e:
+                logging.error(f"Error publishing metrics: {e}")
+
+    def render(self):
+        snapshot = self.publish()
+        if not self.shared():
+            return self.registry.render(self.registry.merge([(snapshot, True)]))
+        now = time.time()
+        # a worker is live if it published within the last few intervals
+        live_since = now - 3 * self.interval - 1
+        snapshots = [(snapshot, updated_at >= live_since) for updated_at, snapshot in self.store.read(now - self.retention)]
+        return self.registry.render(self.registry.merge(snapshots))
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.store is not None:
+            try:
+                self.publish()  # final counters, kept until they age out
+            except Exception as e:
+                logging.error(f"Error publishing metrics: {e}")
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    'pocketllm_http_requests_total', 'HTTP requests by route, method and status code', ('route', 'method', 'status'))
+http_latency = registry.histogram(
+    'pocketllm_http_request_duration_seconds', 'HTTP request latency by route and method', ('route', 'method'))
+chat_in_flight = registry.gauge(
+    'pocketllm_chat_requests_in_flight', 'Chat requests waiting on an LLM answer, by model', ('model',))
+ollama_latency = registry.histogram(
+    'pocketllm_ollama_request_duration_seconds', 'Ollama call latency, until the last token for streams',
+    ('model', 'operation'))
+ollama_errors = registry.counter(
+    'pocketllm_ollama_errors_total', 'Ollama calls that failed or timed out', ('model', 'operation'))
+ollama_outstanding = registry.gauge(
+    'pocketllm_ollama_backend_outstanding', 'Ollama calls in progress by backend host', ('host',))
+ollama_up = registry.gauge(
+    'pocketllm_ollama_backend_up', 'Whether a backend host takes requests (0 while unhealthy or ejected)',
+    ('host',), 'max')
+ollama_ejections = registry.counter(
+    'pocketllm_ollama_backend_ejections_total', 'Times a backend host was ejected after failed calls', ('host',))
+cache_hits = registry.counter('pocketllm_cache_hits_total', 'Response cache hits by model', ('model',))
+cache_misses = registry.counter('pocketllm_cache_misses_total', 'Response cache misses by model', ('model',))
+# in shared mode every worker reports the same store
+cache_aggregate = 'max' if CACHE_MODE == 'shared' else 'sum'
+cache_entries = registry.gauge(
+    'pocketllm_cache_entries', 'Entries in the response cache by model', ('model',), cache_aggregate)
+cache_capacity = registry.gauge(
+    'pocketllm_cache_capacity', 'Response cache size limit by model', ('model',), cache_aggregate)
+db_sessions = registry.gauge('pocketllm_db_sessions_active', 'Request database sessions currently open')
+db_pool = registry.gauge(
+    'pocketllm_db_pool_connections', 'Database pool connections by state (checked_out, idle, overflow, size)',
+    ('state',))
+log_queue_depth = registry.gauge('pocketllm_log_queue_depth', 'Activity log rows waiting to be written')
+log_queue_capacity = registry.gauge('pocketllm_log_queue_capacity', 'Activity log queue size limit')
+log_rows = registry.counter(
+    'pocketllm_log_rows_total', 'Activity log rows by outcome (written, dropped, failed)', ('outcome',))
+
+exporter = MetricsExporter(registry, METRICS_SHARED_PATH, METRICS_SYNC_INTERVAL_MS / 1000.0, METRICS_RETENTION_S)
@@ -0,0 +1,153 @@
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData, inspect, select, insert, func, text
+from sqlalchemy.exc import OperationalError
+
+from models import Base, Log, LogRollup, PREVIEW_LENGTH
+
+# Versioned schema migrations.
+#
+# A new database gets the current schema from the models and is stamped
+# with the latest version. An existing one gets any new tables from the
+# models, then every migration above its recorded version, each in its own
+# transaction. Every step runs under the database write lock and re-reads
+# the schema once it holds it, so when several workers start at once they
+# take turns: the first creates the tables or applies a migration, the
+# others find it done and skip.
+
+LOCK_TIMEOUT = 120  # seconds to wait for another worker's migration
+
+schema_version = Table(
+    'schema_version', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False, default=datetime.utcnow)
+)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def register(apply):
+        MIGRATIONS.append((version, description, apply))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return apply
+    return register
+
+
+@migration(1, 'Denormalized message_count and last_message on chat_threads')
+def thread_summaries(connection):
+    columns = {column['name'] for column in inspect(connection).get_columns('chat_threads')}
+    if 'message_count' in columns:
+        return
+    connection.execute(text('ALTER TABLE chat_threads ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0'))
+    connection.execute(text(f'ALTER TABLE chat_threads ADD COLUMN last_message VARCHAR({PREVIEW_LENGTH})'))
+    connection.execute(text(f'''
+        UPDATE chat_threads SET
+            message_count = (SELECT COUNT(*) FROM chat_messages m WHERE m.thread_id = chat_threads.id),
+            last_message = (
+                SELECT substr(m.content, 1, {PREVIEW_LENGTH}) FROM chat_messages m
+                WHERE m.thread_id = chat_threads.id ORDER BY m.created_at DESC LIMIT 1
+            )
+    '''))
+
+
+@migration(2, 'Composite indexes for thread, message and log listings')
+def listing_indexes(connection):
+    # single-column indexes now covered by a composite index with the same prefix
+    for name in (
+        'ix_chat_threads_user_id', 'ix_chat_messages_thread_id',
+        'ix_logs_user_id', 'ix_logs_action', 'ix_logs_created_at',
+        # earlier two-column versions, recreated below with id for the keyset tie-break
+        'ix_chat_threads_user_updated', 'ix_chat_messages_thread_created',
+    ):
+        connection.execute(text(f'DROP INDEX IF EXISTS {name}'))
+    for name, table, columns in (
+        ('ix_chat_threads_user_updated', 'chat_threads', 'user_id, updated_at, id'),
+        ('ix_chat_messages_thread_created', 'chat_messages', 'thread_id, created_at, id'),
+        ('ix_logs_created', 'logs', 'created_at, id'),
+        ('ix_logs_action_created', 'logs', 'action, created_at, id'),
+        ('ix_logs_user_created', 'logs', 'user_id, created_at, id'),
+    ):
+        connection.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})'))
+
+
+
+@migration(3, 'Backfill log_rollups from existing logs')
+def backfill_rollups(connection):
+    # rollups written since the table existed already count their logs
+    if connection.scalar(select(LogRollup.bucket).limit(1)) is not None:
+        return
+    from logger import rollup_key
+    counts = Counter()
+    rows = connection.execute(
+        select(Log.created_at, Log.action, Log.status_code, Log.log_metadata)
+        .where(Log.created_at.isnot(None))
+        .execution_options(yield_per=5000)
+    )
+    for row in rows:
+        counts[rollup_key(*row)] += 1
+    if counts:
+        connection.execute(insert(LogRollup), [
+            {'bucket': bucket, 'action': action, 'model': model, 'status_code': status_code, 'count': count}
+            for (bucket, action, model, status_code), count in counts.items()
+        ])
+    logging.info(f"Backfilled {len(counts)} log rollup rows")
+
+def current_version(connection):
+    return connection.scalar(select(func.coalesce(func.max(schema_version.c.version), 0)))
+
+
+@contextmanager
+def locked(engine):
+    """A transaction that holds the database write lock from its first statement.
+
+    pysqlite only opens a transaction before data changes, so CREATE TABLE
+    and the schema checks before it would run unlocked; BEGIN IMMEDIATE
+    takes the write lock up front, waiting while another worker holds it.
+    Other databases serialize on a transaction-scoped advisory lock.
+    """
+    with engine.connect() as connection:
+        if connection.dialect.name == 'sqlite':
+            deadline = time.monotonic() + LOCK_TIMEOUT
+            while True:
+                try:
+                    connection.exec_driver_sql('BEGIN IMMEDIATE')
+                    break
+                except OperationalError as e:
+                    # busy_timeout has run out while another worker migrates
+                    if 'locked' not in str(e) or time.monotonic() > deadline:
+                        raise
+                    connection.rollback()
+        elif connection.dialect.name == 'postgresql':
+            connection.execute(text('SELECT pg_advisory_xact_lock(18020)'))
+        try:
+            yield connection
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+
+
+def migrate(engine):
+    """Bring the database schema up to the latest migration"""
+    with locked(engine) as connection:
+        fresh = not inspect(connection).has_table('users')
+        Base.metadata.create_all(connection)
+        schema_version.create(connection, checkfirst=True)
+        if fresh:
+            connection.execute(insert(schema_version), [
+                {'version': version, 'description': description} for version, description, _ in MIGRATIONS
+            ])
+            return
+
+    for version, description, apply in MIGRATIONS:
+        with locked(engine) as connection:
+            if version <= current_version(connection):
+                continue  # applied earlier or by another worker
+            connection.execute(insert(schema_version).values(version=version, description=description))
+            apply(connection)
+        logging.info(f"Applied schema migration {version}: {description}")
@@ -1,24 +1,86 @@
 from datetime import datetime
-from sqlalchemy import create_engine, Column, String, Text, Boolean, Integer, DateTime, ForeignKey
+from sqlalchemy import (
+    create_engine, event, Column, String, Text, Boolean, Integer, DateTime, ForeignKey, Index
+)
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from werkzeug.security import generate_password_hash, check_password_hash
 import uuid
 import os
 
+from metrics import db_sessions
+from constants import (
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+    SQLITE_CACHE_SIZE_KB, SQLITE_BUSY_TIMEOUT_MS, PASSWORD_HASH_METHOD, PASSWORD_SALT_LENGTH
+)
+
+def to_async_url(url):
+    """Swap the driver of a database URL for its asyncio counterpart"""
+    for sync_prefix, async_prefix in (
+        ('sqlite://', 'sqlite+aiosqlite://'),
+        ('postgresql://', 'postgresql+asyncpg://'),
+        ('postgresql+psycopg2://', 'postgresql+asyncpg://'),
+    ):
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url
+
+def engine_options(url):
+    """Pool settings for a database URL"""
+    if url.startswith('sqlite'):
+        if ':memory:' in url or url.rstrip('/').endswith(':'):
+            return {}  # in-memory databases live on a single connection
+        options = {'pool_size': DB_POOL_SIZE, 'max_overflow': DB_MAX_OVERFLOW, 'pool_timeout': DB_POOL_TIMEOUT}
+        if url.startswith('sqlite+aiosqlite'):
+            # aiosqlite defaults to opening a new connection (and re-running the pragmas) per session
+            options['poolclass'] = AsyncAdaptedQueuePool
+        return options
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': True
+    }
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers run alongside the single writer; NORMAL sync is durable in WAL mode
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
 # Database setup
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///chat_app.db')
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {})
+ASYNC_DATABASE_URL = os.getenv('ASYNC_DATABASE_URL', to_async_url(DATABASE_URL))
+
+# Request handlers use the async engine (aiosqlite / asyncpg) so database
+# waits never block the event loop; the sync engine creates the schema and
+# serves offline scripts
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {},
+    **engine_options(DATABASE_URL)
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+if DATABASE_URL.startswith('sqlite'):
+    event.listen(engine, 'connect', set_sqlite_pragmas)
+if ASYNC_DATABASE_URL.startswith('sqlite'):
+    event.listen(async_engine.sync_engine, 'connect', set_sqlite_pragmas)
 Base = declarative_base()
 
 # Dependency to get DB session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+async def get_db():
+    with db_sessions.track():
+        async with AsyncSessionLocal() as db:
+            yield db
 
 class User(Base):
     __tablename__ = 'users'
@@ -38,7 +100,8 @@ class User(Base):
     logs = relationship('Log', backref='user', lazy=True)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        # blocking; request handlers use passwords.hash_password instead
+        self.password_hash = generate_password_hash(password, PASSWORD_HASH_METHOD, PASSWORD_SALT_LENGTH)
     
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
@@ -53,19 +116,35 @@ class User(Base):
             'is_active': self.is_active
         }
 
+PREVIEW_LENGTH = 200
+
 class ChatThread(Base):
     __tablename__ = 'chat_threads'
+    __table_args__ = (
+        # serves the per-user thread listing, newest first, and its keyset cursor
+        Index('ix_chat_threads_user_updated', 'user_id', 'updated_at', 'id'),
+    )
     
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    user_id = Column(String(36), ForeignKey('users.id'), nullable=False, index=True)
+    user_id = Column(String(36), ForeignKey('users.id'), nullable=False)
     title = Column(String(200), nullable=True)
     model_used = Column(String(100), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, index=True)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Denormalized so listings never touch chat_messages
+    message_count = Column(Integer, nullable=False, default=0)
+    last_message = Column(String(PREVIEW_LENGTH), nullable=True)
     
     # Relationships
     messages = relationship('ChatMessage', backref='thread', lazy=True, cascade='all, delete-orphan', order_by='ChatMessage.created_at')
     
+    def add_messages(self, *messages):
+        """Account for messages saved to this thread in the same transaction"""
+        # incremented in SQL so concurrent turns on one thread don't lose counts
+        self.message_count = ChatThread.message_count + len(messages)
+        self.last_message = messages[-1].content[:PREVIEW_LENGTH]
+        self.updated_at = datetime.utcnow()
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -74,14 +153,19 @@ class ChatThread(Base):
             'model_used': self.model_used,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'message_count': len(self.messages)
+            'message_count': self.message_count,
+            'last_message': self.last_message
         }
 
 class ChatMessage(Base):
     __tablename__ = 'chat_messages'
+    __table_args__ = (
+        # serves loading and paging through a thread by (created_at, id)
+        Index('ix_chat_messages_thread_created', 'thread_id', 'created_at', 'id'),
+    )
     
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    thread_id = Column(String(36), ForeignKey('chat_threads.id'), nullable=False, index=True)
+    thread_id = Column(String(36), ForeignKey('chat_threads.id'), nullable=False)
     role = Column(String(20), nullable=False)  # system, user, assistant
     content = Column(Text, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, index=True)
@@ -146,17 +230,23 @@ class APIKey(Base):
 
 class Log(Base):
     __tablename__ = 'logs'
+    __table_args__ = (
+        # the admin log listing pages newest first, unfiltered or filtered by action or user
+        Index('ix_logs_created', 'created_at', 'id'),
+        Index('ix_logs_action_created', 'action', 'created_at', 'id'),
+        Index('ix_logs_user_created', 'user_id', 'created_at', 'id'),
+    )
     
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    user_id = Column(String(36), ForeignKey('users.id'), nullable=True, index=True)
-    action = Column(String(100), nullable=False, index=True)  # chat_request, login, model_change, etc.
+    user_id = Column(String(36), ForeignKey('users.id'), nullable=True)
+    action = Column(String(100), nullable=False)  # chat_request, login, model_change, etc.
     endpoint = Column(String(200), nullable=True)
     method = Column(String(10), nullable=True)
     status_code = Column(Integer, nullable=True)
     log_metadata = Column(Text, nullable=True)  # JSON string
     ip_address = Column(String(45), nullable=True)
     user_agent = Column(String(500), nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
     
     def to_dict(self):
         return {
@@ -173,6 +263,17 @@ class Log(Base):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
-# Create all tables
+class LogRollup(Base):
+    """Hourly log counts per action, model and status, kept up to date as logs are written"""
+    __tablename__ = 'log_rollups'
+    
+    bucket = Column(DateTime, primary_key=True)  # start of the hour
+    action = Column(String(100), primary_key=True)
+    model = Column(String(100), primary_key=True, default='')  # '' when the log has no model
+    status_code = Column(Integer, primary_key=True, default=0)  # 0 when the log has no status
+    count = Column(Integer, nullable=False, default=0)
+
+# Create missing tables and apply pending schema migrations
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    from migrations import migrate
+    migrate(engine)
@@ -1,32 +1,404 @@
-from ollama import generate, chat
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager
+import httpx
+from ollama import AsyncClient, ResponseError
+
+from constants import (
+    OLLAMA_HOST, OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT,
+    OLLAMA_MAX_CONNECTIONS, OLLAMA_KEEPALIVE_EXPIRY, OLLAMA_KEEP_ALIVE,
+    OLLAMA_HOSTS, OLLAMA_MODEL_HOSTS, OLLAMA_HOST_CONCURRENCY, OLLAMA_QUEUE_TIMEOUT,
+    OLLAMA_HEALTH_INTERVAL, OLLAMA_HEALTH_TIMEOUT, OLLAMA_EJECT_ERRORS, OLLAMA_EJECT_SECONDS
+)
+from metrics import ollama_latency, ollama_errors, ollama_ejections
+
+# One keep-alive connection pool per Ollama host, shared by every request
+_clients = {}
+
+def get_async_client(host: str = None) -> AsyncClient:
+    """Return the shared AsyncClient for a host, creating it on first use"""
+    host = host or OLLAMA_HOST
+    client = _clients.get(host)
+    if client is None:
+        client = AsyncClient(
+            host=host,
+            timeout=httpx.Timeout(OLLAMA_READ_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=OLLAMA_MAX_CONNECTIONS,
+                max_keepalive_connections=OLLAMA_MAX_CONNECTIONS,
+                keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY
+            )
+        )
+        _clients[host] = client
+    return client
+
+async def close_async_clients():
+    """Close all pooled connections (called on application shutdown)"""
+    for client in _clients.values():
+        await client._client.aclose()
+    _clients.clear()
+
+class BackendUnavailable(Exception):
+    """Raised when no Ollama host for a model frees up within OLLAMA_QUEUE_TIMEOUT"""
+
+
+def is_host_failure(error):
+    """Whether a failed call says something about the host rather than the request"""
+    if isinstance(error, httpx.TransportError):  # refused, reset or timed out
+        return True
+    # -1: an error reported in the middle of a stream
+    return isinstance(error, ResponseError) and (error.status_code >= 500 or error.status_code == -1)
+
+
+def never_sent(error):
+    """Whether a call failed before the request reached the host, so it is safe to send elsewhere"""
+    return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+
+
+class Backend:
+    """One Ollama host: its connection pool, call slots and health"""
+
+    def __init__(self, host, limit):
+        self.host = host
+        self.limit = limit
+        self.outstanding = 0
+        self.healthy = True  # outcome of the last active probe
+        self.failures = 0  # consecutive failed calls
+        self.ejections = 0  # consecutive ejections, for the backoff
+        self.ejected_until = 0.0
+        self.calls = 0
+        self.errors = 0
+
+    @property
+    def client(self):
+        return get_async_client(self.host)
+
+    def available(self, now):
+        return self.healthy and now >= self.ejected_until
+
+    def has_slot(self):
+        return not self.limit or self.outstanding < self.limit
+
+
+class BackendPool:
+    """Routes Ollama calls across hosts, least outstanding calls first.
+
+    Each model has a list of hosts (OLLAMA_MODEL_HOSTS, else OLLAMA_HOSTS).
+    A call goes to the host with the fewest calls in progress that is
+    below its concurrency cap, rotating between equally loaded ones; when
+    every host is at its cap the call waits for a slot. Hosts leave the
+    rotation when an active probe fails, or for a while after
+    `eject_errors` consecutive calls failed on them (refused, timed out or
+    a server error), with the ejection time doubling on repeats. If every
+    host of a model is out, calls go to all of them anyway rather than
+    failing outright. Slots and counts are per worker process; everything
+    runs on the event loop, so no locking is needed.
+    """
+
+    def __init__(self, hosts, model_hosts=None, limit=0, queue_timeout=60.0,
+                 eject_errors=3, eject_seconds=30.0, probe_interval=10.0, probe_timeout=2.0):
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self.eject_errors = eject_errors
+        self.eject_seconds = eject_seconds
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.backends = {}  # {host: Backend}, shared by every model served there
+        self.default = [self.backend(host) for host in hosts]
+        self.models = {model: [self.backend(host) for host in hosts] for model, hosts in (model_hosts or {}).items()}
+        self.waiters = []  # futures of calls waiting for a slot
+        self.turn = 0
+        self.task = None
+
+    def backend(self, host):
+        backend = self.backends.get(host)
+        if backend is None:
+            backend = self.backends[host] = Backend(host, self.limit)
+        return backend
+
+    def backends_for(self, model):
+        return self.models.get(model) or self.default
+
+    def pick(self, backends):
+        """The least loaded live backend with a free slot, or None if all are at their cap"""
+        now = time.monotonic()
+        live = [backend for backend in backends if backend.available(now)] or backends
+        free = [backend for backend in live if backend.has_slot()]
+        if not free:
+            return None
+        fewest = min(backend.outstanding for backend in free)
+        least = [backend for backend in free if backend.outstanding == fewest]
+        self.turn += 1
+        return least[self.turn % len(least)]
+
+    async def acquire(self, backends):
+        """Take a call slot on one of `backends`, waiting up to queue_timeout for one to free up"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.queue_timeout
+        while True:
+            backend = self.pick(backends)
+            if backend is not None:
+                backend.outstanding += 1
+                backend.calls += 1
+                return backend
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise BackendUnavailable(f"All {len(backends)} Ollama hosts are busy")
+            waiter = loop.create_future()
+            self.waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+
+    def release(self, backend, ok=None):
+        """Give a slot back; ok is True after a success, False after a host failure, None if unknown"""
+        backend.outstanding -= 1
+        if ok:
+            backend.failures = 0
+            if time.monotonic() >= backend.ejected_until:
+                backend.ejections = 0
+        elif ok is False:
+            backend.errors += 1
+            backend.failures += 1
+            if backend.failures >= self.eject_errors:
+                self.eject(backend)
+        # wake every waiter: each re-checks the hosts of its own model
+        waiters, self.waiters = self.waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def eject(self, backend):
+        seconds = self.eject_seconds * 2 ** min(backend.ejections, 5)
+        backend.ejected_until = time.monotonic() + seconds
+        backend.ejections += 1
+        backend.failures = 0
+        ollama_ejections.inc((backend.host,))
+        logging.warning(f"Ollama host {backend.host} ejected for {seconds:.0f}s after repeated failures")
+
+    async def probe(self, backend):
+        try:
+            response = await backend.client._client.get('/api/tags', timeout=self.probe_timeout)
+            healthy = response.status_code == 200
+        except httpx.HTTPError:
+            healthy = False
+        if healthy != backend.healthy:
+            logging.warning(f"Ollama host {backend.host} is {'back up' if healthy else 'not responding to probes'}")
+        backend.healthy = healthy
+
+    async def _probe_loop(self):
+        while True:
+            await asyncio.gather(*(self.probe(backend) for backend in list(self.backends.values())))
+            await asyncio.sleep(self.probe_interval)
+
+    def start(self):
+        """Start the active health probes; only worth it with another host to fail over to"""
+        if self.task is None and self.probe_interval > 0 and len(self.backends) > 1:
+            self.task = asyncio.ensure_future(self._probe_loop())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            'hosts': {
+                host: {
+                    'outstanding': backend.outstanding,
+                    'limit': backend.limit or None,
+                    'available': backend.available(now),
+                    'healthy': backend.healthy,
+                    'ejected_for_s': round(max(backend.ejected_until - now, 0.0), 1),
+                    'calls': backend.calls,
+                    'errors': backend.errors,
+                }
+                for host, backend in self.backends.items()
+            },
+            'waiting': len(self.waiters),
+            'default': [backend.host for backend in self.default],
+            'models': {model: [backend.host for backend in backends] for model, backends in self.models.items()},
+        }
+
+
+def extract_content(response) -> str:
+    # The ollama library returns a dict with 'message' key containing the response
+    if isinstance(response, dict):
+        # Most common structure: {'message': {'content': '...', 'role': 'assistant'}}
+        if 'message' in response:
+            message = response['message']
+            if isinstance(message, dict) and 'content' in message:
+                return message['content']
+            elif isinstance(message, str):
+                return message
+        # Alternative structure: direct 'content' or 'response' key
+        elif 'content' in response:
+            return response['content']
+        elif 'response' in response:
+            return response['response']
+        else:
+            raise ValueError(f"Unexpected response structure: {response}")
+    else:
+        # Handle object response (if it's an object with message attribute)
+        return response.message.content
+
+class PromptEvalStats:
+    """Prompt tokens Ollama evaluated and the time it took, per way of sending the conversation.
+
+    'history' turns resend the message list; 'context' turns send only the
+    new prompt on top of the thread's saved context.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.modes = {}
+
+    def record(self, mode, response):
+        if not isinstance(response, dict):
+            return
+        with self.lock:
+            totals = self.modes.setdefault(mode, {'turns': 0, 'prompt_tokens': 0, 'prompt_eval_seconds': 0.0})
+            totals['turns'] += 1
+            totals['prompt_tokens'] += response.get('prompt_eval_count') or 0
+            totals['prompt_eval_seconds'] += (response.get('prompt_eval_duration') or 0) / 1e9
+
+    def snapshot(self):
+        with self.lock:
+            modes = {mode: dict(totals) for mode, totals in self.modes.items()}
+        for totals in modes.values():
+            turns = totals['turns']
+            totals['prompt_eval_seconds'] = round(totals['prompt_eval_seconds'], 4)
+            totals['mean_prompt_tokens'] = round(totals['prompt_tokens'] / turns, 1) if turns else None
+            totals['mean_prompt_eval_ms'] = round(totals['prompt_eval_seconds'] * 1000 / turns, 2) if turns else None
+        return modes
+
+prompt_eval_stats = PromptEvalStats()
+
+pool = BackendPool(
+    OLLAMA_HOSTS, OLLAMA_MODEL_HOSTS, OLLAMA_HOST_CONCURRENCY, OLLAMA_QUEUE_TIMEOUT,
+    OLLAMA_EJECT_ERRORS, OLLAMA_EJECT_SECONDS, OLLAMA_HEALTH_INTERVAL, OLLAMA_HEALTH_TIMEOUT
+)
+
+@contextmanager
+def observed(model, operation):
+    """Record the latency of an Ollama call, and count it as an error if it raises"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ollama_errors.inc((model, operation))
+        raise
+    finally:
+        ollama_latency.observe(time.perf_counter() - started, (model, operation))
 
 class OllamaClient:
-    def __init__(self, model: str):
+    """Ollama calls for one model, routed through the backend pool (or pinned to `host`)"""
+
+    def __init__(self, model: str, host: str = None):
         self.model = model
+        self.backends = [pool.backend(host)] if host else pool.backends_for(model)
+
+    async def _call(self, operation: str, **kwargs):
+        """Make one call on the least loaded host, moving on to another if it cannot be reached"""
+        tried = set()
+        while True:
+            candidates = [backend for backend in self.backends if backend not in tried]
+            backend = await pool.acquire(candidates)
+            ok = None
+            try:
+                with observed(self.model, operation):
+                    response = await getattr(backend.client, operation)(
+                        model=self.model, keep_alive=OLLAMA_KEEP_ALIVE, **kwargs
+                    )
+                ok = True
+                return response
+            except Exception as e:
+                ok = not is_host_failure(e)
+                tried.add(backend)
+                if never_sent(e) and len(tried) < len(self.backends):
+                    continue
+                raise
+            finally:
+                pool.release(backend, ok)
 
-    def get_single_response(self, prompt: str) -> str:
+    async def _stream(self, operation: str, **kwargs):
+        """Streaming form of _call; moves on to another host only before the first chunk"""
+        tried = set()
+        while True:
+            candidates = [backend for backend in self.backends if backend not in tried]
+            backend = await pool.acquire(candidates)
+            ok, started = None, False
+            try:
+                with observed(self.model, f"{operation}_stream"):
+                    stream = await getattr(backend.client, operation)(
+                        model=self.model, stream=True, keep_alive=OLLAMA_KEEP_ALIVE, **kwargs
+                    )
+                    try:
+                        async for chunk in stream:
+                            started = True
+                            yield chunk
+                    finally:
+                        # Closing the generator releases the pooled connection, also on cancellation
+                        await stream.aclose()
+                ok = True
+                return
+            except Exception as e:
+                ok = not is_host_failure(e)
+                tried.add(backend)
+                if not started and never_sent(e) and len(tried) < len(self.backends):
+                    continue
+                raise
+            finally:
+                pool.release(backend, ok)
 
-        response = generate(model=self.model, prompt=prompt)
+    async def get_single_response(self, prompt: str) -> str:
+        response = await self._call('generate', prompt=prompt)
         return response['response']
-    
-    def get_chat_response(self, messages: list) -> str:
-        response = chat(model=self.model, messages=messages)
-        # The ollama library returns a dict with 'message' key containing the response
-        if isinstance(response, dict):
-            # Most common structure: {'message': {'content': '...', 'role': 'assistant'}}
-            if 'message' in response:
-                message = response['message']
-                if isinstance(message, dict) and 'content' in message:
-                    return message['content']
-                elif isinstance(message, str):
-                    return message
-            # Alternative structure: direct 'content' or 'response' key
-            elif 'content' in response:
-                return response['content']
-            elif 'response' in response:
-                return response['response']
-            else:
-                raise ValueError(f"Unexpected response structure: {response}")
-        else:
-            # Handle object response (if it's an object with message attribute)
-            return response.message.content
\ No newline at end of file
+
+    async def get_chat_response(self, messages: list) -> str:
+        response = await self._call('chat', messages=messages)
+        prompt_eval_stats.record('history', response)
+        return extract_content(response)
+
+    async def stream_chat_response(self, messages: list):
+        """Yield the assistant reply chunk by chunk as Ollama generates it"""
+        async for chunk in self._stream('chat', messages=messages):
+            message = chunk.get('message') or {}
+            content = message.get('content', '') if isinstance(message, dict) else ''
+            if content:
+                yield content
+            if chunk.get('done'):
+                prompt_eval_stats.record('history', chunk)
+
+    async def get_context_response(self, prompt: str, context: list = None, system: str = '', state: dict = None) -> str:
+        """Answer prompt as the next turn after `context`, Ollama's encoding of the conversation so far.
+
+        Only the new prompt is sent and evaluated. The context to continue
+        from next time is stored in state['context'].
+        """
+        response = await self._call('generate', prompt=prompt, system=system, context=context)
+        prompt_eval_stats.record('context', response)
+        if state is not None:
+            state['context'] = response.get('context')
+        return response['response']
+
+    async def stream_context_response(self, prompt: str, context: list = None, system: str = '', state: dict = None):
+        """Streaming form of get_context_response"""
+        async for chunk in self._stream('generate', prompt=prompt, system=system, context=context):
+            if chunk.get('response'):
+                yield chunk['response']
+            if chunk.get('done'):
+                prompt_eval_stats.record('context', chunk)
+                if state is not None:
+                    state['context'] = chunk.get('context')
@@ -0,0 +1,48 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+# Keyset pagination: a page starts right after the (timestamp, id) of the last
+# row the client saw, so every page is an index range scan no matter how deep
+# it is, and rows inserted meanwhile never shift or repeat entries.
+
+def encode_cursor(moment, key):
+    payload = json.dumps([moment.isoformat(), key]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Return the (timestamp, id) a cursor points at; ValueError if it is malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        moment, key = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(moment), str(key)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+def keyset(query, order_column, id_column, cursor=None, limit=50, descending=True):
+    """Order query by (order_column, id_column) and start it after cursor.
+
+    One extra row is fetched so `page` can tell whether another page exists.
+    """
+    if cursor:
+        moment, key = decode_cursor(cursor)
+        if descending:
+            after = or_(order_column < moment, and_(order_column == moment, id_column < key))
+        else:
+            after = or_(order_column > moment, and_(order_column == moment, id_column > key))
+        query = query.where(after)
+    if descending:
+        query = query.order_by(order_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(order_column.asc(), id_column.asc())
+    return query.limit(limit + 1)
+
+def page(rows, limit, order_attr):
+    """Split the rows of a `keyset` query into (page, next_cursor)"""
+    rows = list(rows)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, order_attr), last.id)
@@ -0,0 +1,58 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from constants import (
+    PASSWORD_HASH_METHOD, PASSWORD_SALT_LENGTH,
+    PASSWORD_HASH_WORKERS, PASSWORD_HASH_CONCURRENCY, PASSWORD_HASH_QUEUE_TIMEOUT
+)
+
+# scrypt and PBKDF2 run inside OpenSSL with the GIL released, so a thread
+# pool gives real parallelism without the pickling cost of processes. The
+# pool is sized separately from the default executor so a login burst
+# cannot starve the response cache lookups that share it.
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+_slots = asyncio.Semaphore(PASSWORD_HASH_CONCURRENCY)
+_current_prefix = None
+
+
+class HasherBusy(Exception):
+    """Raised when too many password operations are already queued"""
+
+
+def method_prefix(password_hash):
+    """The 'method:params' part of a werkzeug hash, e.g. 'scrypt:32768:8:1'"""
+    return password_hash.split('$', 1)[0]
+
+
+def current_prefix():
+    # werkzeug fills in default parameters, so hash once to learn them
+    global _current_prefix
+    if _current_prefix is None:
+        _current_prefix = method_prefix(generate_password_hash('', PASSWORD_HASH_METHOD, PASSWORD_SALT_LENGTH))
+    return _current_prefix
+
+
+async def _run(func, *args):
+    try:
+        await asyncio.wait_for(_slots.acquire(), PASSWORD_HASH_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HasherBusy()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+    finally:
+        _slots.release()
+
+
+async def hash_password(password):
+    return await _run(generate_password_hash, password, PASSWORD_HASH_METHOD, PASSWORD_SALT_LENGTH)
+
+
+async def verify_password(password_hash, password):
+    return await _run(check_password_hash, password_hash, password)
+
+
+async def needs_rehash(password_hash):
+    """Whether a stored hash was made with other parameters than the configured ones"""
+    prefix = _current_prefix or await _run(current_prefix)
+    return method_prefix(password_hash) != prefix
@@ -13,6 +13,8 @@ const AdminDashboard = () => {
   // Data
   const [telemetry, setTelemetry] = useState(null);
   const [logs, setLogs] = useState([]);
+  const [logsCursor, setLogsCursor] = useState(null);
+  const [logsTotal, setLogsTotal] = useState(null);
   const [users, setUsers] = useState([]);
   const [models, setModels] = useState([]);
 
@@ -49,15 +51,19 @@ const AdminDashboard = () => {
     }
   };
 
-  const fetchLogs = async () => {
+  const fetchLogs = async (cursor = null) => {
     setLoading(true);
     try {
       const params = new URLSearchParams({
         limit: logFilter.limit,
-        ...(logFilter.action && { action: logFilter.action })
+        ...(logFilter.action && { action: logFilter.action }),
+        ...(cursor && { cursor })
       });
       const response = await axios.get(`/api/admin/logs?${params}`);
-      setLogs(response.data.logs || []);
+      const page = response.data.logs || [];
+      setLogs(prev => cursor ? [...prev, ...page] : page);
+      setLogsCursor(response.data.next_cursor);
+      setLogsTotal(response.data.total);
       setError('');
     } catch (err) {
       setError(err.response?.data?.detail || err.message);
@@ -215,7 +221,8 @@ const AdminDashboard = () => {
                   <option value="chat_request">Chat Request</option>
                   <option value="user_registered">User Registered</option>
                 </select>
-                <button className="refresh-btn" onClick={fetchLogs}><RefreshCw /> Search</button>
+                <button className="refresh-btn" onClick={() => fetchLogs()}><RefreshCw /> Search</button>
+                {logsTotal !== null && <span className="logs-total">{logs.length} of ~{logsTotal}</span>}
               </div>
               <div className="scrollable-table">
                 <table>
@@ -236,6 +243,9 @@ const AdminDashboard = () => {
                   </tbody>
                 </table>
               </div>
+              {logsCursor && (
+                <button className="refresh-btn" onClick={() => fetchLogs(logsCursor)} disabled={loading}>Load more</button>
+              )}
             </div>
           )}
 
@@ -6,6 +6,7 @@ const ChatPage = () => {
   const [messages, setMessages] = useState([]);
   const [input, setInput] = useState('');
   const [isLoading, setIsLoading] = useState(false);
+  const [isStreaming, setIsStreaming] = useState(false);
   const [sessions, setSessions] = useState([]);
   const [currentSession, setCurrentSession] = useState(null);
   const [selectedModel, setSelectedModel] = useState('gemma2:2b');
@@ -37,7 +38,7 @@ const ChatPage = () => {
   const loadSessions = async () => {
     try {
       const response = await axios.get('/api/chat/threads');
-      setSessions(response.data || []);
+      setSessions(response.data.threads || []);
     } catch (error) {
       console.error('Failed to load sessions:', error);
     }
@@ -79,37 +80,88 @@ const ChatPage = () => {
     setIsLoading(true);
 
     try {
-      // Backend expects: { prompt, thread_id?, model? }
-      const response = await axios.post('/api/chat', {
-        prompt: userMessage.content,
-        thread_id: currentSession,
-        model: selectedModel
+      // Backend expects: { prompt, thread_id?, model? } and answers with Server-Sent Events
+      const response = await fetch('/api/chat/stream', {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          Authorization: axios.defaults.headers.common['Authorization']
+        },
+        body: JSON.stringify({
+          prompt: userMessage.content,
+          thread_id: currentSession,
+          model: selectedModel
+        })
       });
 
-      // Backend returns: { response, thread_id }
-      const assistantMessage = {
-        role: 'assistant',
-        content: response.data.response,
-        timestamp: new Date().toISOString()
+      if (!response.ok) {
+        const errorData = await response.json().catch(() => ({}));
+        throw new Error(errorData.detail || 'Failed to send message. Please try again.');
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let started = false;
+      let threadId = currentSession;
+
+      const appendToken = (content) => {
+        if (!started) {
+          started = true;
+          setIsStreaming(true);
+          setMessages(prev => [...prev, {
+            role: 'assistant',
+            content,
+            timestamp: new Date().toISOString()
+          }]);
+          return;
+        }
+        setMessages(prev => {
+          const last = prev[prev.length - 1];
+          return [...prev.slice(0, -1), { ...last, content: last.content + content }];
+        });
       };
 
-      setMessages(prev => [...prev, assistantMessage]);
-      
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line: "event: <name>\ndata: <json>\n\n"
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+          const frame = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+
+          const event = frame.match(/^event: (.*)$/m)?.[1];
+          const data = JSON.parse(frame.match(/^data: (.*)$/m)?.[1] || '{}');
+
+          if (event === 'thread') {
+            threadId = data.thread_id;
+          } else if (event === 'token') {
+            appendToken(data.content);
+          } else if (event === 'error') {
+            throw new Error(data.detail);
+          }
+        }
+      }
+
       // Update current session if new
-      if (!currentSession && response.data.thread_id) {
-        setCurrentSession(response.data.thread_id);
+      if (!currentSession && threadId) {
+        setCurrentSession(threadId);
         loadSessions(); // Refresh session list
       }
     } catch (error) {
       console.error('Chat error:', error);
       const errorMessage = {
         role: 'error',
-        content: error.response?.data?.detail || 'Failed to send message. Please try again.',
+        content: error.message || 'Failed to send message. Please try again.',
         timestamp: new Date().toISOString()
       };
       setMessages(prev => [...prev, errorMessage]);
     } finally {
       setIsLoading(false);
+      setIsStreaming(false);
     }
   };
 
@@ -203,7 +255,7 @@ const ChatPage = () => {
                   </div>
                 </div>
               ))}
-              {isLoading && (
+              {isLoading && !isStreaming && (
                 <div className="message message-assistant">
                   <div className="message-avatar">🤖</div>
                   <div className="message-content">
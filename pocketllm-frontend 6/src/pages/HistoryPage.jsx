@@ -4,6 +4,7 @@ import './HistoryPage.css';
 
 const HistoryPage = () => {
   const [sessions, setSessions] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [selectedSession, setSelectedSession] = useState(null);
   const [searchQuery, setSearchQuery] = useState('');
   const [filterDate, setFilterDate] = useState('all');
@@ -13,11 +14,12 @@ const HistoryPage = () => {
     loadSessions();
   }, []);
 
-  const loadSessions = async () => {
-    setLoading(true);
+  const loadSessions = async (cursor = null) => {
+    if (!cursor) setLoading(true);
     try {
-      const response = await axios.get('/api/chat/threads');
-      setSessions(response.data);
+      const response = await axios.get('/api/chat/threads', { params: cursor ? { cursor } : {} });
+      setSessions(prev => cursor ? [...prev, ...response.data.threads] : response.data.threads);
+      setNextCursor(response.data.next_cursor);
     } catch (error) {
       console.error('Failed to load sessions:', error);
     } finally {
@@ -34,6 +36,21 @@ const HistoryPage = () => {
     }
   };
 
+  const loadEarlierMessages = async () => {
+    try {
+      const response = await axios.get(`/api/chat/threads/${selectedSession.id}`, {
+        params: { cursor: selectedSession.next_cursor }
+      });
+      setSelectedSession(prev => ({
+        ...prev,
+        messages: [...response.data.messages, ...prev.messages],
+        next_cursor: response.data.next_cursor
+      }));
+    } catch (error) {
+      console.error('Failed to load earlier messages:', error);
+    }
+  };
+
   const deleteSession = async (sessionId) => {
     alert('Delete functionality not available in this backend version.');
     // Backend doesn't support DELETE /api/chat/threads/{id}
@@ -46,7 +63,7 @@ const HistoryPage = () => {
     if (searchQuery) {
       filtered = filtered.filter(session =>
         session.title?.toLowerCase().includes(searchQuery.toLowerCase()) ||
-        session.messages?.some(m => m.content.toLowerCase().includes(searchQuery.toLowerCase()))
+        session.last_message?.toLowerCase().includes(searchQuery.toLowerCase())
       );
     }
 
@@ -144,7 +161,7 @@ const HistoryPage = () => {
                       {session.title || `Conversation ${session.id.slice(0, 8)}`}
                     </div>
                     <div className="session-preview">
-                      {session.messages?.[0]?.content.slice(0, 60)}...
+                      {session.last_message?.slice(0, 60)}...
                     </div>
                     <div className="session-meta">
                       <span className="session-date">{formatDate(session.updated_at)}</span>
@@ -154,6 +171,11 @@ const HistoryPage = () => {
                 </div>
               ))
             )}
+            {!loading && nextCursor && (
+              <button className="load-more-btn" onClick={() => loadSessions(nextCursor)}>
+                Load more
+              </button>
+            )}
           </div>
         </div>
 
@@ -174,11 +196,16 @@ const HistoryPage = () => {
                 <div className="details-meta">
                   <span>Created: {new Date(selectedSession.created_at).toLocaleString()}</span>
                   <span>Updated: {new Date(selectedSession.updated_at).toLocaleString()}</span>
-                  <span>Messages: {selectedSession.messages.length}</span>
+                  <span>Messages: {selectedSession.message_count}</span>
                 </div>
               </div>
 
               <div className="messages-container">
+                {selectedSession.next_cursor && (
+                  <button className="load-more-btn" onClick={loadEarlierMessages}>
+                    Load earlier messages
+                  </button>
+                )}
                 {selectedSession.messages.map((message, idx) => (
                   <div key={idx} className={`message message-${message.role}`}>
                     <div className="message-header">
@@ -0,0 +1,208 @@
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from metrics import Histogram, http_requests, http_latency
+
+# Per-request stage timing.
+#
+# The middleware gives every request a Timings object through a context
+# variable; `span(name)` adds the time spent in a block to it. FastAPI runs
+# dependencies, the endpoint and streaming bodies in copies of the request
+# context, and since they all share the same Timings object every stage ends
+# up in one place. The stages go out in the Server-Timing header and, once
+# the response is complete, into per-endpoint histograms.
+
+_timings = ContextVar('timings', default=None)
+
+
+class Timings:
+    __slots__ = ('started', 'stages')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def header(self):
+        stages = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.stages.items()]
+        stages.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.2f}")
+        return ', '.join(stages)
+
+
+@contextmanager
+def span(name):
+    """Time a block as stage `name` of the current request (no-op outside a request)"""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+class StageStats:
+    """Latency histograms per (endpoint, stage), including the request total"""
+
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def observe(self, endpoint, stages):
+        for stage, seconds in stages.items():
+            histogram = self.histograms.get((endpoint, stage))
+            if histogram is None:
+                with self.lock:
+                    histogram = self.histograms.setdefault((endpoint, stage), Histogram())
+            histogram.observe(seconds)
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+
+    def stats(self):
+        endpoints = {}
+        for (endpoint, stage), histogram in sorted(self.histograms.items()):
+            endpoints.setdefault(endpoint, {})[stage] = histogram.summary(scale=1000)
+        return endpoints
+
+
+stage_stats = StageStats()
+
+
+class TimingMiddleware:
+    """ASGI middleware adding a Server-Timing header and recording stage latencies.
+
+    Written against raw ASGI rather than BaseHTTPMiddleware so streamed
+    responses pass through untouched. For a stream the header carries the
+    stages up to the first byte; the histograms get the full request. It
+    also feeds the request counters and latency histograms of /metrics.
+    """
+
+    def __init__(self, app, header=True):
+        self.app = app
+        self.header = header
+        self.routes = {}
+
+    def route(self, scope):
+        # Starlette leaves the matched endpoint in the scope; report its path
+        # template so /api/chat/threads/{thread_id} is one series
+        handler = scope.get('endpoint')
+        if handler is not None and handler not in self.routes:
+            for route in getattr(scope.get('app'), 'routes', ()):
+                if getattr(route, 'endpoint', None) is handler:
+                    self.routes[handler] = route.path
+                    break
+        return self.routes.get(handler, 'unmatched')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        timings = Timings()
+        token = _timings.set(timings)
+        response = {'status': 500}  # if the app fails before responding
+
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                if self.header:
+                    headers = list(message.get('headers', []))
+                    headers.append((b'server-timing', timings.header().encode()))
+                    message = {**message, 'headers': headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timings.reset(token)
+            total = time.perf_counter() - timings.started
+            timings.stages['total'] = total
+            route, method = self.route(scope), scope['method']
+            stage_stats.observe(f"{method} {route}", timings.stages)
+            http_requests.inc((route, method, str(response['status'])))
+            http_latency.observe(total, (route, method))
+
+
+class SamplingProfiler:
+    """Statistical profiler for the event loop thread, started and stopped at runtime.
+
+    A background thread snapshots the loop thread's stack every `interval`
+    seconds and counts identical stacks, which come out in the collapsed
+    "frame;frame;frame count" format flame graph tools read. Only the
+    sampler thread does work, so the overhead is one stack walk per sample.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopping = threading.Event()
+        self.stacks = Counter()
+        self.samples = 0
+        self.interval = None
+        self.started_at = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, interval=0.005, target=None):
+        """Start sampling the thread `target` (default: the calling thread)"""
+        with self.lock:
+            if self.running:
+                return False
+            self.stacks = Counter()
+            self.samples = 0
+            self.interval = interval
+            self.started_at = time.time()
+            self.stopping.clear()
+            target = target or threading.get_ident()
+            self.thread = threading.Thread(target=self._sample, args=(target,), name='sampling-profiler', daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self):
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is None:
+            return False
+        self.stopping.set()
+        thread.join()
+        return True
+
+    def _sample(self, target):
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(target)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]})")
+                frame = frame.f_back
+            with self.lock:
+                self.stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+
+    def report(self, top=50):
+        with self.lock:
+            stacks = self.stacks.most_common(top)
+        return {
+            'running': self.running,
+            'interval_ms': self.interval * 1000 if self.interval else None,
+            'started_at': self.started_at,
+            'samples': self.samples,
+            'stacks': [{'stack': stack, 'samples': count} for stack, count in stacks],
+            'collapsed': '\n'.join(f"{stack} {count}" for stack, count in stacks)
+        }
+
+
+profiler = SamplingProfiler()
@@ -47,6 +47,12 @@ class UpdateUserRoleRequest(BaseModel):
 class UpdateUserStatusRequest(BaseModel):
     is_active: bool
 
+# Response cache schemas
+class UpdateCacheConfigRequest(BaseModel):
+    model: Optional[str] = None  # all models when omitted
+    size: Optional[int] = None
+    threshold: Optional[float] = None
+
 # Database query schemas
 class DatabaseQueryRequest(BaseModel):
     type: str